@@ -1 +1,2 @@
-from .minimax import generate_move_minimax as gen_move_minimax
\ No newline at end of file
+from .minimax import generate_move_minimax as gen_move_minimax
+from .minimax import generate_moves_minimax_batch
@@ -1,12 +1,259 @@
 import numpy as np
 import math
-from typing import Optional, Tuple
-from agents.common import PlayerAction, SavedState, BoardPiece, PLAYER1, PLAYER2, connected_four,ROWS, \
-    COLUMNS,apply_player_action, \
-    check_end_state, GameState
+import os
 import random
+import time
+import weakref
+from enum import Enum
+from typing import Callable, List, Optional, Tuple
+from agents.common import PlayerAction, SavedState, BoardPiece, ROWS, COLUMNS, BitBoard, WINDOW_INDICES, \
+    BITS_PER_COLUMN, run_profiled, mirror_column, get_process_pool, CENTRE_ORDER, NO_PLAYER, boards_to_masks, \
+    connected_masks, valid_columns_batch
 
 WINDOW_LENGTH = 4
+CENTER_WEIGHT = 3
+MOVE_TIME = 1.0  # seconds per move for the iterative deepening search
+TT_SIZE = 1 << 18
+BATCH_DEPTH = 3  # plies searched by the batch move generation
+KILLER_SLOTS = 2
+CENTRE_RANK = [CENTRE_ORDER.index(col) for col in range(COLUMNS)]
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside minimax when the deadline of the search has passed.
+    """
+
+
+class Bound(Enum):
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+
+class TranspositionTable:
+    """
+    Fixed size table of search results indexed by BitBoard.canonical_key(), so a position and
+    its mirror image share an entry. Every slot keeps the full key, the search depth, the
+    value, the bound type and the best move, in the frame of the canonical key. A slot is
+    overwritten when it is empty, was written during an earlier search, or the new result
+    comes from a search at least as deep as the stored one.
+    """
+
+    def __init__(self, size: int = TT_SIZE):
+        self.size = size
+        self.keys = [None] * size
+        self.depths = [0] * size
+        self.values = [0.] * size
+        self.bounds = [Bound.EXACT] * size
+        self.moves = [None] * size
+        self.ages = [0] * size
+        self.age = 0
+
+    def new_search(self):
+        """
+        Marks all stored entries as coming from an earlier search, so they are replaced first.
+        """
+        self.age += 1
+
+    def probe(self, key: int):
+        """
+        Returns (depth, value, bound, move) stored for `key`, or None if it is not in the table.
+        """
+        slot = key % self.size
+        if self.keys[slot] != key:
+            return None
+        return self.depths[slot], self.values[slot], self.bounds[slot], self.moves[slot]
+
+    def store(self, key: int, depth: int, value, bound: Bound, move):
+        slot = key % self.size
+        if self.keys[slot] is not None and self.ages[slot] == self.age and self.depths[slot] > depth:
+            return
+        self.keys[slot] = key
+        self.depths[slot] = depth
+        self.values[slot] = value
+        self.bounds[slot] = bound
+        self.moves[slot] = move
+        self.ages[slot] = self.age
+
+
+def _shared_memory_dir() -> Optional[str]:
+    return '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+class SharedTranspositionTable:
+    """
+    TranspositionTable in a memory-mapped file, shared by the processes of a parallel search.
+    A pickled table attaches to the same file, the file is removed with the table that
+    created it. Every slot holds one entry packed into a 64-bit word and a check word, the
+    key xor the entry; processes write without locks, and an entry torn by two writers is
+    detected by the check and treated as missing. The table of a helper process raises
+    SearchTimeout on the next store after `stop` was called, so all helpers stop together.
+    Entries are packed as depth (8 bits), bound (2), move (4, 15 for None), age (8) and the
+    value, an integer or +-inf, in the upper 32 bits.
+    """
+    _VALUE_OFFSET = 1 << 31
+    _INF = (1 << 32) - 1
+
+    def __init__(self, size: int = TT_SIZE, path: Optional[str] = None):
+        self.size = size
+        self.raise_on_stop = False
+        if path is None:
+            import tempfile
+
+            fd, path = tempfile.mkstemp(prefix='minimax-tt-', dir=_shared_memory_dir())
+            os.close(fd)
+            mode = 'w+'
+            weakref.finalize(self, os.remove, path)
+        else:
+            mode = 'r+'
+        self.path = path
+        words = np.memmap(path, dtype=np.uint64, mode=mode, shape=(2 + 2 * size,))
+        self.header = words[:2]  # age of the current search, stop flag
+        self.checks = words[2:2 + size]
+        self.entries = words[2 + size:]
+
+    def __getstate__(self):
+        return {'size': self.size, 'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['size'], state['path'])
+
+    @property
+    def age(self) -> int:
+        return int(self.header[0])
+
+    def new_search(self):
+        self.header[0] += np.uint64(1)
+        self.header[1] = 0
+
+    def stop(self):
+        self.header[1] = 1
+
+    def probe(self, key: int):
+        slot = key % self.size
+        entry = int(self.entries[slot])
+        if not entry or int(self.checks[slot]) ^ entry != key:
+            return None
+        move = (entry >> 10) & 15
+        value = entry >> 32
+        if value == self._INF:
+            value = math.inf
+        elif value == 0:
+            value = -math.inf
+        else:
+            value -= self._VALUE_OFFSET
+        return entry & 255, value, Bound((entry >> 8) & 3), None if move == 15 else move
+
+    def store(self, key: int, depth: int, value, bound: Bound, move):
+        if self.raise_on_stop and self.header[1]:
+            raise SearchTimeout
+        slot = key % self.size
+        age = self.age & 255
+        old = int(self.entries[slot])
+        if old and (old >> 14) & 255 == age and old & 255 > depth:
+            return
+        if value == math.inf:
+            value = self._INF
+        elif value == -math.inf:
+            value = 0
+        else:
+            value = int(value) + self._VALUE_OFFSET
+        entry = value << 32 | age << 14 | (15 if move is None else move) << 10 | bound.value << 8 | depth
+        self.entries[slot] = entry
+        self.checks[slot] = key ^ entry
+
+
+class MoveOrdering:
+    """
+    Move ordering heuristics of a search. Columns are tried centre first, after the
+    transposition table move and the killer moves of the ply, i.e. the last KILLER_SLOTS moves
+    that caused a cutoff at the same distance from the root, and in the order of the history
+    table, which scores every (player, cell) move by the squared depth of the cutoffs it caused.
+    A `seed` swaps some neighbours in the centre first order at random, so that the helpers of
+    a parallel search explore the moves in different orders.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.killers = [[] for _ in range(ROWS * COLUMNS + 1)]
+        self.history = [0] * (2 * BITS_PER_COLUMN * COLUMNS)
+        self.rank = CENTRE_RANK
+        if seed is not None:
+            rng = random.Random(seed)
+            order = CENTRE_ORDER[:]
+            for i in range(len(order) - 1):
+                if rng.random() < 0.5:
+                    order[i], order[i + 1] = order[i + 1], order[i]
+            self.rank = [order.index(col) for col in range(COLUMNS)]
+
+    def new_search(self):
+        """
+        Forgets the killer moves and halves the history scores, so that older searches count less.
+        """
+        for killers in self.killers:
+            killers.clear()
+        self.history = [score >> 1 for score in self.history]
+
+    def order(self, position: BitBoard, columns: list, tt_move=None) -> list:
+        """
+        Returns the `columns` playable in `position` in the order they should be searched.
+        """
+        killers = self.killers[len(position.moves)]
+        history = self.history
+        offset = (position.turn & 1) * BITS_PER_COLUMN * COLUMNS
+        heights = position.heights
+        rank = self.rank
+        return sorted(columns, key=lambda col: (col != tt_move, col not in killers,
+                                                -history[offset + heights[col]], rank[col]))
+
+    def cutoff(self, position: BitBoard, col: int, depth: int):
+        """
+        Records that playing `col` in `position` caused a cutoff in a search of `depth`.
+        """
+        killers = self.killers[len(position.moves)]
+        if col not in killers:
+            killers.insert(0, col)
+            del killers[KILLER_SLOTS:]
+        self.history[(position.turn & 1) * BITS_PER_COLUMN * COLUMNS + position.heights[col]] += depth * depth
+
+
+class MinimaxStats:
+    """
+    Counters of one minimax search, collected when a stats object is passed to the search.
+    depth_times holds (depth, seconds) for every completed iteration of iterative deepening,
+    profile the pstats.Stats of the move if it was profiled.
+    """
+
+    def __init__(self):
+        self.nodes = 0
+        self.cutoffs = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.forced = 0  # nodes decided or narrowed down by their immediate threats
+        self.depth_times = []
+        self.depth = 0
+        self.time = 0.
+        self.profile = None
+
+    @property
+    def nodes_per_second(self) -> float:
+        return self.nodes / self.time if self.time else 0.
+
+    def __repr__(self):
+        return (f'MinimaxStats(depth={self.depth}, nodes={self.nodes}, cutoffs={self.cutoffs}, '
+                f'tt_hits={self.tt_hits}/{self.tt_probes}, time={self.time:.3f}s)')
+
+
+class MinimaxSavedState(SavedState):
+    """
+    Keeps the transposition table and the move ordering of the minimax agent between moves.
+    """
+
+    def __init__(self, player: BoardPiece, tt_size: int = TT_SIZE):
+        self.player = player
+        self.tt = TranspositionTable(tt_size)
+        self.ordering = MoveOrdering()
 
 
 def window_value(window, player: BoardPiece):
@@ -24,135 +271,443 @@ def window_value(window, player: BoardPiece):
     else:
         opp_player = BoardPiece(1)
 
-        if window.count(player) == 4:
-            heuristic_value += 1000
-        elif window.count(player) == 3 and window.count(BoardPiece(0)) == 1:
-            heuristic_value += 10
-        elif window.count(player) == 2 and window.count(BoardPiece(0)) == 2:
-            heuristic_value += 5
-        if window.count(opp_player) == 3 and window.count(BoardPiece(0)) == 1:
-            heuristic_value -= 90
-        elif window.count(opp_player) == 2 and window.count(BoardPiece(0)) == 2:
-            heuristic_value -= 20
+    if window.count(player) == 4:
+        heuristic_value += 1000
+    elif window.count(player) == 3 and window.count(BoardPiece(0)) == 1:
+        heuristic_value += 10
+    elif window.count(player) == 2 and window.count(BoardPiece(0)) == 2:
+        heuristic_value += 5
+    if window.count(opp_player) == 3 and window.count(BoardPiece(0)) == 1:
+        heuristic_value -= 90
+    elif window.count(opp_player) == 2 and window.count(BoardPiece(0)) == 2:
+        heuristic_value -= 20
 
-        return heuristic_value
+    return heuristic_value
 
 
-def board_heuristic(board: np.ndarray, player: BoardPiece):
+def _window_score_table() -> np.ndarray:
+    """
+    Returns the window_value of a window as a table indexed by
+    (pieces of the player) * (WINDOW_LENGTH + 1) + (pieces of the opponent).
     """
+    table = np.zeros((WINDOW_LENGTH + 1) ** 2, dtype=np.int64)
+    for own in range(WINDOW_LENGTH + 1):
+        for other in range(WINDOW_LENGTH + 1 - own):
+            window = [1] * own + [2] * other + [0] * (WINDOW_LENGTH - own - other)
+            table[own * (WINDOW_LENGTH + 1) + other] = window_value(window, BoardPiece(1))
+    return table
 
-    :param board: Contains current state of the board an ndarray, shape (ROWS, COLUMNS) and data type (dtype) BoardPiece
-    :param player: Current player playing the game of type BoardPiece
-    :return: heuristic_value: heuristic value of the column of type float
 
+WINDOW_SCORES = _window_score_table()
+# the bits of the cells of WINDOW_INDICES and of the centre column in a BitBoard mask
+WINDOW_BITS = WINDOW_INDICES % COLUMNS * BITS_PER_COLUMN + WINDOW_INDICES // COLUMNS
+CENTRE_BITS = COLUMNS // 2 * BITS_PER_COLUMN + np.arange(ROWS)
+
+
+def board_heuristic(board: np.ndarray, player):
     """
-    heuristic_value = 0
 
-    # Horizontal
-    for r in range(ROWS):
-        row_array = [int(i) for i in list(board[r, :])]
-        for c in range(COLUMNS - 3):
-            window = row_array[c:c + WINDOW_LENGTH]
-            heuristic_value += window_value(window, player)
-
-    # Vertical
-    for c in range(COLUMNS):
-        col_array = [int(i) for i in list(board[:, c])]
-        for r in range(ROWS - 3):
-            window = col_array[r:r + WINDOW_LENGTH]
-            heuristic_value += window_value(window, player)
-
-    # center column
-    center_array = [int(i) for i in list(board[:, COLUMNS // 2])]
-    center_count = center_array.count(player)
-    heuristic_value += center_count * 3
-
-    # Diagonal element
-    for r in range(ROWS - 3):
-        for c in range(COLUMNS - 3):
-            window = [board[r + i][c + i] for i in range(WINDOW_LENGTH)]
-            heuristic_value += window_value(window, player)
-
-    for r in range(ROWS - 3):
-        for c in range(COLUMNS - 3):
-            window = [board[r + 3 - i][c + i] for i in range(WINDOW_LENGTH)]
-            heuristic_value += window_value(window, player)
+    :param board: Contains current state of the board an ndarray, shape (ROWS, COLUMNS), or a stack
+                  of boards, shape (N, ROWS, COLUMNS), of data type (dtype) BoardPiece
+    :param player: Player the value is computed for of type BoardPiece, or an ndarray of shape
+                   (N,) holding the player of every board in the stack
+    :return: heuristic_value: heuristic value of the board of type int, or an ndarray of shape (N,)
+                              holding the value of every board in the stack
 
+    """
+    boards = board.reshape(-1, ROWS * COLUMNS)
+    players = np.asarray(player, dtype=BoardPiece).reshape(-1, 1)
+    own = boards == players
+    other = (boards != players) & (boards != NO_PLAYER)
+    windows = (own[:, WINDOW_INDICES].sum(axis=2) * (WINDOW_LENGTH + 1)
+               + other[:, WINDOW_INDICES].sum(axis=2))
+    heuristic_value = WINDOW_SCORES[windows].sum(axis=1)
+    heuristic_value += own.reshape(-1, ROWS, COLUMNS)[:, :, COLUMNS // 2].sum(axis=1) * CENTER_WEIGHT
+    if board.ndim == 2:
+        return int(heuristic_value[0])
     return heuristic_value
 
 
-def minimax(depth: int, board: np.ndarray, player: BoardPiece, alpha, beta, maximizing=True):
+def mask_heuristic(masks: np.ndarray) -> np.ndarray:
+    """
+    board_heuristic of positions given as bitboards, without building their boards.
+
+    :param masks: ndarray of shape (N, 2) and dtype uint64, the pieces of the player the value is
+                  computed for and the pieces of the opponent in every position
+    :return: heuristic_value: ndarray of shape (N,) holding the value of every position
+    """
+    bits = np.unpackbits(np.ascontiguousarray(masks, dtype='<u8').view(np.uint8).reshape(-1, 2, 8),
+                         axis=2, bitorder='little')
+    windows = (bits[:, 0, WINDOW_BITS].sum(axis=2, dtype=np.int64) * (WINDOW_LENGTH + 1)
+               + bits[:, 1, WINDOW_BITS].sum(axis=2, dtype=np.int64))
+    heuristic_value = WINDOW_SCORES[windows].sum(axis=1)
+    heuristic_value += bits[:, 0, CENTRE_BITS].sum(axis=1, dtype=np.int64) * CENTER_WEIGHT
+    return heuristic_value
+
+
+def leaf_values(position: BitBoard, player: BoardPiece, columns) -> list:
+    """
+    Returns the values of the positions after playing each of `columns`, seen from `player`.
+    Winning moves and moves filling the board are scored directly, the bitboards of all other
+    children are stacked and scored by a single mask_heuristic call.
+    """
+    mover = position.player
+    own = int(player) - 1
+    values = [None] * len(columns)
+    masks, index = [], []
+    for i, col in enumerate(columns):
+        position.play(col)
+        if position.last_move_won():
+            values[i] = math.inf if mover == player else -math.inf
+        elif position.is_full():
+            values[i] = 0
+        else:
+            masks.append((position.masks[own], position.masks[own ^ 1]))
+            index.append(i)
+        position.undo()
+    if index:
+        for i, value in zip(index, mask_heuristic(np.array(masks, dtype=np.uint64)).tolist()):
+            values[i] = value
+    return values
+
+
+def minimax(depth: int, position: BitBoard, player: BoardPiece, alpha, beta, maximizing=True,
+            tt: Optional[TranspositionTable] = None, deadline: Optional[float] = None,
+            stats: Optional[MinimaxStats] = None, ordering: Optional[MoveOrdering] = None):
     """
 
     :param depth: depth of the tree search of type int
-    :param board: Contains current state of the board an ndarray, shape (ROWS, COLUMNS) and data type (dtype) BoardPiece
-    :param player: Current player playing the game of type BoardPiece
+    :param position: Contains current state of the board as a BitBoard, searched in place with play/undo
+    :param player: Player the heuristic value is computed for (the maximizing player) of type BoardPiece
     :param alpha: Alpha value for alpha-beta pruning of type float
     :param beta: Beta value for alpha-beta pruning of type float
     :param maximizing: A boolean value to switch between maximising and minimising heuristic_value
+    :param tt: Optional transposition table, values are stored from the view of `player`
+    :param deadline: Optional time.perf_counter() value after which SearchTimeout is raised
+    :param stats: Optional MinimaxStats the node, cutoff and transposition table counts are added to
+    :param ordering: Optional MoveOrdering, without it columns are searched left to right after
+                     the transposition table move
     :return: column : the column to be played by the agent of type int
             value : the heuristic value of the board
 
     """
-    board_copy = np.copy(board)
-    valid_columns = []
-    for col in range(COLUMNS):
-        if board[ROWS - 1][col] == 0:
-            valid_columns.append(col)
+    if deadline is not None and time.perf_counter() > deadline:
+        raise SearchTimeout
+    if stats is not None:
+        stats.nodes += 1
+    if position.last_move_won():
+        return None, (-math.inf if position.player == player else math.inf)
+    valid_columns = position.valid_columns()
+    if len(valid_columns) == 0:
+        return None, 0
+    if depth == 0:
+        own = int(player) - 1
+        return None, int(mask_heuristic(np.array([(position.masks[own], position.masks[own ^ 1])],
+                                                 dtype=np.uint64))[0])
+    threats = position.threats()
+    if threats.own_wins:
+        if stats is not None:
+            stats.forced += 1
+        return threats.own_wins[0], (math.inf if maximizing else -math.inf)
+    if len(threats.opponent_wins) > 1:
+        # only one of the opponent's wins can be blocked
+        if stats is not None:
+            stats.forced += 1
+        return threats.opponent_wins[0], (-math.inf if maximizing else math.inf)
+    replies = threats.replies(valid_columns)
+    if stats is not None and len(replies) < len(valid_columns):
+        stats.forced += 1
+    valid_columns = replies
+    if position.is_symmetric():
+        # mirrored moves lead to mirrored positions of the same value
+        valid_columns = [col for col in valid_columns if col <= COLUMNS // 2]
+
+    alpha_orig, beta_orig = alpha, beta
+    tt_move = None
+    if tt is not None:
+        key, mirrored = position.canonical_key()
+        entry = tt.probe(key)
+        if stats is not None:
+            stats.tt_probes += 1
+            stats.tt_hits += entry is not None
+        if entry is not None:
+            entry_depth, entry_value, entry_bound, entry_move = entry
+            if entry_depth >= depth:
+                if entry_bound == Bound.EXACT:
+                    if stats is not None:
+                        stats.tt_cutoffs += 1
+                    return (mirror_column(entry_move) if mirrored else entry_move), entry_value
+                if entry_bound == Bound.LOWER:
+                    alpha = max(alpha, entry_value)
+                else:
+                    beta = min(beta, entry_value)
+                if alpha >= beta:
+                    if stats is not None:
+                        stats.tt_cutoffs += 1
+                    return (mirror_column(entry_move) if mirrored else entry_move), entry_value
+            if entry_move is not None:
+                tt_move = mirror_column(entry_move) if mirrored else entry_move
+    if ordering is not None:
+        valid_columns = ordering.order(position, valid_columns, tt_move)
+    elif tt_move in valid_columns:
+        valid_columns.remove(tt_move)
+        valid_columns.insert(0, tt_move)
 
-    if depth == 0 or check_end_state(board,player).name == GameState.IS_WIN or len(valid_columns) == 0:
-        if check_end_state(board, player).name == GameState.IS_WIN or len(valid_columns) == 0:
-            if connected_four(board_copy, BoardPiece(2)):
-                return None, math.inf
-            elif connected_four(board_copy, BoardPiece(1)):
-                return None, -math.inf
-            else:
-                return None, 0
-        else: 
-            return None, board_heuristic(board_copy, BoardPiece(2))
+    if depth == 1:
+        # all children are leaves: score them together instead of one recursive call each
+        values = leaf_values(position, player, valid_columns)
+        if stats is not None:
+            stats.nodes += len(valid_columns)
+        value = max(values) if maximizing else min(values)
+        column = valid_columns[values.index(value)]
+        if tt is not None:
+            tt.store(key, depth, value, Bound.EXACT, mirror_column(column) if mirrored else column)
+        return column, value
 
+    # the first column searched is the best guess, it is kept when all columns lose (or all win)
+    column = valid_columns[0]
     if maximizing:
         value = -math.inf
-        column = random.choice(valid_columns)
         for col in valid_columns:
-            board_copy = np.copy(board)
-            value_temp = minimax(depth - 1, board_copy, player, alpha, beta, False)[1]
+            position.play(col)
+            value_temp = minimax(depth - 1, position, player, alpha, beta, False, tt, deadline, stats, ordering)[1]
+            position.undo()
             if value_temp > value:
                 value = value_temp
                 column = col
             alpha = max(alpha, value)
             if alpha >= beta:
+                if stats is not None:
+                    stats.cutoffs += 1
+                if ordering is not None:
+                    ordering.cutoff(position, col, depth)
                 break
-        return column, value
     else:
         value = math.inf
-        column = random.choice(valid_columns)
         for col in valid_columns:
-            board_copy = np.copy(board)
-            value_temp = minimax(depth - 1, board_copy, player, alpha, beta, True)[1]
+            position.play(col)
+            value_temp = minimax(depth - 1, position, player, alpha, beta, True, tt, deadline, stats, ordering)[1]
+            position.undo()
             if value_temp < value:
                 value = value_temp
                 column = col
             beta = min(beta, value)
             if beta <= alpha:
+                if stats is not None:
+                    stats.cutoffs += 1
+                if ordering is not None:
+                    ordering.cutoff(position, col, depth)
                 break
-        return column, value
 
+    if tt is not None:
+        if value <= alpha_orig:
+            bound = Bound.UPPER
+        elif value >= beta_orig:
+            bound = Bound.LOWER
+        else:
+            bound = Bound.EXACT
+        tt.store(key, depth, value, bound, mirror_column(column) if mirrored else column)
+    return column, value
 
-def generate_move_minimax(board: np.ndarray, player: BoardPiece, saved_state: Optional[SavedState]
-                          ) -> Tuple[PlayerAction, Optional[SavedState]]:
+
+def iterative_deepening(position: BitBoard, player: BoardPiece, tt: TranspositionTable,
+                        deadline: Optional[float], max_depth: int = ROWS * COLUMNS,
+                        stats: Optional[MinimaxStats] = None, ordering: Optional[MoveOrdering] = None,
+                        start_depth: int = 1):
+    """
+
+    :param position: Contains current state of the board as a BitBoard
+    :param player: Player to move and maximize for of type BoardPiece
+    :param tt: Transposition table, carries the best moves of one depth over as the first
+               moves to try at the next depth
+    :param deadline: time.perf_counter() value at which the search stops, None to search to max_depth
+    :param max_depth: Deepest search to run
+    :param stats: Optional MinimaxStats, also gets the time taken by every completed depth
+    :param ordering: Optional MoveOrdering shared by all depths
+    :param start_depth: Depth of the first search, only depth 1 runs without the deadline
+    :return: column : the best column of the deepest completed search, None if no search completed
+            value : the value of that search
+            depth : the depth of that search
+
+    """
+    moves_played = len(position.moves)
+    column, value, completed_depth = None, 0, 0
+    max_depth = min(max_depth, ROWS * COLUMNS - position.num_pieces())
+    for depth in range(start_depth, max_depth + 1):
+        t0 = time.perf_counter()
+        try:
+            # depth 1 always completes, so there is a move to return even with no time left
+            column, value = minimax(depth, position, player, -math.inf, math.inf, True, tt,
+                                    deadline if depth > 1 else None, stats, ordering)
+        except SearchTimeout:
+            while len(position.moves) > moves_played:
+                position.undo()
+            break
+        completed_depth = depth
+        if stats is not None:
+            stats.depth_times.append((depth, time.perf_counter() - t0))
+        if abs(value) == math.inf:
+            break
+    return column, value, completed_depth
+
+
+def lazy_smp_helper(board: np.ndarray, player: BoardPiece, tt: SharedTranspositionTable, deadline: float,
+                    max_depth: int, helper: int):
+    """
+    Runs in a helper process of the parallel search: iterative deepening on the shared
+    transposition table, starting one ply deeper than the main search for every other helper
+    and with a move order of its own. `deadline` is a time.time() value, as the clocks of
+    time.perf_counter() are not shared between processes. Returns the column, value and depth
+    of the deepest completed search and the number of nodes searched.
+    """
+    tt.raise_on_stop = True
+    position = BitBoard.from_array(board, player)
+    stats = MinimaxStats()
+    column, value, depth = iterative_deepening(position, player, tt, time.perf_counter() + deadline - time.time(),
+                                               max_depth, stats, MoveOrdering(seed=helper),
+                                               start_depth=1 + helper % 2)
+    return column, value, depth, stats.nodes
+
+
+def generate_move_minimax(board: np.ndarray, player: BoardPiece, saved_state: Optional[SavedState],
+                          time_limit: float = MOVE_TIME, max_depth: int = ROWS * COLUMNS,
+                          stats_callback: Optional[Callable[[MinimaxStats], None]] = None,
+                          profile: bool = False, move_ordering: bool = True,
+                          workers: int = 1) -> Tuple[PlayerAction, Optional[SavedState]]:
     """
 
     :param board:   np.ndarray
                     Contains current state of the board an ndarray, shape (ROWS, COLUMNS) and data type (dtype) BoardPiece
     :param player:  BoardPiece
                     Current player playing the game
-    :param saved_state: Saved state of the game
+    :param saved_state: Saved state of the game, a MinimaxSavedState holding the transposition
+                        table is created on the first call
+    :param time_limit: seconds after which iterative deepening returns the move of the
+                       deepest completed search
+    :param max_depth: deepest search to run if time allows
+    :param stats_callback: if given, the search is instrumented and this is called with the
+                           MinimaxStats of the move
+    :param profile: if True (and stats_callback is given) the move is run under cProfile and
+                    the stats get the collected pstats.Stats
+    :param move_ordering: if False, columns are searched left to right after the transposition
+                          table move, to measure the nodes saved by the move ordering
+    :param workers: number of processes searching, more than 1 runs a lazy SMP search: helper
+                    processes search the same position at staggered depths and in other move
+                    orders, sharing a SharedTranspositionTable with this process, and the
+                    deepest completed search is played; the stats count the nodes of all
     :return: action:    PlayerAction (np.int8)
                         The column to be played
             saved_state: The saved state of the game
 
     """
-    col_, val = minimax(4, board, player, math.inf, -math.inf, True)
+    t0 = time.perf_counter()
+    deadline = t0 + time_limit
+    if not isinstance(saved_state, MinimaxSavedState) or saved_state.player != player:
+        saved_state = MinimaxSavedState(player)
+    if workers > 1 and not isinstance(saved_state.tt, SharedTranspositionTable):
+        saved_state.tt = SharedTranspositionTable(saved_state.tt.size)
+    saved_state.tt.new_search()
+    saved_state.ordering.new_search()
+    helpers = []
+    if workers > 1:
+        helpers = [get_process_pool(workers - 1).submit(lazy_smp_helper, board, player, saved_state.tt,
+                                                        time.time() + time_limit, max_depth, helper)
+                   for helper in range(1, workers)]
+    position = BitBoard.from_array(board, player)
+    stats = MinimaxStats() if stats_callback is not None else None
+    ordering = saved_state.ordering if move_ordering else None
+    search_args = (position, player, saved_state.tt, deadline, max_depth, stats, ordering)
+    if stats is not None and profile:
+        (col_, val, depth), stats.profile = run_profiled(iterative_deepening, *search_args)
+    else:
+        col_, val, depth = iterative_deepening(*search_args)
+    if helpers:
+        saved_state.tt.stop()
+        for helper in helpers:
+            helper_col, helper_val, helper_depth, helper_nodes = helper.result()
+            if helper_col is not None and helper_depth > depth:
+                col_, val, depth = helper_col, helper_val, helper_depth
+            if stats is not None:
+                stats.nodes += helper_nodes
     action = PlayerAction(int(col_))
+    if stats is not None:
+        stats.depth = depth
+        stats.time = time.perf_counter() - t0
+        stats_callback(stats)
     return action, saved_state
+
+
+def expand_batch(boards: np.ndarray, players: np.ndarray):
+    """
+    Plays every column on every board at once. Returns the children, shape
+    (N * COLUMNS, ROWS, COLUMNS) with child i * COLUMNS + col of board i playing `col`, and
+    boolean arrays of shape (N * COLUMNS,) saying which children exist (the column was not
+    full) and which of them are won by the move.
+    """
+    n = len(boards)
+    heights = np.count_nonzero(boards != NO_PLAYER, axis=1).reshape(-1)
+    valid = heights < ROWS
+    children = np.repeat(boards, COLUMNS, axis=0)
+    movers = np.repeat(players, COLUMNS)
+    index = np.flatnonzero(valid)
+    children[index, heights[index], index % COLUMNS] = movers[index]
+    won = np.zeros(n * COLUMNS, dtype=bool)
+    won[index] = connected_masks(boards_to_masks(children[index], movers[index]))
+    return children, valid, won
+
+
+def minimax_batch(boards: np.ndarray, players: np.ndarray, root_players: np.ndarray, depth: int) -> np.ndarray:
+    """
+    Searches all boards `depth` plies deep at once, without pruning, and returns the value of
+    every child, shape (N, COLUMNS), seen from the root player of its board. The player to
+    move is the root player when `players` equals `root_players`, which holds for all boards
+    of a level. Children of full columns get NaN.
+
+    :param boards: stack of boards, shape (N, ROWS, COLUMNS), none of them won or full
+    :param players: player to move on every board, shape (N,)
+    :param root_players: player the values are computed for, shape (N,)
+    :param depth: plies to search, at least 1
+    """
+    children, valid, won = expand_batch(boards, players)
+    child_roots = np.repeat(root_players, COLUMNS)
+    maximizing = players[0] == root_players[0] if len(players) else True
+    values = np.full(len(children), np.nan)
+    values[won] = math.inf if maximizing else -math.inf
+    open_children = valid & ~won
+    full = np.count_nonzero(children[open_children] == NO_PLAYER, axis=(1, 2)) == 0
+    index = np.flatnonzero(open_children)
+    values[index[full]] = 0.
+    index = index[~full]
+    if depth == 1:
+        values[index] = board_heuristic(children[index], child_roots[index])
+    elif index.size:
+        grandchildren = minimax_batch(children[index], 3 - np.repeat(players, COLUMNS)[index],
+                                      child_roots[index], depth - 1)
+        # the opponent moves next: they pick the child worst for the root player
+        values[index] = np.nanmin(grandchildren, axis=1) if maximizing else np.nanmax(grandchildren, axis=1)
+    return values.reshape(-1, COLUMNS)
+
+
+def generate_moves_minimax_batch(boards: np.ndarray, players: np.ndarray, saved_states: List[Optional[SavedState]],
+                                 depth: int = BATCH_DEPTH) -> Tuple[np.ndarray, List[Optional[SavedState]]]:
+    """
+
+    :param boards: Contains the boards to move on, an ndarray, shape (N, ROWS, COLUMNS) and data type (dtype) BoardPiece
+    :param players: Player to move on every board, an ndarray of shape (N,)
+    :param saved_states: Saved state of every game, passed through unchanged as the batch
+                         search keeps no state between moves
+    :param depth: plies searched on every board, all boards are searched together level by
+                  level, without pruning
+    :return: actions: ndarray of shape (N,) and data type PlayerAction, the column to be played on every board
+            saved_states: The saved states of the games
+
+    """
+    players = np.asarray(players, dtype=BoardPiece)
+    values = minimax_batch(boards, players, players, depth)[:, CENTRE_ORDER]
+    valid = valid_columns_batch(boards)[:, CENTRE_ORDER]
+    # full columns are NaN, which nanargmax ranks like a lost column, so they are masked out and the
+    # centre is preferred among the equally valued valid columns
+    values = np.where(valid, values, -np.inf)
+    best = valid & (values == values.max(axis=1, keepdims=True))
+    actions = np.array(CENTRE_ORDER)[np.argmax(best, axis=1)]
+    return actions.astype(PlayerAction), saved_states
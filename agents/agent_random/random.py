@@ -1,18 +1,25 @@
 import numpy as np
 import random
-from typing import Optional,Tuple
-from agents.common import PlayerAction, BoardPiece, SavedState,ROWS,COLUMNS
+from typing import List, Optional,Tuple
+from agents.common import PlayerAction, BoardPiece, SavedState,ROWS,COLUMNS, valid_columns_batch
 
 
 def generate_move_random(
     board: np.ndarray, player: BoardPiece, saved_state: Optional[SavedState]
 ) -> Tuple[PlayerAction, Optional[SavedState]]:
-    action = PlayerAction(-1)
     # Choose a valid, non-full column randomly and return it as `action`
-    if player == BoardPiece(2):
-        valid_columns = []
-        for col in range(COLUMNS):
-            if board[ROWS - 1][col] == 0:
-                valid_columns.append(col)
-        action = PlayerAction(random.sample(valid_columns, 1))
-    return action, saved_state
\ No newline at end of file
+    valid_columns = []
+    for col in range(COLUMNS):
+        if board[ROWS - 1][col] == 0:
+            valid_columns.append(col)
+    action = PlayerAction(random.choice(valid_columns))
+    return action, saved_state
+
+
+def generate_moves_random_batch(
+    boards: np.ndarray, players: np.ndarray, saved_states: List[Optional[SavedState]]
+) -> Tuple[np.ndarray, List[Optional[SavedState]]]:
+    # Draw a random number for every valid column of every board and play the largest
+    keys = np.random.random_sample((len(boards), COLUMNS))
+    keys[~valid_columns_batch(boards)] = -1.
+    return keys.argmax(axis=1).astype(PlayerAction), saved_states
@@ -0,0 +1 @@
+from .solver import generate_move_solver as gen_move_solver
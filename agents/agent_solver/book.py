@@ -0,0 +1,126 @@
+"""
+Opening book of solved positions. The book holds every position of the first plies with its
+exact score and best column, in a binary file that is memory-mapped when loaded, so lookups
+read only the pages they touch.
+
+    python -m agents.agent_solver.book --plies 8 --output book.bin
+
+The file starts with a header (magic, format version, plies, number of records), followed by
+the records sorted by position key: key as uint64, score and column as int8, 10 bytes each.
+"""
+import argparse
+import sys
+import time
+from typing import Callable, Optional, Tuple
+import numpy as np
+from agents.common import BitBoard
+from agents.agent_solver.solver import Solver
+
+MAGIC = b'C4OPBOOK'
+VERSION = 1
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('plies', '<u4'), ('count', '<u8')])
+RECORD_DTYPE = np.dtype([('key', '<u8'), ('score', 'i1'), ('column', 'i1')])
+
+
+def book_positions(plies: int, root: Optional[BitBoard] = None) -> list:
+    """
+    Returns every distinct position reachable from `root` (the empty board by default) in at
+    most `plies` moves, except the positions where the game is already over.
+    """
+    positions = {}
+    stack = [(root.copy() if root is not None else BitBoard(), 0)]
+    while stack:
+        position, depth = stack.pop()
+        key = position.key()
+        if key in positions:
+            continue
+        positions[key] = position
+        if depth == plies:
+            continue
+        for col in position.valid_columns():
+            child = position.copy()
+            child.play(col)
+            if not child.last_move_won() and not child.is_full():
+                stack.append((child, depth + 1))
+    return list(positions.values())
+
+
+def generate_book(path: str, plies: int, root: Optional[BitBoard] = None, solver: Optional[Solver] = None,
+                  progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """
+    Solves every position of the first `plies` moves from `root` and writes them as a book to
+    `path`. Returns the number of positions written.
+
+    :param path: file the book is written to
+    :param plies: the positions after up to this many moves from `root` are solved
+    :param root: position the book starts from, the empty board by default
+    :param solver: Solver to use, a new one by default; its transposition table is shared by
+                   all positions
+    :param progress: called with (positions solved, positions in total) after every position
+    """
+    solver = solver if solver is not None else Solver()
+    positions = book_positions(plies, root)
+    records = np.zeros(len(positions), dtype=RECORD_DTYPE)
+    for i, position in enumerate(positions):
+        score, column = solver.analyze(position)
+        records[i] = (position.key(), score, column)
+        if progress is not None:
+            progress(i + 1, len(positions))
+    records.sort(order='key')
+    header = np.array([(MAGIC, VERSION, plies, len(records))], dtype=HEADER_DTYPE)
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(records.tobytes())
+    return len(records)
+
+
+class OpeningBook:
+    """
+    Read-only view of a book file, memory-mapped on construction.
+    """
+
+    def __init__(self, path: str):
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if len(header) != 1 or header['magic'][0] != MAGIC or header['version'][0] != VERSION:
+            raise ValueError(f'{path} is not an opening book of version {VERSION}')
+        self.plies = int(header['plies'][0])
+        count = int(header['count'][0])
+        self.records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_DTYPE.itemsize, shape=(count,))
+
+    def __len__(self):
+        return len(self.records)
+
+    def lookup(self, position: BitBoard) -> Optional[Tuple[int, int]]:
+        """
+        Returns (score, column) of `position`, or None if it is not in the book.
+        """
+        keys = self.records['key']
+        key = np.uint64(position.key())
+        i = int(np.searchsorted(keys, key))
+        if i == len(keys) or keys[i] != key:
+            return None
+        record = self.records[i]
+        return int(record['score']), int(record['column'])
+
+    def best_move(self, position: BitBoard) -> Optional[int]:
+        entry = self.lookup(position)
+        return None if entry is None else entry[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--plies', type=int, default=8)
+    parser.add_argument('--output', default='book.bin')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+
+    def progress(done, total):
+        print(f'\r{done}/{total} positions solved, {time.perf_counter() - t0:.0f} s', end='', file=sys.stderr)
+
+    count = generate_book(args.output, args.plies, progress=progress)
+    print(f'\n{count} positions written to {args.output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Exact Connect Four solver. Positions are searched as two integers in the bitboard layout of
+agents.common: `current` holds the pieces of the player to move, `mask` all pieces. Scores
+count how early a game is won: a player winning with their k-th last piece scores k, i.e.
+(CELLS + 1 - pieces on the board) // 2 for a win with the next move. The score is positive if
+the player to move wins, negative if they lose and 0 for a draw.
+"""
+import time
+from typing import Optional, Tuple
+import numpy as np
+from agents.common import PlayerAction, SavedState, BoardPiece, ROWS, COLUMNS, BitBoard, \
+    BITS_PER_COLUMN, COLUMN_MASKS, CENTRE_ORDER, winning_cells, playable_cells
+from agents.agent_minimax.minimax import SearchTimeout, TranspositionTable as MinimaxTranspositionTable, \
+    MoveOrdering, iterative_deepening
+
+CELLS = ROWS * COLUMNS
+MIN_SCORE = -(CELLS // 2) + 3
+MAX_SCORE = (CELLS + 1) // 2 - 3
+TT_SIZE = (1 << 20) + 7  # odd, so that consecutive keys spread over the slots
+DEADLINE_CHECK_INTERVAL = 1 << 10  # nodes between checks of the deadline
+SOLVE_SHARE = 0.5  # share of the move time the solver gets before falling back to minimax
+_ORDERED_COLUMN_MASKS = [COLUMN_MASKS[col] for col in CENTRE_ORDER]
+
+
+def popcount(x: int) -> int:
+    return bin(x).count('1')
+
+
+def non_losing_moves(current: int, mask: int) -> int:
+    """
+    Returns the playable cells that do not let the opponent win with their next move. It is 0
+    if every move loses, i.e. the opponent has two immediate wins or all moves play below one.
+    Only valid if the player to move cannot win immediately.
+    """
+    playable = playable_cells(mask)
+    opponent_wins = winning_cells(current ^ mask, mask)
+    forced = playable & opponent_wins
+    if forced:
+        if forced & (forced - 1):
+            return 0
+        playable = forced
+    return playable & ~(opponent_wins >> 1)
+
+
+def column_of(move: int) -> int:
+    return (move.bit_length() - 1) // BITS_PER_COLUMN
+
+
+class SolverTable:
+    """
+    Fixed size table of score bounds indexed by the position key `current + mask`. A slot
+    keeps the full key and one encoded bound; newer entries always replace older ones. Bounds
+    are encoded as small positive integers, upper bounds as score - MIN_SCORE + 1 and lower
+    bounds as score + MAX_SCORE - 2 * MIN_SCORE + 2.
+    """
+
+    def __init__(self, size: int = TT_SIZE):
+        self.size = size
+        self.keys = [0] * size
+        self.values = [0] * size
+
+    def get(self, key: int) -> int:
+        slot = key % self.size
+        return self.values[slot] if self.keys[slot] == key else 0
+
+    def put(self, key: int, value: int):
+        slot = key % self.size
+        self.keys[slot] = key
+        self.values[slot] = value
+
+
+class Solver:
+    """
+    Exact Connect Four solver: negamax with alpha-beta pruning over bitboards, searched with
+    null windows that narrow down the score, a transposition table of score bounds, only
+    non-losing moves and the moves creating the most threats searched first.
+    """
+
+    def __init__(self, table: Optional[SolverTable] = None):
+        self.table = table if table is not None else SolverTable()
+        self.nodes = 0
+        self.deadline = None
+
+    def negamax(self, current: int, mask: int, moves: int, alpha: int, beta: int) -> int:
+        """
+        Returns the score of the position if it lies within (alpha, beta), otherwise a bound
+        on the score on the side of the window it lies. The player to move must not be able
+        to win immediately.
+        """
+        self.nodes += 1
+        if self.deadline is not None and self.nodes % DEADLINE_CHECK_INTERVAL == 0 \
+                and time.perf_counter() > self.deadline:
+            raise SearchTimeout
+        candidates = non_losing_moves(current, mask)
+        if not candidates:
+            return -((CELLS - moves) // 2)
+        if moves >= CELLS - 2:
+            return 0
+        lowest = -((CELLS - 2 - moves) // 2)
+        if alpha < lowest:
+            alpha = lowest
+            if alpha >= beta:
+                return alpha
+        highest = (CELLS - 1 - moves) // 2
+        key = current + mask
+        value = self.table.get(key)
+        if value:
+            if value > MAX_SCORE - MIN_SCORE + 1:
+                lowest = value + 2 * MIN_SCORE - MAX_SCORE - 2
+                if alpha < lowest:
+                    alpha = lowest
+                    if alpha >= beta:
+                        return alpha
+            else:
+                highest = value + MIN_SCORE - 1
+        if beta > highest:
+            beta = highest
+            if alpha >= beta:
+                return beta
+
+        ordered = []
+        for column_mask in _ORDERED_COLUMN_MASKS:
+            move = candidates & column_mask
+            if move:
+                ordered.append((-popcount(winning_cells(current | move, mask)), len(ordered), move))
+        ordered.sort()
+        opponent = current ^ mask
+        for _, _, move in ordered:
+            score = -self.negamax(opponent, mask | move, moves + 1, -beta, -alpha)
+            if score >= beta:
+                self.table.put(key, score + MAX_SCORE - 2 * MIN_SCORE + 2)
+                return score
+            if score > alpha:
+                alpha = score
+        self.table.put(key, alpha - MIN_SCORE + 1)
+        return alpha
+
+    def solve(self, current: int, mask: int, moves: int) -> int:
+        """
+        Returns the exact score of the position, narrowing the score range with null window
+        searches, which prune far more than a single search with the full window.
+        """
+        if winning_cells(current, mask) & playable_cells(mask):
+            return (CELLS + 1 - moves) // 2
+        lowest = -((CELLS - moves) // 2)
+        highest = (CELLS + 1 - moves) // 2
+        while lowest < highest:
+            # probe closer to 0 first, where most positions score
+            middle = lowest + (highest - lowest) // 2
+            if middle <= 0 and -(-lowest // 2) < middle:
+                middle = -(-lowest // 2)
+            elif middle >= 0 and highest // 2 > middle:
+                middle = highest // 2
+            score = self.negamax(current, mask, moves, middle, middle + 1)
+            if score <= middle:
+                highest = score
+            else:
+                lowest = score
+        return lowest
+
+    def analyze(self, position: BitBoard) -> Tuple[int, int]:
+        """
+        Returns the exact score of `position` for the player to move and a column reaching it.
+        """
+        current, mask = position.masks[position.turn], position.occupied
+        moves = popcount(mask)
+        playable = playable_cells(mask)
+        wins = winning_cells(current, mask) & playable
+        if wins:
+            return (CELLS + 1 - moves) // 2, column_of(wins & -wins)
+        best_score, best_column = None, None
+        for col in CENTRE_ORDER:
+            move = playable & COLUMN_MASKS[col]
+            if not move:
+                continue
+            score = -self.solve(current ^ mask, mask | move, moves + 1)
+            if best_score is None or score > best_score:
+                best_score, best_column = score, col
+        return best_score, best_column
+
+
+class SolverSavedState(SavedState):
+    """
+    Keeps the solver with its transposition table, and the opening book if one is used,
+    between moves.
+    """
+
+    def __init__(self, player: BoardPiece, book=None):
+        self.player = player
+        self.solver = Solver()
+        self.book = book
+
+
+def generate_move_solver(board: np.ndarray, player: BoardPiece, saved_state: Optional[SavedState],
+                         time_limit: Optional[float] = None,
+                         book_path: Optional[str] = None) -> Tuple[PlayerAction, Optional[SavedState]]:
+    """
+
+    :param board: Contains current state of the board an ndarray, shape (ROWS, COLUMNS) and data type (dtype) BoardPiece
+    :param player: Current player playing the game
+    :param saved_state: Saved state of the game, a SolverSavedState is created on the first call
+    :param time_limit: seconds the move may take, None to always solve the position exactly. If
+                       the solver does not finish within SOLVE_SHARE of the time, the move of a
+                       minimax search over the rest of the time is played
+    :param book_path: opening book written by agents.agent_solver.book, looked up before searching
+    :return: action: The column to be played
+            saved_state: The saved state of the game
+
+    """
+    t0 = time.perf_counter()
+    if not isinstance(saved_state, SolverSavedState) or saved_state.player != player:
+        from agents.agent_solver.book import OpeningBook
+        saved_state = SolverSavedState(player, OpeningBook(book_path) if book_path is not None else None)
+    position = BitBoard.from_array(board, player)
+    if saved_state.book is not None:
+        column = saved_state.book.best_move(position)
+        if column is not None:
+            return PlayerAction(column), saved_state
+    solver = saved_state.solver
+    solver.deadline = None if time_limit is None else t0 + time_limit * SOLVE_SHARE
+    try:
+        _, column = solver.analyze(position)
+    except SearchTimeout:
+        column, _, _ = iterative_deepening(position, player, MinimaxTranspositionTable(),
+                                           t0 + time_limit, ordering=MoveOrdering())
+    return PlayerAction(column), saved_state
@@ -1,8 +1,7 @@
 from enum import Enum
 from typing import Optional
 import numpy as np
-from typing import Callable, Tuple
-from scipy.signal import convolve2d
+from typing import Callable, List, NamedTuple, Tuple
 
 BoardPiece = np.int8  # The data type (dtype) of the board
 NO_PLAYER = BoardPiece(0)  # board[i, j] == NO_PLAYER where the position is empty
@@ -42,37 +41,26 @@ def pretty_print_board(board: np.ndarray) -> str:
     to be used when playing or printing diagnostics to the console (stdout). The piece in
     board[0, 0] should appear in the lower-left. Here's an example output, note that we use
     PLAYER1_Print to represent PLAYER1 and PLAYER2_Print to represent PLAYER2):
-    |==============|
-    |              |
-    |              |
-    |    X X       |
-    |    O X X     |
-    |  O X O O     |
-    |  O O X X     |
-    |==============|
-    |0 1 2 3 4 5 6 |
-
-    """
-
-    board = np.flipud(board)  # flip vertically to get board[x][y] in lower left
-    print('|===============|')
-    pp_string = str('')
-    for y in range(ROWS):
-        # board_2_str = pp_string + ' '.join(
-        #     NO_PLAYER_PRINT if board[y][x] == NO_PLAYER else PLAYER1_PRINT if board[y][x] == PLAYER1 else PLAYER2_PRINT
-        #     for x in range(COLUMNS))
-        board_2_str = ''
-        # board_2_str = pp_string + str('| ') + ' '.join(
-        #     NO_PLAYER_PRINT if board[y][x] == NO_PLAYER else PLAYER1_PRINT if board[y][x] == PLAYER1 else PLAYER2_PRINT
-        #     for x in range(COLUMNS)) + str(' |')
-
-        print(str('| ') + ' '.join(
-            NO_PLAYER_PRINT if board[y][x] == NO_PLAYER else PLAYER1_PRINT if board[y][x] == PLAYER1 else PLAYER2_PRINT
-            for x in range(COLUMNS)) + str(' |'))
-    print('|===============|')
-    print(str('| ') + ' '.join(map(str, range(COLUMNS))) + str(' |'))
-
-    return board_2_str
+    |===============|
+    |               |
+    |               |
+    |     X X       |
+    |     O X X     |
+    |   O X O O     |
+    |   O O X X     |
+    |===============|
+    | 0 1 2 3 4 5 6 |
+
+    """
+    prints = {NO_PLAYER: NO_PLAYER_PRINT, PLAYER1: PLAYER1_PRINT, PLAYER2: PLAYER2_PRINT}
+    border = '|' + '=' * (2 * COLUMNS + 1) + '|'
+    lines = [border]
+    # flip vertically to get board[0, 0] in the lower left
+    for row in np.flipud(board):
+        lines.append('| ' + ' '.join(prints[BoardPiece(piece)] for piece in row) + ' |')
+    lines.append(border)
+    lines.append('| ' + ' '.join(map(str, range(COLUMNS))) + ' |')
+    return '\n'.join(lines)
 
 
 def string_to_board(pp_board: str) -> np.ndarray:
@@ -81,9 +69,18 @@ def string_to_board(pp_board: str) -> np.ndarray:
     This is quite useful for debugging, when the agent crashed and you have the last
     board state as a string.
     """
-    str_2_board = np.array(pp_board).reshape((ROWS,COLUMNS))
-
-    return str_2_board
+    pieces = {NO_PLAYER_PRINT: NO_PLAYER, PLAYER1_PRINT: PLAYER1, PLAYER2_PRINT: PLAYER2}
+    lines = pp_board.strip('\n').splitlines()
+    if len(lines) < ROWS + 2 or not lines[0].startswith('|=') or lines[ROWS + 1] != lines[0]:
+        raise ValueError('not a board printed by pretty_print_board')
+    board = initialize_game_state()
+    # the rows sit between the two borders, the top row first
+    for i, line in enumerate(lines[1:ROWS + 1]):
+        cells = line[2:2 * COLUMNS + 1:2]
+        if len(cells) != COLUMNS or any(cell not in pieces for cell in cells):
+            raise ValueError(f'cannot read the board row {line!r}')
+        board[ROWS - 1 - i] = [pieces[cell] for cell in cells]
+    return board
 
 
 def apply_player_action(
@@ -92,19 +89,18 @@ def apply_player_action(
     """
     Sets board[i, action] = player, where i is the lowest open row. The modified
     board is returned. If copy is True, makes a copy of the board before modifying it.
+    Raises ValueError if the column is full.
     """
     board_copy = board
     if copy:
         board_copy = board.copy()
-    lowest_open_row = np.min(np.where(board_copy[:, action] == NO_PLAYER))
+    # pieces stack from row 0 up, so the number of pieces in the column is its lowest open row
+    lowest_open_row = np.count_nonzero(board_copy[:, action])
+    if lowest_open_row == ROWS:
+        raise ValueError(f'column {action} is full')
     board_copy[lowest_open_row, action] = player
     return board_copy
 
-col_kernel = np.ones((4, 1), dtype=BoardPiece)
-row_kernel = np.ones((1, 4), dtype=BoardPiece)
-dia_l_kernel = np.diag(np.ones(4, dtype=BoardPiece))
-dia_r_kernel = np.array(np.diag(np.ones(4, dtype=BoardPiece))[::-1, :])
-
 def connected_four(
         board: np.ndarray, player: BoardPiece, _last_action: Optional[PlayerAction] = None
 ) -> bool:
@@ -114,15 +110,31 @@ def connected_four(
    If desired, the last action taken (i.e. last column played) can be provided
    for potential speed optimisation.
     """
-    board = board.copy()
+    if _last_action is not None:
+        return _connected_through(board, player, int(_last_action))
+    return _connected(board_to_mask(board, player))
 
-    other_player = BoardPiece(player % 2 + 1)
-    board[board == other_player] = NO_PLAYER
-    board[board == player] = BoardPiece(1)
 
-    for kernel in (col_kernel, row_kernel, dia_l_kernel, dia_r_kernel):
-        result = convolve2d(board, kernel, mode='valid', boundary='fill', fillvalue=BoardPiece(0))
-        if np.any(result == 4):
+def _connected_through(board: np.ndarray, player: BoardPiece, col: int) -> bool:
+    """
+    Returns True if the top piece of column `col` belongs to `player` and lies on a line of
+    four, only walking the lines through that piece.
+    """
+    rows = board.tolist()
+    player = int(player)
+    row = ROWS - 1
+    while row >= 0 and rows[row][col] == NO_PLAYER:
+        row -= 1
+    if row < 0 or rows[row][col] != player:
+        return False
+    for d_row, d_col in ((1, 0), (0, 1), (1, 1), (1, -1)):
+        count = 1
+        for sign in (1, -1):
+            r, c = row + sign * d_row, col + sign * d_col
+            while 0 <= r < ROWS and 0 <= c < COLUMNS and rows[r][c] == player:
+                count += 1
+                r, c = r + sign * d_row, c + sign * d_col
+        if count >= CONNECT_N:
             return True
     return False
 
@@ -133,14 +145,15 @@ def check_end_state(
     """
     Returns the current game state for the current `player`, i.e. has their last
     action won (GameState.IS_WIN) or drawn (GameState.IS_DRAW) the game,
-    or is play still on-going (GameState.STILL_PLAYING)?
+    or is play still on-going (GameState.STILL_PLAYING)? If `last_action` is given,
+    only the lines through the piece played there are checked for a win.
     """
-    state = connected_four(board, player)
+    state = connected_four(board, player, last_action)
 
     if state:
         game_state = GameState.IS_WIN
     else:
-        if NO_PLAYER in board:
+        if NO_PLAYER in board[ROWS - 1]:
             game_state = GameState.STILL_PLAYING
         else:
             game_state = GameState.IS_DRAW
@@ -165,8 +178,398 @@ def get_opponent_player(player: BoardPiece) -> BoardPiece:
     else:
         return PLAYER1
 
+def _window_indices() -> np.ndarray:
+    windows = []
+    for d_row, d_col in ((0, 1), (1, 0), (1, 1), (-1, 1)):
+        for row in range(ROWS):
+            for col in range(COLUMNS):
+                cells = [(row + i * d_row, col + i * d_col) for i in range(CONNECT_N)]
+                if all(0 <= r < ROWS and 0 <= c < COLUMNS for r, c in cells):
+                    windows.append([r * COLUMNS + c for r, c in cells])
+    return np.array(windows, dtype=np.intp)
+
+
+# Flat indices into board.reshape(-1) of every horizontal, vertical and diagonal window of
+# CONNECT_N cells, shape (69, 4) on the standard board.
+WINDOW_INDICES = _window_indices()
+
+# Bitboard layout: every column takes ROWS + 1 bits, bit `col * (ROWS + 1) + row` marks the
+# cell board[row, col]. The spare bit on top of each column stays empty, so shifting a mask
+# never carries a line over from one column into the next.
+BITS_PER_COLUMN = ROWS + 1
+BOTTOM_MASK = sum(1 << (col * BITS_PER_COLUMN) for col in range(COLUMNS))
+BOARD_MASK = BOTTOM_MASK * ((1 << ROWS) - 1)
+COLUMN_MASKS = [((1 << ROWS) - 1) << (col * BITS_PER_COLUMN) for col in range(COLUMNS)]  # the cells of every column
+# columns from the centre outwards, the order in which the searches try moves
+CENTRE_ORDER = sorted(range(COLUMNS), key=lambda col: abs(col - COLUMNS // 2))
+_CELL_BITS = np.array(
+    [[1 << (col * BITS_PER_COLUMN + row) for col in range(COLUMNS)] for row in range(ROWS)],
+    dtype=np.uint64,
+)
+_LINE_SHIFTS = (1, BITS_PER_COLUMN, BITS_PER_COLUMN - 1, BITS_PER_COLUMN + 1)
+_COLUMN_MASK = (1 << BITS_PER_COLUMN) - 1
+# shift taking the bits of a column to the same bits of its mirror column
+_MIRROR_SHIFTS = [(COLUMNS - 1 - 2 * col) * BITS_PER_COLUMN for col in range(COLUMNS)]
+
+
+def _connected(mask: int) -> bool:
+    """
+    Returns True if the bitboard `mask` contains four set bits in a vertical, horizontal
+    or diagonal line.
+    """
+    for shift in _LINE_SHIFTS:
+        pairs = mask & (mask >> shift)
+        if pairs & (pairs >> (2 * shift)):
+            return True
+    return False
+
+
+_LINE_SHIFTS_U64 = tuple((np.uint64(shift), np.uint64(2 * shift)) for shift in _LINE_SHIFTS)
+
+
+def connected_masks(masks: np.ndarray) -> np.ndarray:
+    """
+    Vectorized `_connected`: takes an array of bitboards of dtype uint64 and returns a boolean
+    array of the same shape, True where the bitboard contains four in a line.
+    """
+    won = np.zeros(masks.shape, dtype=bool)
+    for shift, double_shift in _LINE_SHIFTS_U64:
+        pairs = masks & (masks >> shift)
+        won |= (pairs & (pairs >> double_shift)) != 0
+    return won
+
+
+def boards_to_masks(boards: np.ndarray, players) -> np.ndarray:
+    """
+    Vectorized `board_to_mask`: takes boards of shape (N, ROWS, COLUMNS) and the player of
+    every board, shape (N,), and returns their bitboards as an array of dtype uint64.
+    """
+    own = boards == np.asarray(players, dtype=BoardPiece).reshape(-1, 1, 1)
+    return np.where(own, _CELL_BITS, np.uint64(0)).sum(axis=(1, 2), dtype=np.uint64)
+
+
+def masks_to_boards(masks: np.ndarray) -> np.ndarray:
+    """
+    Vectorized `mask_to_board` for both players: takes bitboards of shape (N, 2), PLAYER1's
+    and PLAYER2's, of dtype uint64 and returns boards of shape (N, ROWS, COLUMNS).
+    """
+    # unpacking the bytes of the masks into bits is far cheaper than testing every cell
+    bits = np.unpackbits(np.ascontiguousarray(masks, dtype='<u8').view(np.uint8).reshape(-1, 2, 8),
+                         axis=2, bitorder='little')
+    pieces = bits[:, 0] | (bits[:, 1] << 1)
+    # bit col * BITS_PER_COLUMN + row holds board[row, col]
+    columns = pieces[:, :COLUMNS * BITS_PER_COLUMN].reshape(-1, COLUMNS, BITS_PER_COLUMN)[:, :, :ROWS]
+    return np.ascontiguousarray(columns.transpose(0, 2, 1)).view(BoardPiece)
+
+
+def valid_columns_batch(boards: np.ndarray) -> np.ndarray:
+    """
+    Returns a boolean array of shape (N, COLUMNS), True where a piece can be dropped into the
+    column of the board, for boards of shape (N, ROWS, COLUMNS).
+    """
+    return boards[:, ROWS - 1, :] == NO_PLAYER
+
+
+def winning_cells(mask, occupied):
+    """
+    Returns the empty cells where a piece would complete four in a line for the player owning
+    the bitboard `mask`, whether or not the cell can be played right now. Works on ints and,
+    element-wise, on arrays of dtype uint64.
+    """
+    # vertical: three pieces directly below
+    cells = (mask << 1) & (mask << 2) & (mask << 3)
+    for shift in _LINE_SHIFTS[1:]:
+        pair = (mask << shift) & (mask << 2 * shift)
+        cells |= pair & (mask << 3 * shift)
+        cells |= pair & (mask >> shift)
+        pair = (mask >> shift) & (mask >> 2 * shift)
+        cells |= pair & (mask << shift)
+        cells |= pair & (mask >> 3 * shift)
+    return cells & (BOARD_MASK ^ occupied)
+
+
+def playable_cells(occupied):
+    """
+    Returns the lowest empty cell of every column that is not full.
+    """
+    return (occupied + BOTTOM_MASK) & BOARD_MASK
+
+
+def mask_columns(mask: int) -> List[int]:
+    """
+    Returns the columns holding at least one set bit of `mask`.
+    """
+    return [col for col in range(COLUMNS) if (mask >> (col * BITS_PER_COLUMN)) & _COLUMN_MASK]
+
+
+class ThreatMap(NamedTuple):
+    """
+    Immediate threats of a position. wins[i] holds the columns where the player of
+    BitBoard.masks[i] completes four in a line by dropping a piece now, `losing` the columns
+    where a piece of the player to move would let the opponent do so right on top of it.
+    """
+    turn: int
+    wins: Tuple[List[int], List[int]]
+    losing: List[int]
+
+    @property
+    def own_wins(self) -> List[int]:
+        return self.wins[self.turn]
+
+    @property
+    def opponent_wins(self) -> List[int]:
+        return self.wins[self.turn ^ 1]
+
+    def replies(self, columns: List[int]) -> List[int]:
+        """
+        Returns the moves among the playable `columns` worth searching: a winning column if
+        there is one, otherwise the columns blocking the opponent's wins if they have any,
+        otherwise the columns that do not hand the opponent a win, or all of them if every
+        column does.
+        """
+        if self.own_wins:
+            return self.own_wins[:1]
+        if self.opponent_wins:
+            return self.opponent_wins
+        safe = [col for col in columns if col not in self.losing]
+        return safe if safe else columns
+
+
+def mirror_mask(mask: int) -> int:
+    """
+    Returns the bitboard `mask` mirrored about the centre column.
+    """
+    mirrored = 0
+    for col in range(COLUMNS):
+        mirrored |= ((mask >> (col * BITS_PER_COLUMN)) & _COLUMN_MASK) << ((COLUMNS - 1 - col) * BITS_PER_COLUMN)
+    return mirrored
+
+
+def mirror_column(col: int) -> int:
+    return COLUMNS - 1 - col
+
+
+def board_to_mask(board: np.ndarray, player: BoardPiece) -> int:
+    """
+    Returns the bitboard of all cells of `board` occupied by `player`.
+    """
+    return int(_CELL_BITS[board == player].sum(dtype=np.uint64))
+
+
+def mask_to_board(mask: int, piece: BoardPiece, board: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Writes `piece` into every cell of `board` that is set in `mask` and returns the board.
+    A new empty board is used if none is given.
+    """
+    if board is None:
+        board = initialize_game_state()
+    board[(_CELL_BITS & np.uint64(mask)) != 0] = piece
+    return board
+
+
+class BitBoard:
+    """
+    Connect Four position stored as one bitboard per player plus the next free bit of
+    every column. Moves are applied with `play` and taken back with `undo`, both in
+    constant time, so a search can walk the game tree on a single object.
+
+    The key of the position and the key of its mirror image are updated along with every
+    move, so `canonical_key` returns the same key for a position and its mirror image at the
+    cost of a comparison.
+    """
+    __slots__ = ('masks', 'heights', 'moves', 'turn', 'hashes')
+
+    def __init__(self):
+        self.masks = [0, 0]  # masks[0] holds PLAYER1's pieces, masks[1] PLAYER2's
+        self.heights = [col * BITS_PER_COLUMN for col in range(COLUMNS)]
+        self.moves = []
+        self.turn = 0  # index into masks of the player to move
+        # masks[0] + occupied + BOTTOM_MASK, of the position and of its mirror image
+        self.hashes = [BOTTOM_MASK, BOTTOM_MASK]
+
+    @classmethod
+    def from_array(cls, board: np.ndarray, player: Optional[BoardPiece] = None) -> 'BitBoard':
+        """
+        Builds a position from an ndarray board. `player` is the player to move; if it is
+        not given it is inferred from the number of pieces on the board.
+        """
+        position = cls()
+        position.masks = [board_to_mask(board, PLAYER1), board_to_mask(board, PLAYER2)]
+        filled = np.count_nonzero(board != NO_PLAYER, axis=0)
+        position.heights = [col * BITS_PER_COLUMN + int(filled[col]) for col in range(COLUMNS)]
+        if player is None:
+            player = PLAYER1 if np.count_nonzero(board == PLAYER1) <= np.count_nonzero(board == PLAYER2) else PLAYER2
+        position.turn = int(player) - 1
+        position.hashes = [position.masks[0] + position.occupied + BOTTOM_MASK,
+                           mirror_mask(position.masks[0]) + mirror_mask(position.occupied) + BOTTOM_MASK]
+        return position
+
+    def to_array(self) -> np.ndarray:
+        """
+        Returns the position as an ndarray, shape (ROWS, COLUMNS) and dtype BoardPiece.
+        """
+        board = mask_to_board(self.masks[0], PLAYER1)
+        return mask_to_board(self.masks[1], PLAYER2, board)
+
+    def copy(self) -> 'BitBoard':
+        position = BitBoard.__new__(BitBoard)
+        position.masks = self.masks[:]
+        position.heights = self.heights[:]
+        position.moves = self.moves[:]
+        position.turn = self.turn
+        position.hashes = self.hashes[:]
+        return position
+
+    @property
+    def player(self) -> BoardPiece:
+        """
+        The player to move.
+        """
+        return BoardPiece(self.turn + 1)
+
+    @property
+    def occupied(self) -> int:
+        return self.masks[0] | self.masks[1]
+
+    def can_play(self, col: int) -> bool:
+        return self.heights[col] < col * BITS_PER_COLUMN + ROWS
+
+    def valid_columns(self) -> List[int]:
+        heights = self.heights
+        return [col for col in range(COLUMNS) if heights[col] < col * BITS_PER_COLUMN + ROWS]
+
+    def play(self, col: int):
+        """
+        Drops a piece of the player to move into column `col` and passes the turn.
+        """
+        height = self.heights[col]
+        self.masks[self.turn] |= 1 << height
+        # a piece of PLAYER1 is counted in masks[0] and in the occupied cells
+        weight = 2 - self.turn
+        self.hashes[0] += weight << height
+        self.hashes[1] += weight << (height + _MIRROR_SHIFTS[col])
+        self.heights[col] = height + 1
+        self.moves.append(col)
+        self.turn ^= 1
+
+    def undo(self) -> int:
+        """
+        Takes back the last move played and returns its column.
+        """
+        col = self.moves.pop()
+        self.turn ^= 1
+        height = self.heights[col] - 1
+        self.heights[col] = height
+        self.masks[self.turn] ^= 1 << height
+        weight = 2 - self.turn
+        self.hashes[0] -= weight << height
+        self.hashes[1] -= weight << (height + _MIRROR_SHIFTS[col])
+        return col
+
+    def is_win(self, player: BoardPiece) -> bool:
+        return _connected(self.masks[int(player) - 1])
+
+    def last_move_won(self) -> bool:
+        """
+        Returns True if the player who moved last has four in a row. Only their mask is
+        tested: on a bitboard the four shift-and-mask passes over one mask are cheaper than
+        walking the individual lines through the last piece.
+        """
+        return _connected(self.masks[self.turn ^ 1])
+
+    def num_pieces(self) -> int:
+        return bin(self.occupied).count('1')
+
+    def is_full(self) -> bool:
+        return self.occupied == BOARD_MASK
+
+    def key(self) -> int:
+        """
+        Returns an integer that uniquely identifies the position and the player to move.
+        """
+        return self.hashes[0] << 1 | self.turn
+
+    def canonical_key(self) -> Tuple[int, bool]:
+        """
+        Returns the smaller of the keys of the position and of its mirror image, and True if
+        that is the key of the mirror image. Moves stored under a mirrored key have to be
+        mirrored with `mirror_column`.
+        """
+        key, mirror = self.hashes
+        if mirror < key:
+            return mirror << 1 | self.turn, True
+        return key << 1 | self.turn, False
+
+    def is_symmetric(self) -> bool:
+        """
+        Returns True if the position is its own mirror image.
+        """
+        return self.hashes[0] == self.hashes[1]
+
+    def threats(self) -> ThreatMap:
+        """
+        Returns the ThreatMap of the position, computed in one pass over both bitboards. Only
+        meaningful while the game is on.
+        """
+        occupied = self.occupied
+        playable = playable_cells(occupied)
+        cells = [winning_cells(self.masks[0], occupied), winning_cells(self.masks[1], occupied)]
+        # a cell right below an opponent's winning cell gives it to them
+        losing = (cells[self.turn ^ 1] >> 1) & playable
+        return ThreatMap(self.turn, (mask_columns(cells[0] & playable), mask_columns(cells[1] & playable)),
+                         mask_columns(losing))
+
+
+def run_profiled(func: Callable, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) under cProfile and returns its result together with the
+    collected pstats.Stats.
+    """
+    import cProfile
+    import pstats
+
+    profile = cProfile.Profile()
+    result = profile.runcall(func, *args, **kwargs)
+    return result, pstats.Stats(profile)
+
+
+_process_pools = {}
+
+
+def get_process_pool(workers: int) -> 'ProcessPoolExecutor':
+    """
+    Returns a process pool with `workers` processes, created on first use and kept for later
+    moves. Agents searching with the same number of workers share the pool.
+    """
+    if workers not in _process_pools:
+        # imported here, multiprocessing is a noticeable share of an agent's import time
+        from concurrent.futures import ProcessPoolExecutor
+        _process_pools[workers] = ProcessPoolExecutor(max_workers=workers)
+    return _process_pools[workers]
+
+
 GenMove = Callable[
     [np.ndarray, BoardPiece, Optional[SavedState]],  # Arguments for the generate_move function
     Tuple[PlayerAction, Optional[SavedState]]  # Return type of the generate_move function
 ]
 
+
+GenMoveBatch = Callable[
+    # boards of shape (N, ROWS, COLUMNS), the player to move on each board, shape (N,), and the saved states
+    [np.ndarray, np.ndarray, List[Optional[SavedState]]],
+    Tuple[np.ndarray, List[Optional[SavedState]]]  # the action for each board, shape (N,), and the new saved states
+]
+
+
+def generate_moves_batch(gen_move: GenMove, boards: np.ndarray, players: np.ndarray,
+                         saved_states: List[Optional[SavedState]]) -> Tuple[np.ndarray, List[Optional[SavedState]]]:
+    """
+    Runs the GenMove `gen_move` once per board, the GenMoveBatch of agents without a
+    vectorized batch implementation.
+    """
+    actions = np.empty(len(boards), dtype=PlayerAction)
+    new_states = []
+    for i, (board, player, saved_state) in enumerate(zip(boards, players, saved_states)):
+        actions[i], saved_state = gen_move(board.copy(), BoardPiece(player), saved_state)
+        new_states.append(saved_state)
+    return actions, new_states
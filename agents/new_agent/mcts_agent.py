@@ -1,10 +1,29 @@
 import numpy as np
+import math
+import random
+import time
 from collections import defaultdict
-from typing import Optional, Tuple
+from typing import Callable, Optional, Tuple
 from agents.common import PlayerAction, SavedState, BoardPiece, PLAYER1, PLAYER2, \
-    connected_four, ROWS, \
-    COLUMNS, apply_player_action, get_valid_columns, \
-    check_end_state, GameState, get_opponent_player
+    ROWS, mirror_column, \
+    COLUMNS, apply_player_action, \
+    check_end_state, GameState, get_opponent_player, BitBoard, BOARD_MASK, COLUMN_MASKS, \
+    winning_cells, playable_cells, run_profiled, get_process_pool
+
+SIMULATIONS = 3000  # tree_policy iterations per move
+ROLLOUT_BATCH = 1  # random games played from every selected leaf
+EXPLORATION = 1.414
+NODE_CHUNK = 1 << 16  # nodes added to the arrays of an MCTSTree whenever it runs full
+MAX_NODES = 1 << 22
+NOT_TERMINAL = 2  # MCTSTree.terminal value of nodes where the game goes on
+THREATS_UNKNOWN = 3  # MCTSTree.terminal value of nodes whose threats are looked at when first reached
+BUDGET_CHECK_INTERVAL = 32  # iterations between checks of the time budget and the early stop rule
+_NODE_ARRAYS = ('visits', 'score', 'log_visits', 'parent', 'first_child', 'n_children', 'action', 'terminal', 'key',
+                'target')
+_DEPTH_SIGNS = np.where(np.arange(ROWS * COLUMNS + 1) % 2 == 1, 1, -1)
+_COLUMN_BITS = np.array(COLUMN_MASKS, dtype=np.uint64)
+_ONE = np.uint64(1)
+_rng = np.random.default_rng()
 
 
 # MCTS Steps
@@ -26,40 +45,581 @@ from agents.common import PlayerAction, SavedState, BoardPiece, PLAYER1, PLAYER2
 # helps in selection of the next node based on the simulation. Used to balance the exploration
 # and exploitation from existing information
 
+def batch_rollout(position: BitBoard, n_games: int, rng: Optional[np.random.Generator] = None,
+                  stats: Optional['MCTSStats'] = None):
+    """
+    Plays `n_games` random games from `position` at once on arrays of bitboards and returns
+    how often each result (1,0,-1) occurred: PLAYER2 won, draw, PLAYER1 won. The moves follow
+    the immediate threats like `random_rollout`.
+
+    :param position: BitBoard to start all games from, it is not modified
+    :param n_games: number of games to simulate
+    :param rng: numpy random Generator, a module wide one is used if None
+    :param stats: optional MCTSStats the number of games and moves played are added to
+    """
+    rng = _rng if rng is None else rng
+    turn = position.turn
+    own = np.full(n_games, position.masks[turn], dtype=np.uint64)
+    other = np.full(n_games, position.masks[turn ^ 1], dtype=np.uint64)
+    occupied = own | other
+    own_cells = winning_cells(own, occupied)
+    winners = np.zeros(n_games, dtype=np.int8)
+    active = np.arange(n_games)
+    plies = 0
+    while active.size:
+        playable = playable_cells(occupied)
+        # the player to move wins at once, or cannot block two wins of the opponent
+        other_cells = winning_cells(other, occupied)
+        forced = other_cells & playable
+        won = (own_cells & playable) != 0
+        lost = ~won & ((forced & (forced - _ONE)) != 0)
+        winners[active[won]] = turn + 1
+        winners[active[lost]] = (turn ^ 1) + 1
+        going = ~(won | lost)
+        active, own, other, occupied = active[going], own[going], other[going], occupied[going]
+        playable, forced, other_cells = playable[going], forced[going], other_cells[going]
+        safe = playable & ~(other_cells >> _ONE)
+        moves = np.where(forced != 0, forced, np.where(safe != 0, safe, playable))
+        # the largest of random numbers masked to the allowed columns is a uniform choice
+        allowed = (moves[:, None] & _COLUMN_BITS) != 0
+        move = moves & _COLUMN_BITS[np.argmax(rng.random(allowed.shape) * allowed, axis=1)]
+        occupied |= move
+        plies += active.size
+        going = occupied != BOARD_MASK
+        # the cells the opponent wins with stay the same, except the one just filled
+        active, own, other = active[going], other[going], (own | move)[going]
+        own_cells, occupied = (other_cells & ~move)[going], occupied[going]
+        turn ^= 1
+    if stats is not None:
+        stats.rollouts += n_games
+        stats.rollout_plies += plies
+    counts = np.bincount(winners, minlength=3)
+    return {1: int(counts[PLAYER2]), 0: int(counts[0]), -1: int(counts[PLAYER1])}
+
+
+def random_rollout(position: BitBoard, stats: Optional['MCTSStats'] = None) -> int:
+    """
+    Plays one random game from `position`, where the game must still be on, and returns the
+    result (1,0,-1): PLAYER2 won, draw, PLAYER1 won. The moves follow the immediate threats:
+    the game ends as soon as the player to move can win at once or cannot block the
+    opponent's wins, a single win of the opponent is blocked and otherwise a random move is
+    played that does not hand the opponent a win. The game is played on the bitboards
+    alone, `position` is not modified. The number of moves played is added to `stats` if given.
+    """
+    turn = position.turn
+    own, other = position.masks[turn], position.masks[turn ^ 1]
+    occupied = own | other
+    own_cells = winning_cells(own, occupied)
+    plies = 0
+    while True:
+        playable = playable_cells(occupied)
+        if own_cells & playable:
+            winner = turn
+            break
+        other_cells = winning_cells(other, occupied)
+        move = other_cells & playable
+        if move & (move - 1):
+            winner = turn ^ 1
+            break
+        if not move:
+            # every move may hand the opponent a win, then any move is as good
+            moves = playable & ~(other_cells >> 1) or playable
+            # a random column drawn until it holds one of the moves is a uniform choice
+            move = 0
+            while not move:
+                move = moves & COLUMN_MASKS[int(random.random() * COLUMNS)]
+        occupied |= move
+        plies += 1
+        if occupied == BOARD_MASK:
+            winner = None
+            break
+        # the cells the opponent wins with stay the same, except the one just filled
+        own, other = other, own | move
+        own_cells = other_cells & ~move
+        turn ^= 1
+    if stats is not None:
+        stats.rollouts += 1
+        stats.rollout_plies += plies
+    return 0 if winner is None else (1 if winner == 1 else -1)
+
+
+def terminal_result(position: BitBoard, last_mover_only: bool = True) -> int:
+    """
+    Returns the result (1,0,-1) if the game is over in `position`, NOT_TERMINAL otherwise.
+    Unless `last_mover_only` is False only the player who moved last is checked for a win.
+    """
+    pieces = (get_opponent_player(position.player),) if last_mover_only else (PLAYER1, PLAYER2)
+    for piece in pieces:
+        if position.is_win(piece):
+            return 1 if piece == PLAYER2 else -1
+    if position.is_full():
+        return 0
+    return NOT_TERMINAL
+
+
+def threat_result(position: BitBoard) -> int:
+    """
+    Returns the result (1,-1) of a position where the game is still on if its immediate
+    threats decide it: the player to move wins at once, or cannot block both wins of the
+    opponent. Returns NOT_TERMINAL otherwise.
+    """
+    turn = position.turn
+    occupied = position.occupied
+    playable = playable_cells(occupied)
+    if winning_cells(position.masks[turn], occupied) & playable:
+        winner = turn
+    else:
+        forced = winning_cells(position.masks[turn ^ 1], occupied) & playable
+        if not forced & (forced - 1):
+            return NOT_TERMINAL
+        winner = turn ^ 1
+    return 1 if winner == 1 else -1
+
+
+class MCTSStats:
+    """
+    Counters of one MCTS search, collected when an MCTSTree has a stats object. The times
+    split an iteration into selection, expansion, rollout and backpropagation, profile holds
+    the pstats.Stats of the move if it was profiled.
+    """
+
+    def __init__(self):
+        self.simulations = 0
+        self.stop_reason = None
+        self.tree_size = 0
+        self.max_depth = 0
+        self.rollouts = 0
+        self.rollout_plies = 0
+        self.time_select = 0.
+        self.time_expand = 0.
+        self.time_rollout = 0.
+        self.time_backprop = 0.
+        self.time = 0.
+        self.profile = None
+
+    @property
+    def mean_rollout_length(self) -> float:
+        return self.rollout_plies / self.rollouts if self.rollouts else 0.
+
+    def __repr__(self):
+        return (f'MCTSStats(simulations={self.simulations}, stop_reason={self.stop_reason}, tree_size={self.tree_size}, '
+                f'max_depth={self.max_depth}, mean_rollout_length={self.mean_rollout_length:.1f}, '
+                f'select={self.time_select:.3f}s, expand={self.time_expand:.3f}s, '
+                f'rollout={self.time_rollout:.3f}s, backprop={self.time_backprop:.3f}s, time={self.time:.3f}s)')
+
+
+class MCTSTree:
+    """
+    Monte Carlo search tree stored as a structure of arrays, node 0 being the root. The
+    children of a node are created together and stored next to each other, so a node only
+    keeps the index of its first child and their number. score[i] counts wins minus losses
+    of the player who moved into node i and log_visits[i] caches the log of its visits for
+    the UCB of its children. Nodes keep the action leading to them and the canonical key of
+    their position, but not the position itself: every iteration replays the actions on the
+    root BitBoard while descending and takes them back afterwards. Symmetric positions only
+    get the children up to the centre column, the others are their mirror images. If
+    `mirrored` is set, the tree was reused for the mirror image of the game position and its
+    actions have to be mirrored before they are played.
+
+    With `dag` set the tree becomes a directed acyclic graph: `table` maps the key of every
+    position to the first node created for it, and target[i] is the node holding the
+    statistics and children of the position of node i, i itself unless the position was
+    reached before through another order of moves. Selection then follows the targets, so
+    every position is searched and scored once, with the visits of all paths to it.
+    """
+
+    def __init__(self, position: BitBoard, max_nodes: int = MAX_NODES, exploration_param: float = EXPLORATION,
+                 stats: Optional[MCTSStats] = None, dag: bool = False):
+        self.position = position.copy()
+        self.max_nodes = max_nodes
+        self.exploration_param = exploration_param
+        self.stats = stats
+        self.full = False
+        self.mirrored = False
+        self.size = 0
+        self.capacity = 0
+        self.visits = np.zeros(0, dtype=np.int32)
+        self.score = np.zeros(0, dtype=np.int32)
+        self.log_visits = np.zeros(0, dtype=np.float32)
+        self.parent = np.zeros(0, dtype=np.int32)
+        self.first_child = np.zeros(0, dtype=np.int32)
+        self.n_children = np.zeros(0, dtype=np.int8)
+        self.action = np.zeros(0, dtype=np.int8)
+        self.terminal = np.zeros(0, dtype=np.int8)
+        self.key = np.zeros(0, dtype=np.uint64)
+        self.target = np.zeros(0, dtype=np.int32)
+        self.table = {position.key(): 0} if dag else None
+        self._grow(1)
+        self.size = 1
+        self.parent[0] = -1
+        self.action[0] = -1
+        self.key[0] = position.canonical_key()[0]
+        self.terminal[0] = terminal_result(position, last_mover_only=False)
+
+    @property
+    def player(self) -> BoardPiece:
+        """
+        The player to move at the root.
+        """
+        return self.position.player
+
+    def _grow(self, n_nodes: int):
+        """
+        Makes room for `n_nodes` more nodes, growing the arrays by NODE_CHUNK nodes at a time.
+        """
+        if self.size + n_nodes <= self.capacity:
+            return
+        capacity = min(max(self.capacity + NODE_CHUNK, self.size + n_nodes), self.max_nodes)
+        for name in _NODE_ARRAYS:
+            array = getattr(self, name)
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            setattr(self, name, grown)
+        self.first_child[self.size:] = -1
+        self.capacity = capacity
+
+    def expand(self, node: int, position: BitBoard) -> bool:
+        """
+        Adds the children of `node`, whose position is `position`. Returns False if the tree
+        has reached max_nodes. Only the replies its immediate threats leave are added. Whether
+        a child is decided by its own threats is left to `tree_policy`, when it is first reached.
+        """
+        columns = position.threats().replies(position.valid_columns())
+        if position.is_symmetric():
+            columns = [col for col in columns if col <= COLUMNS // 2]
+        if self.size + len(columns) > self.max_nodes:
+            self.full = True
+            return False
+        self._grow(len(columns))
+        first = self.size
+        table = self.table
+        for i, col in enumerate(columns):
+            position.play(col)
+            self.key[first + i] = position.canonical_key()[0]
+            terminal = terminal_result(position)
+            self.terminal[first + i] = terminal if terminal != NOT_TERMINAL else THREATS_UNKNOWN
+            if table is not None:
+                self.target[first + i] = table.setdefault(position.key(), first + i)
+            position.undo()
+        last = first + len(columns)
+        if table is None:
+            self.target[first:last] = np.arange(first, last)
+        self.action[first:last] = columns
+        self.parent[first:last] = node
+        self.first_child[node] = first
+        self.n_children[node] = len(columns)
+        self.size = last
+        return True
+
+    def select_child(self, node: int) -> int:
+        """
+        Returns the child of `node` with the highest UCB score, unvisited children first.
+        """
+        first = int(self.first_child[node])
+        last = first + int(self.n_children[node])
+        if self.table is None:
+            visits = self.visits[first:last]
+            score = self.score[first:last]
+        else:
+            targets = self.target[first:last]
+            visits = self.visits[targets]
+            score = self.score[targets]
+        if not visits.all():
+            return first + int(visits.argmin())
+        ucb_scores = score / visits
+        ucb_scores += self.exploration_param * np.sqrt(self.log_visits[node] * 2. / visits)
+        return first + int(ucb_scores.argmax())
+
+    def tree_policy(self, rollout_batch: int = ROLLOUT_BATCH):
+        """
+        Runs one iteration: selects a leaf by UCB, expands it if it was visited before, rolls
+        out from it and backpropagates the result along the path. In a DAG the path holds the
+        target nodes.
+        """
+        stats = self.stats
+        if stats is not None:
+            t0 = time.perf_counter()
+        position = self.position
+        dag = self.table is not None
+        node = 0
+        path = [0]
+        while self.n_children[node]:
+            node = self.select_child(node)
+            position.play(int(self.action[node]))
+            if dag:
+                node = int(self.target[node])
+            path.append(node)
+        if stats is not None:
+            t1 = time.perf_counter()
+        if self.terminal[node] == NOT_TERMINAL and self.visits[node] and self.expand(node, position):
+            node = int(self.first_child[node])
+            position.play(int(self.action[node]))
+            if dag:
+                node = int(self.target[node])
+            path.append(node)
+        if self.terminal[node] == THREATS_UNKNOWN:
+            # a node decided by its threats is terminal, the search never spends rollouts on it
+            self.terminal[node] = threat_result(position)
+        if stats is not None:
+            t2 = time.perf_counter()
+
+        if self.terminal[node] != NOT_TERMINAL:
+            results = {int(self.terminal[node]): rollout_batch}
+        elif rollout_batch > 1:
+            results = batch_rollout(position, rollout_batch, stats=stats)
+        else:
+            results = {random_rollout(position, stats): 1}
+        for _ in range(len(path) - 1):
+            position.undo()
+        if stats is not None:
+            t3 = time.perf_counter()
+        self.backpropagate(np.array(path), results)
+        if stats is not None:
+            stats.simulations += 1
+            stats.max_depth = max(stats.max_depth, len(path) - 1)
+            stats.time_select += t1 - t0
+            stats.time_expand += t2 - t1
+            stats.time_rollout += t3 - t2
+            stats.time_backprop += time.perf_counter() - t3
+
+    def backpropagate(self, path: np.ndarray, results):
+        """
+        Adds the result counts of the rollouts to all nodes on `path`, starting at the root.
+        """
+        n_games = sum(results.values())
+        player2_lead = results.get(1, 0) - results.get(-1, 0)
+        # the root player moves into the nodes at odd depths
+        if self.player == PLAYER1:
+            player2_lead = -player2_lead
+        self.visits[path] += n_games
+        self.score[path] += _DEPTH_SIGNS[:len(path)] * player2_lead
+        self.log_visits[path] = np.log(self.visits[path])
+
+    def best_simulated_action(self, rollout_batch: int = ROLLOUT_BATCH, simulation_no: int = SIMULATIONS) -> int:
+        """
+        Runs the Monte Carlo simulation for the specified number of iterations and returns the
+        most visited root child.
+        """
+        return self.search(simulation_no, rollout_batch=rollout_batch, early_stop=False)
+
+    def search(self, simulation_no: int = SIMULATIONS, deadline: Optional[float] = None,
+               rollout_batch: int = ROLLOUT_BATCH, early_stop: bool = True) -> int:
+        """
+        Runs iterations until the first budget is used up and returns the most visited root
+        child. The budgets are `simulation_no` iterations, the time.perf_counter() `deadline`
+        and the max_nodes of the tree. With `early_stop` the search also ends once no other
+        root child can catch up with the most visited one in the iterations left, estimated
+        from the iteration rate when there is a deadline, or once the root turns out to have
+        a single (forced) child.
+        """
+        t0 = time.perf_counter()
+        stop_reason = 'simulations'
+        for i in range(1, simulation_no + 1):
+            self.tree_policy(rollout_batch)
+            if self.full:
+                stop_reason = 'nodes'
+                break
+            if i % BUDGET_CHECK_INTERVAL or i == simulation_no:
+                continue
+            remaining = simulation_no - i
+            if deadline is not None:
+                now = time.perf_counter()
+                if now >= deadline:
+                    stop_reason = 'time'
+                    break
+                remaining = min(remaining, int(i * (deadline - now) / (now - t0)) + 1)
+            if early_stop and self.n_children[0]:
+                visits = np.sort(self.visits[self.target[self.children(0)]])
+                if len(visits) == 1 or visits[-1] - visits[-2] > remaining * rollout_batch:
+                    stop_reason = 'early_stop'
+                    break
+        if self.stats is not None:
+            self.stats.stop_reason = stop_reason
+        return self.best_child()
+
+    def children(self, node: int = 0) -> np.ndarray:
+        first = self.first_child[node]
+        return np.arange(first, first + self.n_children[node])
+
+    def best_child(self, node: int = 0) -> int:
+        """
+        Returns the most visited child of `node`, the better scored one among equally visited children.
+        """
+        children = self.children(node)
+        if not children.size:
+            raise ValueError(f'node {node} has no children')
+        targets = self.target[children]
+        return int(children[np.lexsort((self.score[targets], self.visits[targets]))[-1]])
+
+    def find_child(self, node: int, key: int) -> Optional[int]:
+        """
+        Returns the child of `node` with canonical key `key`, None if there is none.
+        """
+        for child in self.children(node).tolist():
+            if int(self.key[child]) == key:
+                return child
+        return None
+
+    def subtree(self, node: int) -> 'MCTSTree':
+        """
+        Returns a new tree holding a compacted copy of the subtree below `node`, with `node`
+        as its root. In a DAG the copy holds all nodes reachable from `node`.
+        """
+        dag = self.table is not None
+        if dag:
+            node = int(self.target[node])
+        actions = []
+        ancestor = node
+        while ancestor > 0:
+            actions.append(int(self.action[ancestor]))
+            ancestor = int(self.parent[ancestor])
+        position = self.position.copy()
+        for action in reversed(actions):
+            position.play(action)
+
+        levels = [np.array([node])]
+        frontier = levels[0]
+        while frontier.size:
+            frontier = frontier[self.n_children[frontier] > 0]
+            counts = self.n_children[frontier].astype(np.int64)
+            starts = self.first_child[frontier].astype(np.int64)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            frontier = np.repeat(starts, counts) + offsets
+            if dag:
+                # all nodes of a level are at the same depth, so shared nodes are only added once
+                frontier = np.unique(np.concatenate((frontier, self.target[frontier])))
+            levels.append(frontier)
+        # the root goes first, in a DAG it may have descendants that were added before it
+        keep = np.concatenate(([node], np.sort(np.concatenate(levels[1:]))))
+        new_index = np.full(self.size, -1, dtype=np.int32)
+        new_index[keep] = np.arange(keep.size)
+
+        tree = MCTSTree.__new__(MCTSTree)
+        tree.position = position
+        tree.max_nodes = self.max_nodes
+        tree.exploration_param = self.exploration_param
+        tree.stats = None
+        tree.full = False
+        tree.mirrored = self.mirrored
+        tree.size = 0
+        tree.capacity = 0
+        for name in _NODE_ARRAYS:
+            setattr(tree, name, getattr(self, name)[keep])
+        tree.size = tree.capacity = keep.size
+        has_children = tree.n_children > 0
+        tree.first_child = np.where(has_children, new_index[np.where(has_children, tree.first_child, 0)], -1)
+        tree.first_child = tree.first_child.astype(np.int32)
+        tree.target = new_index[tree.target]
+        tree.table = None
+        if dag:
+            tree.table = {key: int(new_index[slot]) for key, slot in self.table.items() if new_index[slot] >= 0}
+        tree.parent = new_index[np.maximum(tree.parent, 0)]
+        if dag:
+            # a shared node may have been added below a parent outside the copy, it moves below
+            # a node pointing at it, so the path to every node plays its position
+            shared = np.flatnonzero(tree.target != np.arange(tree.size))
+            orphans = tree.parent[tree.target[shared]] < 0
+            tree.parent[tree.target[shared[orphans]]] = tree.parent[shared[orphans]]
+            tree.action[tree.target[shared[orphans]]] = tree.action[shared[orphans]]
+        tree.parent[0] = -1
+        tree.action[0] = -1
+        return tree
+
+
+class SharedPosition:
+    """
+    The single board all nodes of a MonteCarloTreeSearchNode tree are searched on, together
+    with the node it currently shows. Moving it to another node takes back moves and plays
+    new ones instead of copying boards.
+    """
+
+    def __init__(self, position: BitBoard):
+        self.position = position
+        self.root_moves = len(position.moves)
+        self.node = None
+
+    def move_to(self, node: 'MonteCarloTreeSearchNode') -> BitBoard:
+        """
+        Brings the board to the position of `node` and returns it.
+        """
+        if self.node is not node:
+            position = self.position
+            actions = []
+            ancestor = node
+            while ancestor.parent is not None:
+                actions.append(ancestor.parent_action)
+                ancestor = ancestor.parent
+            actions.reverse()
+            # keep the moves the board shares with the path to `node`
+            moves = position.moves
+            common = 0
+            while common < len(actions) and self.root_moves + common < len(moves) \
+                    and moves[self.root_moves + common] == actions[common]:
+                common += 1
+            for _ in range(len(moves) - self.root_moves - common):
+                position.undo()
+            for action in actions[common:]:
+                position.play(action)
+            self.node = node
+        return self.position
+
+
 class MonteCarloTreeSearchNode():
 
     def __init__(self, state, player: BoardPiece, parent=None, parent_action=None):
         """
         Initialises (constructs) the class object taking in a given state (board) and the player
 
-        :param state: np.ndarray representing the current board
-        :param player: int value defining the player playing the game
+        :param state: np.ndarray or BitBoard representing the current board. Below the root
+                      the board is shared with the parent, which must have played
+                      `parent_action` on it
+        :param player: int value defining the player to move in this state
         """
-        self.initial_state = state.copy()
-        self.state = state
+        if parent is not None:
+            self.shared = parent.shared
+        else:
+            self.shared = SharedPosition(state if isinstance(state, BitBoard) else BitBoard.from_array(state, player))
+        self.shared.node = self
         self.parent = parent
-        self.remaining_actions = None
-        self.remaining_actions = self.find_remaining_actions()
         self.parent_action = parent_action
         self.children = []
         self.player = player
         self.number_of_visits = 0
+        self.log_visits = 0.
         self.results = defaultdict(int)
         self.results[1] = 0
         self.results[-1] = 0
+        self.terminal_result = self.find_terminal_result()
+        self.remaining_actions = None
+        self.remaining_actions = self.find_remaining_actions()
 
         return
 
+    @property
+    def position(self) -> BitBoard:
+        """
+        The shared board, brought to the position of this node.
+        """
+        return self.shared.move_to(self)
+
+    @property
+    def state(self) -> np.ndarray:
+        """
+        The board of this node as an ndarray.
+        """
+        return self.position.to_array()
+
     def expand(self):
         """
         Takes the self attributes and methods and uses them to expand the current state to a new child state
         and append it to the existing children states.
         """
+        position = self.position
         action = self.remaining_actions.pop()
-        next_state = self.apply_move(self.state, action, self.player)
+        position.play(action)
 
         child_node = MonteCarloTreeSearchNode(
-            next_state, player=self.player, parent=self, parent_action=action)
+            position, player=get_opponent_player(self.player), parent=self, parent_action=action)
 
         self.children.append(child_node)
         return child_node
@@ -68,16 +628,31 @@ class MonteCarloTreeSearchNode():
         """
         Returns the remaining actions (valid columns) given the current board state.
         """
-        self.remaining_actions = get_valid_columns(self.state)
+        self.remaining_actions = self.position.valid_columns()
         return self.remaining_actions
 
+    def find_terminal_result(self):
+        """
+        Returns the game result (1,0,-1) if the game is already over in this node, None otherwise.
+        Below the root only the player who made the last move can have won.
+        """
+        pieces = (PLAYER1, PLAYER2) if self.parent is None else (get_opponent_player(self.player),)
+        for piece in pieces:
+            if self.position.is_win(piece):
+                return 1 if piece == PLAYER2 else -1
+        if self.position.is_full():
+            return 0
+        return None
+
     def score(self):
         """
         Returns a win score for the current node based on the wins and losses simulated from
-        a current board state.
+        a current board state, seen from the player who moved into this node.
         """
         wins = self.results[1]
         loses = self.results[-1]
+        if self.player == PLAYER2:
+            wins, loses = loses, wins
         return wins - loses
 
     def num_visits(self):
@@ -89,26 +664,60 @@ class MonteCarloTreeSearchNode():
     def rollout(self):
         """
         Simulates the current state using a rollout policy which randomly selects a child until
-        the game ends and returns the result of the game (1,0,-1) corresponding to the win, draw or
-        loss for the AI player.
-        """
-        current_rollout_state = self.state
-        player_ = self.player
-        while not self.is_game_over(current_rollout_state, player_):
-            remaining_moves = get_valid_columns(current_rollout_state)
-            action = self.rollout_policy(remaining_moves)
-            current_rollout_state = self.apply_move(current_rollout_state, action, player_)
-            player_ = get_opponent_player(player_)
-        return self.game_result(current_rollout_state, player_)
+        the game ends and returns the result of the game (1,0,-1) corresponding to a win for
+        PLAYER2, a draw or a win for PLAYER1.
+        """
+        if self.terminal_result is not None:
+            return self.terminal_result
+        position = self.position
+        start = len(position.moves)
+        while True:
+            mover = position.player
+            action = self.rollout_policy(position.valid_columns())
+            position.play(action)
+            if position.last_move_won():
+                result = 1 if mover == PLAYER2 else -1
+                break
+            if position.is_full():
+                result = 0
+                break
+        for _ in range(len(position.moves) - start):
+            position.undo()
+        return result
+
+    def rollout_batch(self, n_games):
+        """
+        Simulates `n_games` random games from the current state at once and returns the
+        number of results (1,0,-1) as a dict, to be passed to backpropagate_results.
+        """
+        if self.terminal_result is not None:
+            return {self.terminal_result: n_games}
+        return batch_rollout(self.position, n_games)
 
     def backpropagate(self, result):
         """
-        Takes in the game result from the rollout and backpropagates the value to the parent node.
+        Takes in the game result from the rollout and adds it to this node and all its parents.
         """
-        self.number_of_visits += 1.
-        self.results[result] += 1.
-        if self.parent:
-            self.parent.backpropagate(result)
+        node = self
+        while node is not None:
+            node.number_of_visits += 1
+            node.results[result] += 1
+            node.log_visits = math.log(node.number_of_visits)
+            node = node.parent
+
+    def backpropagate_results(self, results):
+        """
+        Takes in the result counts of a batch of rollouts and backpropagates them to the parent
+        nodes in one update per node.
+        """
+        node = self
+        n_games = sum(results.values())
+        while node is not None:
+            node.number_of_visits += n_games
+            for result, count in results.items():
+                node.results[result] += count
+            node.log_visits = math.log(node.number_of_visits)
+            node = node.parent
 
     def is_fully_expanded(self):
         """
@@ -116,46 +725,56 @@ class MonteCarloTreeSearchNode():
         """
         return len(self.remaining_actions) == 0
 
+    def is_terminal(self):
+        """
+        Checks if the game is over in the current board state.
+        """
+        return self.terminal_result is not None
+
     def best_child(self, exploration_param=1.414):
         """
         Returns the best child to the current state with the highest UCB score among them.
         """
-        ucb_scores = [(c.score() / c.num_visits()) + exploration_param * np.sqrt((2 * np.log(self.num_visits()) / c.num_visits())) for c in self.children]
-        return self.children[np.argmax(ucb_scores)]
+        visits = np.array([c.number_of_visits for c in self.children], dtype=np.float64)
+        scores = np.array([c.score() for c in self.children], dtype=np.float64)
+        ucb_scores = scores / visits + exploration_param * np.sqrt(2 * self.log_visits / visits)
+        return self.children[int(ucb_scores.argmax())]
 
     def rollout_policy(self, remaining_moves):
         """
         Takes in the possible remaining moves in the current board state and returns a random move.
         """
-        return np.random.choice(remaining_moves)
+        return random.choice(remaining_moves)
 
-    def tree_policy(self):
+    def tree_policy(self, rollout_batch=ROLLOUT_BATCH):
         """
         Traverses through the game tree gets the rewards for the nodes, expand nodes if they were
         visited before and then rolls out(simulates) otherwise just rolls out the current node.
+        With rollout_batch > 1 that many games are simulated from the node at once.
         """
 
         current_node = self
-        while current_node.is_fully_expanded():
+        while current_node.is_fully_expanded() and current_node.children:
             current_node = current_node.best_child()
 
         # fully_expanded_node = current_node
-        if current_node.number_of_visits != 0:
+        if current_node.number_of_visits != 0 and not current_node.is_terminal():
             current_node = current_node.expand()
 
-        reward = current_node.rollout()
-        current_node.backpropagate(reward)
+        if rollout_batch > 1:
+            current_node.backpropagate_results(current_node.rollout_batch(rollout_batch))
+        else:
+            reward = current_node.rollout()
+            current_node.backpropagate(reward)
 
-    def best_simulated_action(self):
+    def best_simulated_action(self, rollout_batch=ROLLOUT_BATCH, simulation_no=SIMULATIONS):
         """
         Runs the Monte Carlo simulation through the game tree for the specified number of times
         and returns the best move.
         """
-        simulation_no = 3000
-
         for i in range(simulation_no):
-            self.tree_policy()
-        return self.best_child()
+            self.tree_policy(rollout_batch)
+        return self.best_child(exploration_param=0.)
 
     def game_result(self, curr_state, player_r):
         """
@@ -172,27 +791,149 @@ class MonteCarloTreeSearchNode():
         if game_state == 'IS_WIN' and player_r == PLAYER1:
             return -1
 
-    def is_game_over(self, curr_state, player):
+    def is_game_over(self, curr_state, player, last_action=None):
         """
-        Checks if game is over based on the current board state and the player.
+        Checks if game is over based on the current board state and the player who made the
+        last move. Only that player can have ended the game, so a single check is needed;
+        giving `last_action` restricts it to the lines through the last piece.
         """
-        if check_end_state(curr_state, player) == GameState.STILL_PLAYING or check_end_state(curr_state, get_opponent_player(player)) == GameState.STILL_PLAYING:
-            return False
-        else:
-            return True
+        return check_end_state(curr_state, player, last_action) != GameState.STILL_PLAYING
 
     def apply_move(self, board:np.ndarray, action: PlayerAction, player_playing:BoardPiece):
         """
-        Applies the action selected for a given player to the current board state and returns the
-        modified board.
+        Applies the action selected for a given player to a copy of the current board state and
+        returns the modified board. The search itself plays on the shared BitBoard instead.
         """
-        b = apply_player_action(board, action, player_playing, True)
-        return b
+        return apply_player_action(board, action, player_playing, True)
 
 
-def generate_move_mcts(board: np.ndarray, player: BoardPiece, saved_state: Optional[SavedState]
-                       ) -> Tuple[PlayerAction, Optional[SavedState]]:
-    root = MonteCarloTreeSearchNode(state=board, player=player)
-    best_node = root.best_simulated_action()
-    action = PlayerAction(int(best_node.parent_action))
+class MCTSSavedState(SavedState):
+    """
+    Keeps the subtree below the last move of the MCTS agent, so its statistics are reused
+    after the opponent has replied.
+    """
+
+    def __init__(self, player: BoardPiece, tree: Optional[MCTSTree] = None):
+        self.player = player
+        self.tree = tree
+
+
+def find_subtree(tree: Optional[MCTSTree], position: BitBoard) -> Optional[MCTSTree]:
+    """
+    Returns the subtree of `tree` below the root child holding `position` or its mirror image,
+    as the tree to continue the search in, or None if neither was expanded.
+    """
+    if tree is None:
+        return None
+    child = tree.find_child(0, position.canonical_key()[0])
+    if child is None:
+        return None
+    subtree = tree.subtree(child)
+    subtree.mirrored = subtree.position.key() != position.key()
+    # a node decided by its threats is terminal without children, the root has to be searched
+    subtree.terminal[0] = terminal_result(subtree.position, last_mover_only=False)
+    return subtree
+
+
+def search_root_statistics(position: BitBoard, simulation_no: int, rollout_batch: int = ROLLOUT_BATCH,
+                           seed: Optional[int] = None, deadline: Optional[float] = None,
+                           max_nodes: int = MAX_NODES, dag: bool = False):
+    """
+    Grows a tree (or a DAG) from `position` and returns the statistics of the root children as a dict
+    action -> (visits, score for the player to move). Run by every worker of the root parallel
+    search, `seed` gives each worker its own random games. `deadline` is a time.time() value,
+    as the clocks of time.perf_counter() are not shared between processes.
+    """
+    global _rng
+    if seed is not None:
+        random.seed(seed)
+        _rng = np.random.default_rng(seed)
+    if deadline is not None:
+        deadline = time.perf_counter() + deadline - time.time()
+    tree = MCTSTree(position, max_nodes, dag=dag)
+    tree.search(simulation_no, deadline, rollout_batch, early_stop=False)
+    return {int(tree.action[child]): (int(tree.visits[child]), int(tree.score[child]))
+            for child in tree.children(0)}
+
+
+def root_parallel_search(position: BitBoard, simulation_no: int, workers: int,
+                         rollout_batch: int = ROLLOUT_BATCH, time_limit: Optional[float] = None,
+                         max_nodes: int = MAX_NODES, dag: bool = False) -> int:
+    """
+    Splits `simulation_no` and `max_nodes` over `workers` processes that each search their own
+    tree from the same root within `time_limit` seconds, merges the root children statistics
+    and returns the action with the most merged visits.
+    """
+    deadline = None if time_limit is None else time.time() + time_limit
+    seeds = np.random.SeedSequence().generate_state(workers)
+    shares = [simulation_no // workers + (i < simulation_no % workers) for i in range(workers)]
+    futures = [get_process_pool(workers).submit(search_root_statistics, position, share, rollout_batch, int(seed),
+                                                deadline, max_nodes // workers, dag)
+               for share, seed in zip(shares, seeds)]
+    merged = defaultdict(lambda: [0, 0])
+    for future in futures:
+        for action, (visits, score) in future.result().items():
+            merged[action][0] += visits
+            merged[action][1] += score
+    return max(merged, key=lambda action: tuple(merged[action]))
+
+
+def generate_move_mcts(board: np.ndarray, player: BoardPiece, saved_state: Optional[SavedState],
+                       simulation_no: int = SIMULATIONS, time_limit: Optional[float] = None,
+                       max_nodes: int = MAX_NODES, workers: int = 1, rollout_batch: int = ROLLOUT_BATCH,
+                       dag: bool = False, stats_callback: Optional[Callable[[MCTSStats], None]] = None,
+                       profile: bool = False) -> Tuple[PlayerAction, Optional[SavedState]]:
+    """
+
+    :param board: Contains current state of the board an ndarray, shape (ROWS, COLUMNS) and data type (dtype) BoardPiece
+    :param player: Current player playing the game
+    :param saved_state: Saved state of the game, an MCTSSavedState keeps the search tree
+                        between moves when searching in this process
+    :param simulation_no: maximum number of tree_policy iterations
+    :param time_limit: seconds the search may take at most, None for no time limit
+    :param max_nodes: maximum number of tree nodes, the search stops when the tree is full
+    :param workers: number of processes the iterations are split over, 1 searches in this process
+    :param rollout_batch: random games played from every selected leaf
+    :param dag: if True, positions reached through different orders of moves share one node
+    :param stats_callback: if given, the search is instrumented and this is called with the
+                           MCTSStats of the move; a root parallel search only reports its
+                           simulations and time
+    :param profile: if True (and stats_callback is given) the move is run under cProfile and
+                    the stats get the collected pstats.Stats
+    :return: action: The column to be played
+            saved_state: The saved state of the game
+
+    """
+    t0 = time.perf_counter()
+    deadline = None if time_limit is None else t0 + time_limit
+    stats = MCTSStats() if stats_callback is not None else None
+    position = BitBoard.from_array(board, player)
+    if workers > 1:
+        action = PlayerAction(root_parallel_search(position, simulation_no, workers, rollout_batch, time_limit,
+                                                   max_nodes, dag))
+        if stats is not None:
+            stats.simulations = simulation_no
+            stats.time = time.perf_counter() - t0
+            stats_callback(stats)
+        return action, saved_state
+    if not isinstance(saved_state, MCTSSavedState) or saved_state.player != player:
+        saved_state = MCTSSavedState(player)
+    tree = find_subtree(saved_state.tree, position)
+    if tree is None or (tree.table is not None) != dag:
+        tree = MCTSTree(position, max_nodes, dag=dag)
+    tree.max_nodes = max_nodes
+    tree.stats = stats
+    search_args = (simulation_no, deadline, rollout_batch)
+    if stats is not None and profile:
+        best_child, stats.profile = run_profiled(tree.search, *search_args)
+    else:
+        best_child = tree.search(*search_args)
+    action = int(tree.action[best_child])
+    action = PlayerAction(mirror_column(action) if tree.mirrored else action)
+    if stats is not None:
+        stats.tree_size = tree.size
+        stats.time = time.perf_counter() - t0
+        stats_callback(stats)
+    # keep only the subtree below our move, the opponent's reply is looked up there next time
+    saved_state.tree = tree.subtree(best_child)
     return action, saved_state
@@ -0,0 +1,261 @@
+"""
+Binary files of positions and of games, for datasets logged from self-play. Both are a
+header followed by fixed size records, so files are written by appending and read through a
+memory map, one batch of records at a time, without loading them:
+
+- positions: the bitboards of PLAYER1 and PLAYER2 as uint64 and the player to move, 17 bytes
+- games: the columns played, 3 bits each and 21 to a uint64, the number of moves and the
+  winner (NO_PLAYER for a draw or a game that was not finished), 18 bytes
+
+The header holds a magic string telling the kind of file, the format version and the size
+of a record. The number of records follows from the size of the file, so a file cut short
+by a crashed writer stays readable up to its last complete record.
+"""
+import os
+from typing import Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from agents.common import BoardPiece, NO_PLAYER, PLAYER1, PLAYER2, ROWS, COLUMNS, BitBoard, boards_to_masks, \
+    masks_to_boards
+
+POSITIONS_MAGIC = b'C4POSREC'
+GAMES_MAGIC = b'C4GAMREC'
+VERSION = 1
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('record_size', '<u4')])
+POSITION_DTYPE = np.dtype([('masks', '<u8', (2,)), ('to_move', 'u1')])
+GAME_DTYPE = np.dtype([('moves', '<u8', (2,)), ('length', 'u1'), ('winner', 'u1')])
+MOVE_BITS = 3
+MAX_MOVES = ROWS * COLUMNS
+MOVES_PER_WORD = MAX_MOVES // 2
+BATCH_SIZE = 1 << 16  # records per batch read from a file
+WRITE_BUFFER = 1 << 12  # records collected by a writer before they are written out
+_MOVE_SHIFTS = np.arange(MOVES_PER_WORD, dtype=np.uint64) * np.uint64(MOVE_BITS)
+
+
+def encode_positions(boards: np.ndarray, players) -> np.ndarray:
+    """
+    Returns the position records of boards of shape (N, ROWS, COLUMNS) with the player to
+    move on every board, shape (N,).
+    """
+    n = len(boards)
+    records = np.zeros(n, dtype=POSITION_DTYPE)
+    records['masks'][:, 0] = boards_to_masks(boards, np.full(n, PLAYER1))
+    records['masks'][:, 1] = boards_to_masks(boards, np.full(n, PLAYER2))
+    records['to_move'] = players
+    return records
+
+
+def decode_positions(records: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the boards, shape (N, ROWS, COLUMNS), and the players to move, shape (N,), of
+    position records.
+    """
+    return masks_to_boards(np.asarray(records['masks'])), np.asarray(records['to_move'], dtype=BoardPiece)
+
+
+def encode_game(moves: Sequence[int], winner: BoardPiece = NO_PLAYER) -> np.ndarray:
+    """
+    Returns the record of a game played with the columns `moves`, a 0-d array of GAME_DTYPE.
+    """
+    if len(moves) > MAX_MOVES:
+        raise ValueError(f'a game has at most {MAX_MOVES} moves, got {len(moves)}')
+    words = [0, 0]
+    for i, col in enumerate(moves):
+        if not 0 <= col < COLUMNS:
+            raise ValueError(f'column {col} out of range')
+        words[i // MOVES_PER_WORD] |= int(col) << (MOVE_BITS * (i % MOVES_PER_WORD))
+    return np.array((words, len(moves), winner), dtype=GAME_DTYPE)
+
+
+def decode_games(records: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the moves of game records, shape (N, MAX_MOVES) with -1 after the last move of
+    every game, their number of moves, shape (N,), and their winners, shape (N,).
+    """
+    words = np.asarray(records['moves'])
+    lengths = np.asarray(records['length'], dtype=np.int64)
+    moves = ((words[:, :, None] >> _MOVE_SHIFTS) & np.uint64(7)).reshape(-1, MAX_MOVES).astype(np.int8)
+    moves[np.arange(MAX_MOVES) >= lengths[:, None]] = -1
+    return moves, lengths, np.asarray(records['winner'], dtype=BoardPiece)
+
+
+def game_positions(moves: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Replays a game and returns the boards before every move and after the last one, shape
+    (len(moves) + 1, ROWS, COLUMNS), with the player to move on every board.
+    """
+    position = BitBoard()
+    masks = np.zeros((len(moves) + 1, 2), dtype=np.uint64)
+    players = np.zeros(len(moves) + 1, dtype=BoardPiece)
+    for i, col in enumerate(moves):
+        masks[i] = position.masks
+        players[i] = position.player
+        position.play(int(col))
+    masks[-1] = position.masks
+    players[-1] = position.player
+    return masks_to_boards(masks), players
+
+
+class _RecordWriter:
+    """
+    Streams records of `dtype` to a file, starting it with a header unless an existing file
+    of the same kind is appended to. Records are buffered and written WRITE_BUFFER at a time.
+    """
+    magic = None
+    dtype = None
+
+    def __init__(self, path: str, append: bool = False, buffer_size: int = WRITE_BUFFER):
+        self.path = path
+        self.buffer = np.zeros(buffer_size, dtype=self.dtype)
+        self.buffered = 0
+        self.written = 0
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            _read_header(path, self.magic, self.dtype)
+            self.file = open(path, 'ab')
+            # a record cut short by a crashed writer is dropped, the appended ones would follow it misaligned
+            self.file.truncate(HEADER_DTYPE.itemsize + _record_count(path, self.dtype) * self.dtype.itemsize)
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(np.array([(self.magic, VERSION, self.dtype.itemsize)], dtype=HEADER_DTYPE).tobytes())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write_records(self, records: np.ndarray):
+        if self.buffered + len(records) > len(self.buffer):
+            self.flush()
+        if len(records) >= len(self.buffer):
+            self.file.write(records.tobytes())
+            self.written += len(records)
+            return
+        self.buffer[self.buffered:self.buffered + len(records)] = records
+        self.buffered += len(records)
+
+    def flush(self):
+        if self.buffered:
+            self.file.write(self.buffer[:self.buffered].tobytes())
+            self.written += self.buffered
+            self.buffered = 0
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class PositionWriter(_RecordWriter):
+    """
+    Streams positions to a file of position records.
+    """
+    magic = POSITIONS_MAGIC
+    dtype = POSITION_DTYPE
+
+    def write(self, position: BitBoard):
+        self.write_records(np.array([(position.masks, position.player)], dtype=POSITION_DTYPE))
+
+    def write_boards(self, boards: np.ndarray, players):
+        self.write_records(encode_positions(boards, players))
+
+
+class GameWriter(_RecordWriter):
+    """
+    Streams games to a file of game records.
+    """
+    magic = GAMES_MAGIC
+    dtype = GAME_DTYPE
+
+    def write(self, moves: Sequence[int], winner: BoardPiece = NO_PLAYER):
+        self.write_records(encode_game(moves, winner).reshape(1))
+
+
+def _record_count(path: str, dtype: np.dtype) -> int:
+    """
+    Returns the number of complete records of `dtype` after the header of the file at `path`.
+    """
+    return (os.path.getsize(path) - HEADER_DTYPE.itemsize) // dtype.itemsize
+
+
+def _read_header(path: str, magic: bytes, dtype: np.dtype):
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) != 1 or header['magic'][0] != magic:
+        raise ValueError(f'{path} is not a file of {magic.decode()} records')
+    if header['version'][0] != VERSION or header['record_size'][0] != dtype.itemsize:
+        raise ValueError(f'{path} has version {header["version"][0]}, only version {VERSION} can be read')
+
+
+class _RecordReader:
+    """
+    Read-only view of a file of records, memory-mapped on construction.
+    """
+    magic = None
+    dtype = None
+
+    def __init__(self, path: str):
+        _read_header(path, self.magic, self.dtype)
+        count = _record_count(path, self.dtype)
+        if count:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r', offset=HEADER_DTYPE.itemsize,
+                                     shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def record_batches(self, batch_size: int = BATCH_SIZE, start: int = 0,
+                       stop: Optional[int] = None) -> Iterator[np.ndarray]:
+        """
+        Yields the records from `start` to `stop` in slices of `batch_size`, each one read
+        from the file when it is yielded.
+        """
+        stop = len(self.records) if stop is None else min(stop, len(self.records))
+        for first in range(start, stop, batch_size):
+            yield self.records[first:min(first + batch_size, stop)]
+
+
+class PositionReader(_RecordReader):
+    """
+    Reads a file of position records in batches of boards.
+    """
+    magic = POSITIONS_MAGIC
+    dtype = POSITION_DTYPE
+
+    def __getitem__(self, i: int) -> BitBoard:
+        record = self.records[i]
+        return BitBoard.from_array(masks_to_boards(record['masks'][None])[0], BoardPiece(record['to_move']))
+
+    def batches(self, batch_size: int = BATCH_SIZE, start: int = 0,
+                stop: Optional[int] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Yields (boards, players) of `batch_size` positions at a time, boards of shape
+        (N, ROWS, COLUMNS) and the players to move of shape (N,).
+        """
+        for records in self.record_batches(batch_size, start, stop):
+            yield decode_positions(records)
+
+
+class GameReader(_RecordReader):
+    """
+    Reads a file of game records, one game or one batch of games at a time.
+    """
+    magic = GAMES_MAGIC
+    dtype = GAME_DTYPE
+
+    def __getitem__(self, i: int) -> Tuple[List[int], BoardPiece]:
+        """
+        Returns the moves and the winner of game `i`.
+        """
+        moves, lengths, winners = decode_games(self.records[i:i + 1])
+        return moves[0, :lengths[0]].tolist(), winners[0]
+
+    def batches(self, batch_size: int = BATCH_SIZE, start: int = 0,
+                stop: Optional[int] = None) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Yields (moves, lengths, winners) of `batch_size` games at a time, as returned by
+        `decode_games`.
+        """
+        for records in self.record_batches(batch_size, start, stop):
+            yield decode_games(records)
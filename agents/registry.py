@@ -0,0 +1,63 @@
+"""
+Agents by name. An agent's module is only imported when the agent is first asked for, so
+a process pays for the agents it plays with and nothing else: importing this module only
+loads agents.common.
+
+    gen_move = get_agent('mcts')
+"""
+import importlib
+from typing import Dict, List, NamedTuple, Optional
+from agents.common import GenMove
+
+
+class AgentSpec(NamedTuple):
+    """
+    Where to find an agent: the GenMove named `attribute` in `module`, and the keyword
+    argument taking the seconds a move may use, None if the agent has no time limit.
+    """
+    module: str
+    attribute: str
+    time_limit_keyword: Optional[str] = None
+
+
+AGENTS: Dict[str, AgentSpec] = {
+    'random': AgentSpec('agents.agent_random', 'generate_move'),
+    'minimax': AgentSpec('agents.agent_minimax', 'gen_move_minimax', 'time_limit'),
+    'mcts': AgentSpec('agents.new_agent', 'gen_move_mcts', 'time_limit'),
+    'solver': AgentSpec('agents.agent_solver', 'gen_move_solver', 'time_limit'),
+}
+_loaded: Dict[str, GenMove] = {}
+
+
+def register_agent(name: str, module: str, attribute: str, time_limit_keyword: Optional[str] = None):
+    """
+    Makes the GenMove `attribute` of `module` available as `name`, replacing any agent of
+    that name. The module is not imported until the agent is used.
+    """
+    AGENTS[name] = AgentSpec(module, attribute, time_limit_keyword)
+    _loaded.pop(name, None)
+
+
+def agent_names() -> List[str]:
+    return sorted(AGENTS)
+
+
+def get_agent(name: str) -> GenMove:
+    """
+    Returns the GenMove of the agent `name`, importing its module on first use.
+    """
+    if name not in _loaded:
+        if name not in AGENTS:
+            raise ValueError(f'unknown agent {name!r}, choose from {agent_names()}')
+        spec = AGENTS[name]
+        _loaded[name] = getattr(importlib.import_module(spec.module), spec.attribute)
+    return _loaded[name]
+
+
+def time_limit_kwargs(name: str, time_limit: Optional[float]) -> dict:
+    """
+    Returns the keyword arguments giving the agent `name` `time_limit` seconds per move,
+    none if it is None or the agent takes no time limit.
+    """
+    keyword = AGENTS[name].time_limit_keyword
+    return {keyword: time_limit} if keyword is not None and time_limit is not None else {}
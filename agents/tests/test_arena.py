@@ -0,0 +1,51 @@
+import json
+import arena
+from agents.agent_random import generate_move
+from agents.common import PLAYER2, PlayerAction, get_valid_columns
+
+
+def first_column(board, player, saved_state):
+    return PlayerAction(get_valid_columns(board)[0]), saved_state
+
+
+def own_column(board, player, saved_state):
+    return PlayerAction(player - 1), saved_state
+
+
+def illegal_column(board, player, saved_state):
+    return PlayerAction(-1), saved_state
+
+
+def test_play_game():
+    """
+    Each agent stacks its pieces in a column of its own, so the player moving first wins
+    """
+    record = arena.play_game(own_column, own_column, agent_1_first=False)
+    assert record['winner'] == 2
+    assert record['agent_1_player'] == PLAYER2
+    assert record['moves'] == [0, 1, 0, 1, 0, 1, 0]
+    assert len(record['move_times']) == 7
+
+
+def test_play_game_illegal_move():
+    record = arena.play_game(first_column, illegal_column)
+    assert record['winner'] == 1
+    assert record['illegal_move']
+
+
+def test_run_arena(tmp_path):
+    output = tmp_path / 'games.jsonl'
+    summary = arena.run_arena(generate_move, generate_move, 6, output=str(output), seed=0)
+    assert summary['games'] == 6
+    assert summary['agent_1_wins'] + summary['agent_2_wins'] + summary['draws'] == 6
+    low, high = summary['agent_1_score_ci95']
+    assert 0. <= low <= summary['agent_1_score'] <= high <= 1.
+
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(record['game'] for record in records) == list(range(6))
+    assert [record['agent_1_player'] for record in sorted(records, key=lambda r: r['game'])] == [1, 2] * 3
+
+
+def test_wilson_interval():
+    low, high = arena.wilson_interval(50, 100)
+    assert abs(low - 0.404) < 1e-3 and abs(high - 0.596) < 1e-3
@@ -0,0 +1,43 @@
+from benchmarks import suite
+
+
+def test_make_positions_reproducible():
+    positions = suite.make_positions(8)
+    again = suite.make_positions(8)
+    assert [p.key() for p in positions] == [p.key() for p in again]
+    assert all(not p.last_move_won() and not p.is_full() for p in positions)
+
+
+def test_compare_reports_regressions():
+    baseline = {
+        'primitives': {'connected_four': 1000.},
+        'agents': {'mcts_300': {'nodes_per_second': 100., 'latency_ms': {'p50': 10., 'p99': 20.}}},
+    }
+    results = {
+        'primitives': {'connected_four': 900.},
+        'agents': {'mcts_300': {'nodes_per_second': 50., 'latency_ms': {'p50': 10., 'p99': 30.}}},
+    }
+    assert suite.compare(results, baseline, tolerance=0.25) == [
+        'mcts_300: 50 nodes/s, baseline 100 nodes/s',
+        'mcts_300: p99 latency 30.0 ms, baseline 20.0 ms',
+    ]
+    assert suite.compare(baseline, baseline) == []
+
+
+def test_median_results():
+    runs = [{'meta': {'seed': 1}, 'primitives': {'connected_four': value},
+             'agents': {'mcts_300': {'nodes_per_second': value, 'latency_ms': {'p50': -value}}}}
+            for value in (3., 1., 2.)]
+    assert suite.median_results(runs) == {
+        'meta': {'seed': 1, 'runs': 3}, 'primitives': {'connected_four': 2.},
+        'agents': {'mcts_300': {'nodes_per_second': 2., 'latency_ms': {'p50': -2.}}},
+    }
+
+
+def test_counting_bitboard():
+    position = suite.make_positions(1)[0]
+    counting = suite.counting_copy(position)
+    counting.play(counting.valid_columns()[0])
+    counting.undo()
+    assert counting.plays == 1
+    assert counting.key() == position.key()
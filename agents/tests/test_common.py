@@ -1,6 +1,11 @@
+import random
 import numpy as np
-from agents.common import BoardPiece, NO_PLAYER, PLAYER1, PLAYER2
+import pytest
+from agents.common import BoardPiece, NO_PLAYER, PLAYER1, PLAYER2, PlayerAction, connected_four, BitBoard
 from agents.common import pretty_print_board, string_to_board, initialize_game_state, apply_player_action
+from agents.common import check_end_state, GameState, mirror_mask, boards_to_masks, valid_columns_batch
+from agents.common import generate_moves_batch
+from agents.agent_random import generate_move, generate_moves_random_batch
 
 
 def test_initialize_game_state():
@@ -34,11 +39,178 @@ def test_string_to_board() -> str:
     ret = string_to_board(board_test)
 
     assert isinstance(ret,np.ndarray)
+    assert np.all(ret == board)
+
+    board[0, 1:4] = PLAYER1
+    board[1, 2] = PLAYER2
+    board[0:6, 6] = PLAYER2
+    assert np.all(string_to_board(pretty_print_board(board)) == board)
 
 def test_apply_player_action():
+    test_board = initialize_game_state()
+    ret = apply_player_action(test_board, 3, PLAYER1)
+    assert ret is test_board
+    assert test_board[0, 3] == PLAYER1
+    copied = apply_player_action(test_board, 3, PLAYER2, copy=True)
+    assert copied[1, 3] == PLAYER2 and test_board[1, 3] == NO_PLAYER
+    for _ in range(5):
+        apply_player_action(test_board, 3, PLAYER2)
+    with pytest.raises(ValueError):
+        apply_player_action(test_board, 3, PLAYER1)
+
+
 
+def test_connected_four():
     test_board = initialize_game_state()
-    ret = pretty_print_board(test_board)
+    test_board[0, 0:3] = PLAYER1
+    assert not connected_four(test_board, PLAYER1)
+    test_board[0, 3] = PLAYER1
+    assert connected_four(test_board, PLAYER1)
+    assert not connected_four(test_board, PLAYER2)
+
+    test_board = initialize_game_state()
+    for i in range(4):
+        test_board[i, 3 - i] = PLAYER2
+    assert connected_four(test_board, PLAYER2)
+
+
+def test_bitboard_round_trip():
+    test_board = initialize_game_state()
+    test_board[0, 1] = PLAYER1
+    test_board[1, 1] = PLAYER2
+    test_board[0, 2] = PLAYER1
+    test_board[0, 6] = PLAYER2
+    position = BitBoard.from_array(test_board)
+
+    assert position.player == PLAYER1
+    assert np.all(position.to_array() == test_board)
+
 
+def test_bitboard_play_undo():
+    position = BitBoard()
+    key = position.key()
+    for col in (3, 3, 4, 2):
+        position.play(col)
+    test_board = initialize_game_state()
+    for col, player in zip((3, 3, 4, 2), (PLAYER1, PLAYER2, PLAYER1, PLAYER2)):
+        apply_player_action(test_board, col, player)
+    assert np.all(position.to_array() == test_board)
+
+    for _ in range(4):
+        position.undo()
+    assert position.key() == key
+    assert position.player == PLAYER1
+
+
+def test_bitboard_full_column():
+    position = BitBoard()
+    for _ in range(6):
+        position.play(0)
+    assert not position.can_play(0)
+    assert position.valid_columns() == [1, 2, 3, 4, 5, 6]
+    assert not position.is_win(PLAYER1)
+
+
+def test_connected_four_last_action():
+    test_board = initialize_game_state()
+    test_board[0, 0:3] = PLAYER1
+    test_board[1, 2] = PLAYER2
+    apply_player_action(test_board, PlayerAction(3), PLAYER1)
+    assert connected_four(test_board, PLAYER1, PlayerAction(3))
+    assert not connected_four(test_board, PLAYER2, PlayerAction(3))
+    # only the lines through the top piece of the given column are checked
+    assert not connected_four(test_board, PLAYER1, PlayerAction(2))
+
+    test_board = initialize_game_state()
+    for i in range(4):
+        test_board[0:i, i] = PLAYER2
+    test_board[0:4, 0:4][np.eye(4, dtype=bool)] = PLAYER1
+    assert connected_four(test_board, PLAYER1, PlayerAction(3))
 
 
+def test_check_end_state_last_action():
+    test_board = initialize_game_state()
+    test_board[0:3, 5] = PLAYER2
+    assert check_end_state(test_board, PLAYER2, PlayerAction(5)) == GameState.STILL_PLAYING
+    apply_player_action(test_board, PlayerAction(5), PLAYER2)
+    assert check_end_state(test_board, PLAYER2, PlayerAction(5)) == GameState.IS_WIN
+
+
+def test_bitboard_canonical_key():
+    position, mirror = BitBoard(), BitBoard()
+    assert position.is_symmetric()
+    for col in [3, 0, 2, 6, 6]:
+        position.play(col)
+        mirror.play(6 - col)
+    assert position.canonical_key()[0] == mirror.canonical_key()[0]
+    assert position.canonical_key()[1] != mirror.canonical_key()[1]
+    assert not position.is_symmetric()
+    assert mirror_mask(position.masks[0]) == mirror.masks[0]
+    from_array = BitBoard.from_array(position.to_array(), position.player)
+    assert from_array.hashes == position.hashes
+    position.undo()
+    mirror.undo()
+    assert position.canonical_key()[0] == mirror.canonical_key()[0]
+    assert position.key() == BitBoard.from_array(position.to_array(), position.player).key()
+
+
+def test_batch_helpers():
+    board = initialize_game_state()
+    board[:, 2] = PLAYER1
+    board[0, 3] = PLAYER2
+    boards = np.stack([initialize_game_state(), board])
+    assert valid_columns_batch(boards).tolist() == [[True] * 7, [True, True, False, True, True, True, True]]
+    position = BitBoard.from_array(board)
+    assert boards_to_masks(boards, np.array([PLAYER1, PLAYER2])).tolist() == [0, position.masks[1]]
+    assert boards_to_masks(boards[1:], np.array([PLAYER1])).tolist() == [position.masks[0]]
+
+
+def test_generate_moves_batch():
+    board = initialize_game_state()
+    board[:, 0:6] = PLAYER1
+    boards = np.stack([board] * 8)
+    players = np.array([PLAYER2] * 8)
+    for gen_moves in (lambda *batch: generate_moves_batch(generate_move, *batch), generate_moves_random_batch):
+        actions, states = gen_moves(boards, players, [None] * 8)
+        assert actions.tolist() == [6] * 8
+        assert states == [None] * 8
+    actions, _ = generate_moves_random_batch(np.stack([initialize_game_state()] * 64), np.array([PLAYER1] * 64),
+                                             [None] * 64)
+    assert len(set(actions.tolist())) > 1
+
+
+def test_bitboard_threats():
+    """
+    The threat map agrees with playing every column and looking at the result
+    """
+    position = BitBoard()
+    for col in (0, 4, 0, 5, 0, 6):
+        position.play(col)
+    threats = position.threats()
+    assert threats.own_wins == [0] and threats.opponent_wins == [3]
+    assert threats.replies(position.valid_columns()) == [0]
+
+    rng = random.Random(7)
+    for _ in range(200):
+        position = BitBoard()
+        while not position.last_move_won() and not position.is_full():
+            threats = position.threats()
+            wins = ([], [])
+            losing = []
+            for col in position.valid_columns():
+                for turn in (0, 1):
+                    position.turn = turn
+                    position.play(col)
+                    if position.last_move_won():
+                        wins[turn].append(col)
+                    position.undo()
+                position.turn = threats.turn
+                position.play(col)
+                if position.can_play(col):
+                    position.play(col)
+                    if position.last_move_won():
+                        losing.append(col)
+                    position.undo()
+                position.undo()
+            assert threats.wins == wins and threats.losing == losing
+            position.play(rng.choice(position.valid_columns()))
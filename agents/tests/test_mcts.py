@@ -1,6 +1,8 @@
+import sys
+import time
 import numpy as np
 from agents.new_agent import mcts_agent
-from agents.common import BoardPiece, NO_PLAYER, PLAYER1, PLAYER2
+from agents.common import BoardPiece, NO_PLAYER, PLAYER1, PLAYER2, BitBoard
 from agents.common import pretty_print_board, string_to_board, initialize_game_state, apply_player_action
 
 
@@ -71,3 +73,316 @@ def test_game_result():
     test_node = mcts_agent.MonteCarloTreeSearchNode(state=test_board, player=PLAYER1)
     ret = test_node.game_result(test_board, PLAYER1)
     assert (ret == -1)
+
+
+def test_generate_move_mcts_blocks_win():
+    """
+    PLAYER1 threatens to complete column 3, the search has to block it
+    """
+    test_board = initialize_game_state()
+    test_board[0:3, 3] = PLAYER1
+    test_board[0:2, 4] = PLAYER2
+    action, _ = mcts_agent.generate_move_mcts(test_board, PLAYER2, None)
+    assert action == 3
+
+
+def test_is_game_over():
+    test_board = initialize_game_state()
+    test_board[0:3, 2] = PLAYER1
+    test_node = mcts_agent.MonteCarloTreeSearchNode(state=test_board, player=PLAYER2)
+    assert not test_node.is_game_over(test_board, PLAYER1, 2)
+    apply_player_action(test_board, 2, PLAYER1)
+    assert test_node.is_game_over(test_board, PLAYER1, 2)
+
+
+def test_apply_move_copies_board():
+    test_board = initialize_game_state()
+    test_node = mcts_agent.MonteCarloTreeSearchNode(state=test_board, player=PLAYER2)
+    new_board = test_node.apply_move(test_board, 3, PLAYER2)
+    assert new_board[0, 3] == PLAYER2
+    assert (test_board == NO_PLAYER).all()
+
+
+def test_batch_rollout():
+    results = mcts_agent.batch_rollout(BitBoard(), 200, np.random.default_rng(0))
+    assert sorted(results) == [-1, 0, 1]
+    assert sum(results.values()) == 200
+    assert results[1] > 0 and results[-1] > 0
+
+
+def test_rollouts_follow_threats():
+    """
+    PLAYER1 to move cannot block both wins of PLAYER2 in row 0, so every rollout is a loss
+    decided without playing a move
+    """
+    test_board = initialize_game_state()
+    test_board[0, 2:5] = PLAYER2
+    test_board[0:2, 0] = PLAYER1
+    test_board[0, 6] = PLAYER1
+    position = BitBoard.from_array(test_board, PLAYER1)
+    stats = mcts_agent.MCTSStats()
+    assert mcts_agent.random_rollout(position, stats) == 1
+    assert mcts_agent.batch_rollout(position, 16, np.random.default_rng(0), stats) == {1: 16, 0: 0, -1: 0}
+    assert stats.rollout_plies == 0
+    assert mcts_agent.threat_result(position) == 1
+
+
+def test_rollout_batch_backpropagate_results():
+    """
+    A batch of rollouts from a node where PLAYER2 already won is counted in one update
+    for the node and all its parents
+    """
+    test_board = initialize_game_state()
+    test_board[0:3, 3] = 2
+    test_board[0:2, 1] = 1
+    test_node = mcts_agent.MonteCarloTreeSearchNode(state=test_board, player=PLAYER2)
+    test_node.remaining_actions = [3]
+    test_child = test_node.expand()
+    results = test_child.rollout_batch(16)
+    assert results == {1: 16}
+    test_child.backpropagate_results(results)
+    assert test_child.num_visits() == 16
+    assert test_node.num_visits() == 16
+    assert test_node.results[1] == 16
+    assert test_child.score() == 16
+
+
+
+def test_nodes_share_one_board():
+    """
+    Children are played on the root's board, which every node brings to its own position
+    before looking at it, and rollouts take their moves back
+    """
+    test_board = initialize_game_state()
+    test_node = mcts_agent.MonteCarloTreeSearchNode(state=test_board, player=PLAYER1)
+    first = test_node.expand()
+    second = test_node.expand()
+    grandchild = first.expand()
+    assert first.position is test_node.position
+    assert np.count_nonzero(second.state) == 1 and second.state[0, 5] == PLAYER1
+    assert np.count_nonzero(grandchild.state) == 2
+    assert (grandchild.state[0, 6], grandchild.state[1, 6]) == (PLAYER1, PLAYER2)
+    moves = list(grandchild.position.moves)
+    grandchild.rollout()
+    assert grandchild.position.moves == moves
+    assert (test_node.state == test_board).all()
+
+
+def test_generate_move_mcts_root_parallel():
+    test_board = initialize_game_state()
+    test_board[0:3, 3] = PLAYER1
+    test_board[0:2, 4] = PLAYER2
+    action, _ = mcts_agent.generate_move_mcts(test_board, PLAYER2, None, simulation_no=2000, workers=2)
+    assert action == 3
+
+
+def test_search_root_statistics():
+    stats = mcts_agent.search_root_statistics(BitBoard(), 200, seed=1)
+    # the empty board is symmetric, only the columns up to the centre are searched
+    assert sorted(stats) == [0, 1, 2, 3]
+    assert sum(visits for visits, _ in stats.values()) == 199
+
+
+def test_generate_move_mcts_tree_reuse():
+    """
+    After our move and the opponent's reply, the next search starts from the subtree that
+    was already grown below that reply
+    """
+    test_board = initialize_game_state()
+    action, saved_state = mcts_agent.generate_move_mcts(test_board, PLAYER1, None, simulation_no=500)
+    assert isinstance(saved_state, mcts_agent.MCTSSavedState)
+    tree = saved_state.tree
+    assert tree.player == PLAYER2
+    reply = tree.best_child()
+    reply_action = int(tree.action[reply])
+    visits = int(tree.visits[reply])
+    assert visits > 0
+
+    apply_player_action(test_board, action, PLAYER1)
+    apply_player_action(test_board, reply_action, PLAYER2)
+    _, saved_state = mcts_agent.generate_move_mcts(test_board, PLAYER1, saved_state, simulation_no=100)
+    # the new tree is the subtree below our next move, so its root was searched again
+    assert saved_state.tree.visits[0] > 0
+
+
+def test_mcts_tree_expand_and_subtree():
+    tree = mcts_agent.MCTSTree(BitBoard())
+    tree.best_simulated_action(simulation_no=300)
+    assert tree.visits[0] == 300
+    children = tree.children(0)
+    # the empty board is symmetric, columns 4 to 6 mirror columns 0 to 2
+    assert tree.action[children].tolist() == [0, 1, 2, 3]
+    assert tree.visits[children].sum() == 299
+
+    child = int(children[3])
+    subtree = tree.subtree(child)
+    assert subtree.visits[0] == tree.visits[child]
+    assert subtree.parent[0] == -1
+    assert subtree.key[0] == tree.key[child]
+    assert subtree.position.canonical_key()[0] == int(tree.key[child])
+    for node in range(1, subtree.size):
+        parent = subtree.parent[node]
+        assert subtree.first_child[parent] <= node < subtree.first_child[parent] + subtree.n_children[parent]
+    assert subtree.visits[subtree.children(0)].sum() == subtree.visits[0] - 1
+
+
+def test_mcts_tree_max_nodes():
+    tree = mcts_agent.MCTSTree(BitBoard(), max_nodes=50)
+    tree.best_simulated_action(simulation_no=500)
+    assert tree.size <= 50
+    assert tree.full
+    assert tree.visits[0] < 500
+
+
+def test_mcts_tree_terminal_child():
+    """
+    PLAYER2 completes column 3 with its move there, so that child is a terminal win and the
+    only child the root gets
+    """
+    test_board = initialize_game_state()
+    test_board[0:3, 3] = PLAYER2
+    test_board[0:3, 0] = PLAYER1
+    tree = mcts_agent.MCTSTree(BitBoard.from_array(test_board, PLAYER2))
+    assert tree.action[tree.best_simulated_action(simulation_no=300)] == 3
+    assert tree.terminal[tree.children(0)].tolist() == [1]
+
+
+def test_backpropagate_deep_path():
+    """
+    Backpropagation walks up the parents in a loop, so paths longer than the recursion limit work
+    """
+    position = BitBoard()
+    node = mcts_agent.MonteCarloTreeSearchNode(state=position, player=PLAYER1)
+    root = node
+    for _ in range(sys.getrecursionlimit() + 10):
+        node = mcts_agent.MonteCarloTreeSearchNode(state=position, player=PLAYER1, parent=node)
+    node.backpropagate(1)
+    assert root.num_visits() == 1
+    assert root.results[1] == 1
+
+
+def test_generate_move_mcts_stats():
+    collected = []
+    mcts_agent.generate_move_mcts(initialize_game_state(), PLAYER1, None, simulation_no=200,
+                                  stats_callback=collected.append)
+    stats, = collected
+    assert stats.simulations <= 200
+    assert stats.rollouts == stats.simulations
+    assert stats.stop_reason in ('simulations', 'early_stop')
+    assert 7 < stats.tree_size
+    assert stats.max_depth >= 1
+    assert stats.mean_rollout_length > 0
+    assert stats.profile is None
+    assert 0 < stats.time_select + stats.time_expand + stats.time_rollout + stats.time_backprop <= stats.time
+
+
+def test_generate_move_mcts_time_limit():
+    collected = []
+    t0 = time.perf_counter()
+    mcts_agent.generate_move_mcts(initialize_game_state(), PLAYER1, None, simulation_no=10 ** 7,
+                                  time_limit=0.2, stats_callback=collected.append)
+    assert time.perf_counter() - t0 < 0.5
+    assert collected[0].stop_reason in ('time', 'early_stop')
+
+
+def test_generate_move_mcts_max_nodes():
+    collected = []
+    saved_state = mcts_agent.MCTSSavedState(PLAYER1)
+    mcts_agent.generate_move_mcts(initialize_game_state(), PLAYER1, saved_state, simulation_no=10 ** 6,
+                                  max_nodes=500, stats_callback=collected.append)
+    assert collected[0].stop_reason == 'nodes'
+    assert collected[0].tree_size <= 500
+
+
+def test_mcts_tree_search_early_stop():
+    """
+    With PLAYER1 about to win in column 3 the root only gets the winning child, which ends
+    the search at the first check
+    """
+    test_board = initialize_game_state()
+    test_board[0:3, 3] = PLAYER1
+    test_board[0:2, 0] = PLAYER2
+    test_board[0, 6] = PLAYER2
+    stats = mcts_agent.MCTSStats()
+    tree = mcts_agent.MCTSTree(BitBoard.from_array(test_board, PLAYER1), stats=stats)
+    assert tree.action[tree.search(simulation_no=20000)] == 3
+    assert stats.stop_reason == 'early_stop'
+    assert tree.visits[0] == mcts_agent.BUDGET_CHECK_INTERVAL
+
+
+def test_find_subtree_mirrored():
+    """
+    The opponent replying in the mirror image of an explored column reuses that subtree
+    """
+    test_board = initialize_game_state()
+    test_board[0, 3] = PLAYER1
+    tree = mcts_agent.MCTSTree(BitBoard.from_array(test_board, PLAYER2))
+    tree.best_simulated_action(simulation_no=300)
+    test_board[0, 5] = PLAYER2
+    subtree = mcts_agent.find_subtree(tree, BitBoard.from_array(test_board, PLAYER1))
+    assert subtree is not None
+    assert subtree.mirrored
+    assert subtree.position.to_array()[0, 1] == PLAYER2
+    assert subtree.visits[0] == tree.visits[tree.find_child(0, subtree.key[0])]
+
+
+def test_find_subtree_reply_decided_by_threats():
+    """
+    The opponent replying with a double threat leaves a child that was marked terminal
+    without being expanded, reusing it as the root still searches it and returns a move
+    """
+    test_board = initialize_game_state()
+    test_board[0, 2:4] = PLAYER1
+    test_board[0, [0, 6]] = PLAYER2
+    state = mcts_agent.MCTSSavedState(PLAYER2, mcts_agent.MCTSTree(BitBoard.from_array(test_board, PLAYER1)))
+    state.tree.best_simulated_action(simulation_no=50)
+    child = state.tree.children(0)[4]
+    assert state.tree.action[child] == 4 and state.tree.terminal[child] != mcts_agent.NOT_TERMINAL
+    test_board[0, 4] = PLAYER1
+    subtree = mcts_agent.find_subtree(state.tree, BitBoard.from_array(test_board, PLAYER2))
+    assert subtree is not None and subtree.terminal[0] == mcts_agent.NOT_TERMINAL
+    action, _ = mcts_agent.generate_move_mcts(test_board.copy(), PLAYER2, state, simulation_no=1)
+    assert action in (1, 5)
+
+
+def test_mcts_dag_shares_transpositions():
+    tree = mcts_agent.MCTSTree(BitBoard(), dag=True)
+    tree.best_simulated_action(simulation_no=2000)
+    nodes = np.arange(tree.size)
+    shared = nodes[tree.target[:tree.size] != nodes]
+    assert shared.size > 0
+    # a node only points at the first node of its position, which holds all the statistics
+    assert (tree.key[shared] == tree.key[tree.target[shared]]).all()
+    assert (tree.target[tree.target[shared]] == tree.target[shared]).all()
+    assert (tree.visits[shared] == 0).all()
+    assert (tree.n_children[shared] == 0).all()
+    assert len(tree.table) == tree.size - shared.size
+
+    subtree = tree.subtree(tree.best_child())
+    assert subtree.visits[0] == tree.visits[tree.best_child()]
+    targets = subtree.target[:subtree.size]
+    assert (targets >= 0).all()
+    assert sorted(subtree.table.values()) == sorted(set(targets.tolist()))
+
+    # reusing the tree move after move keeps its root at the position actually played
+    board = BitBoard()
+    for _ in range(8):
+        children = tree.children(0)
+        # a child sharing the node of a transposition was added below another parent
+        shared_children = children[tree.target[children] != children]
+        child = int(shared_children[0]) if shared_children.size else tree.best_child()
+        board.play(int(tree.action[child]))
+        tree = mcts_agent.find_subtree(tree, board)
+        assert tree.position.masks == board.masks
+        if tree.terminal[0] != mcts_agent.NOT_TERMINAL:
+            break
+        tree.best_simulated_action(simulation_no=300)
+
+
+def test_generate_move_mcts_dag():
+    test_board = initialize_game_state()
+    test_board[0:3, 3] = PLAYER1
+    test_board[0:2, 4] = PLAYER2
+    action, saved_state = mcts_agent.generate_move_mcts(test_board, PLAYER2, None, simulation_no=500, dag=True)
+    assert action == 3
+    assert saved_state.tree.table is not None
@@ -0,0 +1,291 @@
+import math
+import pickle
+import time
+import numpy as np
+import pytest
+from agents.agent_minimax import minimax
+from agents.common import PLAYER1, PLAYER2, PlayerAction, BitBoard, WINDOW_INDICES
+from agents.common import initialize_game_state
+
+
+def test_generate_move_minimax_blocks_win():
+    """
+    PLAYER1 has three pieces stacked in column 3, so PLAYER2 has to play there.
+    """
+    test_board = initialize_game_state()
+    test_board[0:3, 3] = PLAYER1
+    test_board[0:2, 4] = PLAYER2
+    action, _ = minimax.generate_move_minimax(test_board, PLAYER2, None, 0.2)
+    assert isinstance(action, PlayerAction)
+    assert action == 3
+
+
+def test_generate_move_minimax_takes_win():
+    test_board = initialize_game_state()
+    test_board[0, 0:3] = PLAYER1
+    test_board[0:3, 6] = PLAYER2
+    action, _ = minimax.generate_move_minimax(test_board, PLAYER1, None, 0.2)
+    assert action == 3
+
+
+def test_transposition_table_store_probe():
+    tt = minimax.TranspositionTable(size=16)
+    assert tt.probe(5) is None
+    tt.store(5, 3, 1.5, minimax.Bound.EXACT, 2)
+    assert tt.probe(5) == (3, 1.5, minimax.Bound.EXACT, 2)
+    # a shallower result of the same search does not replace a deeper one in its slot
+    tt.store(21, 1, 0., minimax.Bound.LOWER, 4)
+    assert tt.probe(21) is None
+    tt.new_search()
+    tt.store(21, 1, 0., minimax.Bound.LOWER, 4)
+    assert tt.probe(21) == (1, 0., minimax.Bound.LOWER, 4)
+    assert tt.probe(5) is None
+
+
+def test_minimax_transposition_table_value():
+    """
+    The transposition table only saves work, the searched value stays the same
+    """
+    test_board = initialize_game_state()
+    test_board[0:2, 3] = PLAYER1
+    test_board[0, 2] = PLAYER2
+    test_board[0, 4] = PLAYER2
+    position = BitBoard.from_array(test_board, PLAYER1)
+    _, value = minimax.minimax(4, position, PLAYER1, -np.inf, np.inf, True)
+    _, value_tt = minimax.minimax(4, position, PLAYER1, -np.inf, np.inf, True, minimax.TranspositionTable())
+    assert value == value_tt
+
+
+def test_generate_move_minimax_saved_state():
+    test_board = initialize_game_state()
+    action, saved_state = minimax.generate_move_minimax(test_board, PLAYER1, None, 0.2)
+    assert isinstance(saved_state, minimax.MinimaxSavedState)
+    tt = saved_state.tt
+    test_board[0, action] = PLAYER1
+    test_board[0, 0] = PLAYER2
+    _, saved_state = minimax.generate_move_minimax(test_board, PLAYER1, saved_state, 0.2)
+    assert saved_state.tt is tt
+
+
+def test_iterative_deepening_deadline():
+    """
+    The search returns soon after the deadline with the result of a completed depth and
+    leaves the position as it was
+    """
+    position = BitBoard()
+    t0 = time.perf_counter()
+    column, value, depth = minimax.iterative_deepening(
+        position, PLAYER1, minimax.TranspositionTable(), t0 + 0.3)
+    assert time.perf_counter() - t0 < 0.5
+    assert column in range(7)
+    assert depth >= 1
+    assert position.moves == []
+
+
+def test_iterative_deepening_max_depth():
+    position = BitBoard()
+    _, _, depth = minimax.iterative_deepening(position, PLAYER1, minimax.TranspositionTable(), None, 3)
+    assert depth == 3
+
+
+def test_board_heuristic_matches_window_value():
+    """
+    The vectorized heuristic adds up window_value over all windows plus the centre column bonus
+    """
+    test_board = initialize_game_state()
+    test_board[0, 1:4] = PLAYER1
+    test_board[1, 2:4] = PLAYER2
+    test_board[0:2, 5] = PLAYER2
+    test_board[2, 3] = PLAYER1
+    flat = [int(piece) for piece in test_board.reshape(-1)]
+    for player in (PLAYER1, PLAYER2):
+        expected = sum(minimax.window_value([flat[i] for i in window], player)
+                       for window in WINDOW_INDICES.tolist())
+        expected += int(np.sum(test_board[:, 3] == player)) * minimax.CENTER_WEIGHT
+        assert minimax.board_heuristic(test_board, player) == expected
+
+
+def test_board_heuristic_batch():
+    boards = np.stack([initialize_game_state() for _ in range(3)])
+    boards[1, 0, 3] = PLAYER1
+    boards[2, 0:3, 0] = PLAYER2
+    values = minimax.board_heuristic(boards, PLAYER1)
+    assert values.shape == (3,)
+    for board, value in zip(boards, values):
+        assert minimax.board_heuristic(board, PLAYER1) == value
+
+
+def test_generate_move_minimax_stats():
+    collected = []
+    minimax.generate_move_minimax(initialize_game_state(), PLAYER1, None, 10., 3,
+                                  stats_callback=collected.append, profile=True)
+    stats, = collected
+    assert stats.depth == 3
+    assert [depth for depth, _ in stats.depth_times] == [1, 2, 3]
+    assert stats.nodes > 7
+    assert stats.tt_probes >= stats.tt_hits
+    assert stats.profile is not None
+
+
+def test_move_ordering_order():
+    ordering = minimax.MoveOrdering()
+    position = BitBoard()
+    assert ordering.order(position, position.valid_columns()) == [3, 2, 4, 1, 5, 0, 6]
+    assert ordering.order(position, position.valid_columns(), tt_move=6)[0] == 6
+    ordering.cutoff(position, 0, 2)
+    ordering.cutoff(BitBoard.from_array(initialize_game_state(), PLAYER1), 5, 2)
+    assert ordering.order(position, position.valid_columns())[:2] == [5, 0]
+    assert ordering.order(position, position.valid_columns(), tt_move=6)[:3] == [6, 5, 0]
+    ordering.new_search()
+    # the killers are gone, the halved history scores still put both columns first
+    assert ordering.order(position, position.valid_columns())[:2] == [5, 0]
+
+
+def test_minimax_move_ordering_value():
+    """
+    The move ordering only saves nodes, the searched value stays the same
+    """
+    test_board = initialize_game_state()
+    test_board[0:2, 3] = PLAYER1
+    test_board[0, 2] = PLAYER2
+    test_board[0, 4] = PLAYER2
+    position = BitBoard.from_array(test_board, PLAYER1)
+    unordered, ordered = minimax.MinimaxStats(), minimax.MinimaxStats()
+    _, value = minimax.minimax(5, position, PLAYER1, -np.inf, np.inf, True, stats=unordered)
+    _, value_ordered = minimax.minimax(5, position, PLAYER1, -np.inf, np.inf, True, stats=ordered,
+                                       ordering=minimax.MoveOrdering())
+    assert value == value_ordered
+    assert ordered.nodes < unordered.nodes
+
+
+def test_minimax_forced_replies():
+    """
+    With a win of PLAYER1 to block only column 3 is searched, and two wins of PLAYER1 decide
+    the search without looking deeper
+    """
+    test_board = initialize_game_state()
+    test_board[0:3, 3] = PLAYER1
+    test_board[0:2, 4] = PLAYER2
+    stats = minimax.MinimaxStats()
+    column, _ = minimax.minimax(4, BitBoard.from_array(test_board, PLAYER2), PLAYER2, -np.inf, np.inf, True,
+                                stats=stats)
+    assert column == 3
+    assert stats.forced > 0
+
+    test_board = initialize_game_state()
+    test_board[0, 1:4] = PLAYER1
+    test_board[1, 1:3] = PLAYER2
+    stats = minimax.MinimaxStats()
+    _, value = minimax.minimax(4, BitBoard.from_array(test_board, PLAYER2), PLAYER2, -np.inf, np.inf, True,
+                               stats=stats)
+    assert value == -np.inf
+    assert stats.nodes == 1
+
+
+def test_board_heuristic_player_per_board():
+    test_board = initialize_game_state()
+    test_board[0, 2:4] = PLAYER1
+    test_board[0, 4] = PLAYER2
+    boards = np.stack([test_board, test_board])
+    values = minimax.board_heuristic(boards, np.array([PLAYER1, PLAYER2]))
+    assert values.tolist() == [minimax.board_heuristic(test_board, PLAYER1),
+                               minimax.board_heuristic(test_board, PLAYER2)]
+
+
+def test_mask_heuristic_matches_board_heuristic():
+    position = BitBoard()
+    masks, expected = [], []
+    for col in [3, 3, 2, 4, 4, 1, 5, 0, 6, 3]:
+        position.play(col)
+        for player in (PLAYER1, PLAYER2):
+            own = int(player) - 1
+            masks.append((position.masks[own], position.masks[own ^ 1]))
+            expected.append(minimax.board_heuristic(position.to_array(), player))
+    assert minimax.mask_heuristic(np.array(masks, dtype=np.uint64)).tolist() == expected
+
+
+def test_leaf_values_full_board_is_draw():
+    board = initialize_game_state()
+    for row in range(6):
+        for col in range(7):
+            board[row, col] = PLAYER1 if (row // 2 + col) % 2 == 0 else PLAYER2
+    # the last move fills the board without connecting four
+    board[5, 3] = 0
+    position = BitBoard.from_array(board, PLAYER2)
+    assert minimax.leaf_values(position, PLAYER1, [3]) == [0]
+    assert minimax.leaf_values(position, PLAYER2, [3]) == [0]
+
+
+def test_generate_moves_minimax_batch():
+    """
+    Three boards searched together: PLAYER1 takes a win, PLAYER2 blocks one and a board with
+    full columns only gets valid moves
+    """
+    win_board = initialize_game_state()
+    win_board[0, 0:3] = PLAYER1
+    win_board[0:2, 6] = PLAYER2
+    block_board = initialize_game_state()
+    block_board[0:3, 3] = PLAYER1
+    block_board[0:2, 4] = PLAYER2
+    full_board = initialize_game_state()
+    full_board[:, 1:6] = [[PLAYER1, PLAYER2, PLAYER1, PLAYER2, PLAYER1]] * 3 + [[PLAYER2, PLAYER1, PLAYER2, PLAYER1, PLAYER2]] * 3
+    boards = np.stack([win_board, block_board, full_board])
+    players = np.array([PLAYER1, PLAYER2, PLAYER1])
+    states = [None, 'state', None]
+    actions, new_states = minimax.generate_moves_minimax_batch(boards, players, states, depth=2)
+    assert actions.dtype == PlayerAction
+    assert actions[:2].tolist() == [3, 3]
+    assert actions[2] in (0, 6)
+    assert new_states == states
+    for board, player, action in zip(boards, players, actions):
+        value = minimax.minimax_batch(board[np.newaxis], player[np.newaxis], player[np.newaxis], 2)[0, action]
+        _, expected = minimax.minimax(2, BitBoard.from_array(board, player), player, -np.inf, np.inf, True)
+        assert value == expected
+
+
+def test_generate_moves_minimax_batch_all_moves_lose():
+    """
+    PLAYER1 wins in column 0 or 6 whatever PLAYER2 does, the full centre column still must not
+    be chosen
+    """
+    test_board = initialize_game_state()
+    test_board[0:3, [0, 6]] = PLAYER1
+    test_board[[0, 1, 4, 5], 3] = PLAYER1
+    test_board[[2, 3], 3] = PLAYER2
+    test_board[0:2, [1, 4, 5]] = PLAYER2
+    test_board[0, 2] = PLAYER2
+    for depth in (2, 3):
+        actions, _ = minimax.generate_moves_minimax_batch(test_board[np.newaxis], np.array([PLAYER2]), [None], depth)
+        assert actions[0] == 2
+
+
+def test_shared_transposition_table():
+    tt = minimax.SharedTranspositionTable(size=16)
+    tt.new_search()
+    assert tt.probe(5) is None
+    tt.store(5, 3, -42, minimax.Bound.EXACT, 2)
+    tt.store(6, 4, math.inf, minimax.Bound.LOWER, None)
+    tt.store(7, 1, -math.inf, minimax.Bound.UPPER, 6)
+    attached = pickle.loads(pickle.dumps(tt))
+    assert attached.probe(5) == (3, -42, minimax.Bound.EXACT, 2)
+    assert attached.probe(6) == (4, math.inf, minimax.Bound.LOWER, None)
+    assert attached.probe(7) == (1, -math.inf, minimax.Bound.UPPER, 6)
+    # a shallower result of the same search does not replace a deeper one in its slot
+    attached.store(21, 1, 0, minimax.Bound.EXACT, 0)
+    assert tt.probe(21) is None
+    tt.stop()
+    attached.raise_on_stop = True
+    with pytest.raises(minimax.SearchTimeout):
+        attached.store(8, 1, 0, minimax.Bound.EXACT, 0)
+
+
+def test_generate_move_minimax_parallel():
+    test_board = initialize_game_state()
+    test_board[0:3, 3] = PLAYER1
+    test_board[0:2, 4] = PLAYER2
+    collected = []
+    action, saved_state = minimax.generate_move_minimax(test_board, PLAYER2, None, 0.3, workers=2,
+                                                       stats_callback=collected.append)
+    assert action == 3
+    assert isinstance(saved_state.tt, minimax.SharedTranspositionTable)
+    assert collected[0].nodes > 0
@@ -0,0 +1,87 @@
+import random
+import numpy as np
+import pytest
+from agents import records
+from agents.common import BitBoard, NO_PLAYER, PLAYER1, PLAYER2
+
+
+def random_game(rng: random.Random):
+    position = BitBoard()
+    while True:
+        position.play(rng.choice(position.valid_columns()))
+        if position.last_move_won():
+            return position.moves, PLAYER1 if len(position.moves) % 2 else PLAYER2
+        if position.is_full():
+            return position.moves, NO_PLAYER
+
+
+def test_positions_round_trip(tmp_path):
+    """
+    Positions written one by one and as boards come back as the same boards, in batches
+    """
+    rng = random.Random(0)
+    path = str(tmp_path / 'positions.bin')
+    boards, players = [], []
+    with records.PositionWriter(path, buffer_size=8) as writer:
+        for _ in range(20):
+            moves, _ = random_game(rng)
+            position = BitBoard()
+            for col in moves[:rng.randrange(len(moves))]:
+                position.play(col)
+            writer.write(position)
+            boards.append(position.to_array())
+            players.append(position.player)
+        writer.write_boards(np.array(boards), np.array(players))
+    reader = records.PositionReader(path)
+    assert len(reader) == 40
+    read = list(reader.batches(batch_size=16))
+    assert [len(batch_boards) for batch_boards, _ in read] == [16, 16, 8]
+    read_boards = np.concatenate([batch_boards for batch_boards, _ in read])
+    read_players = np.concatenate([batch_players for _, batch_players in read])
+    assert np.all(read_boards == np.array(boards * 2))
+    assert np.all(read_players == np.array(players * 2))
+    assert reader[3].key() == BitBoard.from_array(boards[3], players[3]).key()
+
+
+def test_games_round_trip_and_append(tmp_path):
+    rng = random.Random(1)
+    path = str(tmp_path / 'games.bin')
+    games = [random_game(rng) for _ in range(10)]
+    with records.GameWriter(path) as writer:
+        for moves, winner in games[:6]:
+            writer.write(moves, winner)
+    with records.GameWriter(path, append=True) as writer:
+        for moves, winner in games[6:]:
+            writer.write(moves, winner)
+    reader = records.GameReader(path)
+    assert len(reader) == 10
+    assert reader[7] == (games[7][0], games[7][1])
+    moves, lengths, winners = next(reader.batches())
+    for i, (game_moves, winner) in enumerate(games):
+        assert moves[i, :lengths[i]].tolist() == game_moves
+        assert np.all(moves[i, lengths[i]:] == -1)
+        assert winners[i] == winner
+    boards, players = records.game_positions(games[0][0])
+    assert len(boards) == lengths[0] + 1 and players[0] == PLAYER1
+    assert np.count_nonzero(boards[-1]) == lengths[0]
+
+
+def test_reader_checks_file(tmp_path):
+    path = str(tmp_path / 'games.bin')
+    records.GameWriter(path).close()
+    assert len(records.GameReader(path)) == 0
+    with pytest.raises(ValueError):
+        records.PositionReader(path)
+    # a record cut short by a crashed writer is not read
+    with records.GameWriter(path, append=True) as writer:
+        writer.write([3, 3, 4])
+    with open(path, 'ab') as f:
+        f.write(b'\x01\x02')
+    assert len(records.GameReader(path)) == 1
+    # appending drops it first, so the records written after it stay aligned
+    with records.GameWriter(path, append=True) as writer:
+        writer.write([0, 1, 2], PLAYER1)
+    reader = records.GameReader(path)
+    assert len(reader) == 2
+    assert reader[0] == ([3, 3, 4], NO_PLAYER)
+    assert reader[1] == ([0, 1, 2], PLAYER1)
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+import pytest
+from agents import registry
+from agents.agent_random import generate_move
+
+
+def test_get_agent():
+    assert registry.get_agent('random') is generate_move
+    assert registry.get_agent('random') is registry.get_agent('random')
+    assert registry.time_limit_kwargs('random', 1.) == {}
+    assert registry.time_limit_kwargs('mcts', 1.) == {'time_limit': 1.}
+    with pytest.raises(ValueError):
+        registry.get_agent('no such agent')
+
+
+def test_register_agent():
+    registry.register_agent('test_random', 'agents.agent_random', 'generate_move')
+    try:
+        assert 'test_random' in registry.agent_names()
+        assert registry.get_agent('test_random') is generate_move
+    finally:
+        del registry.AGENTS['test_random']
+        registry._loaded.pop('test_random', None)
+
+
+def test_registry_imports_agents_lazily():
+    """
+    A new interpreter loading the random agent imports no other agent, no SciPy and no
+    multiprocessing
+    """
+    code = ("import sys; from agents.registry import get_agent; get_agent('random'); "
+            "print(' '.join(sorted(sys.modules)))")
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    modules = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True,
+                             check=True).stdout.split()
+    assert 'agents.agent_random' in modules
+    for module in ('agents.agent_minimax', 'agents.new_agent', 'agents.agent_solver', 'scipy', 'multiprocessing'):
+        assert module not in modules
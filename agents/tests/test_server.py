@@ -0,0 +1,90 @@
+import asyncio
+import json
+import server
+
+
+async def request(reader, writer, **fields):
+    writer.write(json.dumps(fields).encode() + b'\n')
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+def run_with_server(client, **server_args):
+    """
+    Starts a server on a free port, runs `client(reader, writer, game_server)` against it and
+    returns its result
+    """
+    async def main():
+        game_server = server.GameServer(**server_args)
+        tcp_server = await server.start_server(game_server, port=0)
+        port = tcp_server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            result = await client(reader, writer, game_server)
+            writer.close()
+            return result
+        finally:
+            tcp_server.close()
+            await tcp_server.wait_closed()
+            game_server.shutdown()
+
+    return asyncio.run(main())
+
+
+def test_server_plays_game():
+    async def client(reader, writer, game_server):
+        game = await request(reader, writer, id=1, op='new_game', agent='random', agent_player=1)
+        assert game['ok'] and game['id'] == 1
+        assert game['to_move'] == 2
+        assert sum(cell != 0 for row in game['board'] for cell in row) == 1
+        while game['result'] == 'playing':
+            column = next(col for col in range(7) if game['board'][5][col] == 0)
+            game = await request(reader, writer, op='move', game=game['game'], column=column)
+            assert game['ok']
+        assert game['result'] in ('win', 'draw')
+        over = await request(reader, writer, op='move', game=game['game'], column=0)
+        assert over == {'ok': False, 'error': 'the game is over'}
+        closed = await request(reader, writer, op='close', game=game['game'])
+        assert closed['ok']
+        return game_server.games
+
+    assert run_with_server(client) == {}
+
+
+def test_server_errors():
+    async def client(reader, writer, game_server):
+        assert not (await request(reader, writer, op='new_game', agent='nobody'))['ok']
+        for agent_player in (True, 300, '1', None, 1.0):
+            response = await request(reader, writer, op='new_game', agent='random', agent_player=agent_player)
+            assert response == {'ok': False, 'error': 'agent_player must be 1 or 2'}
+        for deadline in (-1, 0, float('nan'), float('inf'), True, '1'):
+            response = await request(reader, writer, op='new_game', agent='random', deadline=deadline)
+            assert response == {'ok': False, 'error': 'deadline must be a positive number of seconds'}
+        game = await request(reader, writer, op='new_game', agent='random', deadline=1e9)
+        assert game_server.games[game['game']].deadline == server.MAX_DEADLINE
+        await request(reader, writer, op='close', game=game['game'])
+        assert not (await request(reader, writer, op='state', game='1'))['ok']
+        assert not (await request(reader, writer, op='dance'))['ok']
+        writer.write(b'not json\n')
+        assert not json.loads(await reader.readline())['ok']
+        game = await request(reader, writer, op='new_game', agent='minimax', deadline=0.1)
+        assert game['to_move'] == 1 and 'agent_move' not in game
+        assert not (await request(reader, writer, op='move', game=game['game'], column=7))['ok']
+        assert not (await request(reader, writer, op='move', game=game['game'], column=True))['ok']
+        game = await request(reader, writer, op='move', game=game['game'], column=3)
+        assert game['ok'] and 0 <= game['agent_move'] < 7
+        return len(game_server.games)
+
+    assert run_with_server(client) == 1
+
+
+def test_server_queued_moves_keep_their_deadline():
+    async def client(reader, writer, game_server):
+        new_game = {'agent': 'mcts', 'agent_player': 1, 'deadline': 0.5}
+        # the first move imports the agent in the worker
+        await game_server.new_game(new_game, set())
+        # five moves queued on the one worker take longer together than the deadline allows one
+        games = await asyncio.gather(*(game_server.new_game(new_game, set()) for _ in range(5)))
+        return [game.get('timeout', False) for game in games]
+
+    assert run_with_server(client, workers=1) == [False] * 5
@@ -0,0 +1,78 @@
+import numpy as np
+from agents.common import PLAYER1, PLAYER2, PlayerAction, BitBoard, initialize_game_state
+from agents.agent_solver import solver
+from agents.agent_solver.book import OpeningBook, book_positions, generate_book
+
+
+def late_position() -> BitBoard:
+    position = BitBoard()
+    for col in [5, 2, 1, 4, 5, 5, 4, 2, 4, 4, 4, 1, 2, 0, 4, 1, 2, 2, 5, 1, 1, 2, 5, 5, 1, 0, 6, 0]:
+        position.play(col)
+    return position
+
+
+def exact_score(position: BitBoard) -> int:
+    """
+    Plain negamax over the whole tree, for positions close to the end of the game
+    """
+    best = None
+    for col in position.valid_columns():
+        position.play(col)
+        if position.last_move_won():
+            score = (solver.CELLS + 1 - position.num_pieces() + 1) // 2
+        elif position.is_full():
+            score = 0
+        else:
+            score = -exact_score(position)
+        position.undo()
+        best = score if best is None else max(best, score)
+    return best
+
+
+def test_solver_exact_score():
+    position = late_position()
+    assert not position.last_move_won()
+    score, column = solver.Solver().analyze(position)
+    assert score == exact_score(position.copy())
+    position.play(column)
+    assert -solver.Solver().analyze(position)[0] == score
+
+
+def test_solver_immediate_win():
+    test_board = initialize_game_state()
+    test_board[0:3, 3] = PLAYER1
+    test_board[0:2, 4] = PLAYER2
+    test_board[0, 5] = PLAYER2
+    score, column = solver.Solver().analyze(BitBoard.from_array(test_board, PLAYER1))
+    assert column == 3
+    assert score == (solver.CELLS + 1 - 6) // 2
+
+
+def test_opening_book_round_trip(tmp_path):
+    root = late_position()
+    path = str(tmp_path / 'book.bin')
+    count = generate_book(path, 2, root)
+    assert count == len(book_positions(2, root))
+    book = OpeningBook(path)
+    assert len(book) == count
+    assert isinstance(book.records, np.memmap)
+    assert book.lookup(root) == solver.Solver().analyze(root)
+    assert book.lookup(BitBoard()) is None
+
+
+def test_generate_move_solver_book(tmp_path):
+    root = late_position()
+    path = str(tmp_path / 'book.bin')
+    generate_book(path, 0, root)
+    action, saved_state = solver.generate_move_solver(root.to_array(), root.player, None, book_path=path)
+    assert isinstance(action, PlayerAction)
+    assert action == OpeningBook(path).best_move(root)
+    assert saved_state.solver.nodes == 0
+
+
+def test_generate_move_solver_time_limit():
+    """
+    The empty board cannot be solved in time, the minimax fallback plays instead
+    """
+    action, _ = solver.generate_move_solver(initialize_game_state(), PLAYER1, None, time_limit=0.2)
+    assert 0 <= action < 7
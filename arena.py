@@ -0,0 +1,169 @@
+"""
+Headless self-play arena: plays two agents against each other for many games, alternating
+colours, and reports win rates and throughput.
+
+    python arena.py mcts minimax --games 200 --workers 4 --output results.jsonl
+"""
+import argparse
+import json
+import math
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+import numpy as np
+from agents.common import GenMove, GameState, PLAYER1, PLAYER2, initialize_game_state, apply_player_action, \
+    check_end_state, get_valid_columns
+from agents.registry import agent_names, get_agent
+
+Z_95 = 1.959964
+
+
+def play_game(agent_1: GenMove, agent_2: GenMove, agent_1_first: bool = True,
+              args_1: tuple = (), args_2: tuple = (), seed: Optional[int] = None) -> dict:
+    """
+    Plays one game without any output and returns its record: the winning agent (1 or 2,
+    0 for a draw), the colour agent 1 played, the moves and the time taken by every move.
+    An agent returning an illegal column loses the game.
+    """
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed % 2 ** 32)
+    agents = (1, 2) if agent_1_first else (2, 1)
+    gen_moves = {1: (agent_1, args_1), 2: (agent_2, args_2)}
+    saved_state = {PLAYER1: None, PLAYER2: None}
+    board = initialize_game_state()
+    moves, move_times = [], []
+    winner, illegal = None, False
+    while winner is None:
+        player = (PLAYER1, PLAYER2)[len(moves) % 2]
+        agent = agents[len(moves) % 2]
+        gen_move, args = gen_moves[agent]
+        t0 = time.perf_counter()
+        action, saved_state[player] = gen_move(board.copy(), player, saved_state[player], *args)
+        move_times.append(time.perf_counter() - t0)
+        if action not in get_valid_columns(board):
+            winner, illegal = 3 - agent, True
+            break
+        moves.append(int(action))
+        apply_player_action(board, action, player)
+        end_state = check_end_state(board, player, action)
+        if end_state == GameState.IS_WIN:
+            winner = agent
+        elif end_state == GameState.IS_DRAW:
+            winner = 0
+    return {
+        'winner': winner,
+        'agent_1_player': int(PLAYER1 if agent_1_first else PLAYER2),
+        'moves': moves,
+        'move_times': move_times,
+        'illegal_move': illegal,
+    }
+
+
+def wilson_interval(successes: float, n: int, z: float = Z_95):
+    """
+    Returns the Wilson score confidence interval of the rate successes / n.
+    """
+    if n == 0:
+        return 0., 1.
+    rate = successes / n
+    centre = rate + z * z / (2 * n)
+    margin = z * math.sqrt(rate * (1 - rate) / n + z * z / (4 * n * n))
+    denominator = 1 + z * z / n
+    return (centre - margin) / denominator, (centre + margin) / denominator
+
+
+def summarize(records: list, elapsed: float) -> dict:
+    """
+    Returns win, draw and loss counts of agent 1, its score rate (draws count half) with a 95%
+    confidence interval, games per second and the mean move time of both agents.
+    """
+    n = len(records)
+    wins = sum(record['winner'] == 1 for record in records)
+    losses = sum(record['winner'] == 2 for record in records)
+    draws = n - wins - losses
+    score = wins + 0.5 * draws
+    move_times = {1: [], 2: []}
+    for record in records:
+        agent = 1 if record['agent_1_player'] == PLAYER1 else 2
+        for i, move_time in enumerate(record['move_times']):
+            move_times[agent if i % 2 == 0 else 3 - agent].append(move_time)
+    return {
+        'games': n,
+        'agent_1_wins': wins,
+        'agent_2_wins': losses,
+        'draws': draws,
+        'agent_1_score': score / n if n else 0.,
+        'agent_1_score_ci95': wilson_interval(score, n),
+        'games_per_second': n / elapsed if elapsed > 0 else math.inf,
+        'mean_move_time': {agent: float(np.mean(times)) if times else 0. for agent, times in move_times.items()},
+    }
+
+
+def run_arena(agent_1: GenMove, agent_2: GenMove, n_games: int, workers: int = 1,
+              output: Optional[str] = None, args_1: tuple = (), args_2: tuple = (),
+              seed: Optional[int] = None) -> dict:
+    """
+    Plays `n_games` between the two agents, agent 1 moving first in the even numbered games,
+    spread over `workers` processes. Every record is appended to `output` as a line of JSON as
+    soon as its game is over. Returns the summary of all games.
+
+    :param agent_1, agent_2: GenMove functions, must be importable at module level for workers > 1
+    :param n_games: number of games to play
+    :param workers: number of processes, 1 plays all games in this process
+    :param output: path of the JSON lines file for the game records, None to not write them
+    :param args_1, args_2: extra arguments passed to the agents
+    :param seed: base seed, game i is played with seed + i
+    """
+    seeds = [None if seed is None else seed + i for i in range(n_games)]
+    game_args = [(agent_1, agent_2, i % 2 == 0, args_1, args_2, seeds[i]) for i in range(n_games)]
+    records = []
+    stream = open(output, 'w') if output is not None else None
+    t0 = time.perf_counter()
+
+    def finish(i, record):
+        record['game'] = i
+        records.append(record)
+        if stream is not None:
+            stream.write(json.dumps(record) + '\n')
+            stream.flush()
+
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(play_game, *args): i for i, args in enumerate(game_args)}
+                for future in as_completed(futures):
+                    finish(futures[future], future.result())
+        else:
+            for i, args in enumerate(game_args):
+                finish(i, play_game(*args))
+    finally:
+        if stream is not None:
+            stream.close()
+    return summarize(records, time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('agent_1', choices=agent_names())
+    parser.add_argument('agent_2', choices=agent_names())
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--output', default=None, help='JSON lines file for the game records')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    summary = run_arena(get_agent(args.agent_1), get_agent(args.agent_2), args.games, args.workers,
+                        args.output, seed=args.seed)
+    low, high = summary['agent_1_score_ci95']
+    print(f"{args.agent_1} vs {args.agent_2}: {summary['agent_1_wins']} wins, {summary['draws']} draws, "
+          f"{summary['agent_2_wins']} losses in {summary['games']} games")
+    print(f"{args.agent_1} score {summary['agent_1_score']:.3f} (95% CI {low:.3f} - {high:.3f}), "
+          f"{summary['games_per_second']:.2f} games/s")
+    for agent, name in ((1, args.agent_1), (2, args.agent_2)):
+        print(f"mean move time {name}: {summary['mean_move_time'][agent] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Moves per second of the batch move generation against one GenMove call per board, for
+growing batch sizes, on the benchmark suite positions.
+
+    python -m benchmarks.bench_batch [--sizes 1 16 256] [--depth 2]
+"""
+import argparse
+import time
+import numpy as np
+from agents.common import generate_moves_batch
+from agents.agent_random import generate_move, generate_moves_random_batch
+from agents.agent_minimax import minimax, generate_moves_minimax_batch
+from benchmarks.suite import make_positions
+
+
+def moves_per_second(gen_moves, boards: np.ndarray, players: np.ndarray, repeat: int = 3) -> float:
+    best = 0.
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        gen_moves(boards, players, [None] * len(boards))
+        best = max(best, len(boards) / (time.perf_counter() - t0))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 16, 256])
+    parser.add_argument('--depth', type=int, default=2)
+    args = parser.parse_args()
+
+    def minimax_per_board(board, player, saved_state):
+        position = minimax.BitBoard.from_array(board, player)
+        column, _ = minimax.minimax(args.depth, position, player, -np.inf, np.inf, True)
+        return column, saved_state
+
+    agents = {
+        'random': (generate_move, generate_moves_random_batch),
+        f'minimax depth {args.depth}': (
+            minimax_per_board,
+            lambda boards, players, states: generate_moves_minimax_batch(boards, players, states, args.depth)),
+    }
+    positions = make_positions(max(args.sizes))
+    for name, (gen_move, gen_moves) in agents.items():
+        for size in args.sizes:
+            boards = np.stack([position.to_array() for position in positions[:size]])
+            players = np.array([position.player for position in positions[:size]])
+            per_board = moves_per_second(lambda *batch: generate_moves_batch(gen_move, *batch), boards, players)
+            batch = moves_per_second(gen_moves, boards, players)
+            print(f'{name:<18} batch of {size:4d}: {per_board:10.0f} moves/s per board, {batch:10.0f} moves/s batched')
+
+
+if __name__ == '__main__':
+    main()
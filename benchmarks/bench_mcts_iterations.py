@@ -0,0 +1,45 @@
+"""
+Micro-benchmark of MCTS iterations per second on the default 3000 simulation setup, for the
+object tree (MonteCarloTreeSearchNode) and the array tree (MCTSTree).
+
+    python -m benchmarks.bench_mcts_iterations [--simulations 3000] [--repeat 5]
+"""
+import argparse
+import random
+import time
+import numpy as np
+from agents.common import BitBoard, PLAYER1
+from agents.new_agent import mcts_agent
+
+
+def iterations_per_second(search, simulations: int, repeat: int) -> float:
+    """
+    Returns the best of `repeat` runs of `search(simulations)` in iterations per second.
+    """
+    best = 0.
+    for i in range(repeat):
+        random.seed(i)
+        mcts_agent._rng = np.random.default_rng(i)
+        t0 = time.perf_counter()
+        search(simulations)
+        best = max(best, simulations / (time.perf_counter() - t0))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--simulations', type=int, default=mcts_agent.SIMULATIONS)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    searches = {
+        'MonteCarloTreeSearchNode': lambda n: mcts_agent.MonteCarloTreeSearchNode(
+            BitBoard(), PLAYER1).best_simulated_action(simulation_no=n),
+        'MCTSTree': lambda n: mcts_agent.MCTSTree(BitBoard()).best_simulated_action(simulation_no=n),
+    }
+    for name, search in searches.items():
+        print(f'{name:<26} {iterations_per_second(search, args.simulations, args.repeat):10.0f} iterations/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""
+Scaling of the lazy SMP minimax search: nodes per second and the deepest completed depth
+within a fixed time, for a growing number of worker processes, on the benchmark suite
+positions.
+
+    python -m benchmarks.bench_parallel_minimax [--workers 1 2 4 8] [--time-limit 1.0]
+"""
+import argparse
+from agents.agent_minimax import minimax
+from benchmarks.suite import make_positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--time-limit', type=float, default=1.0)
+    parser.add_argument('--positions', type=int, default=8)
+    args = parser.parse_args()
+
+    positions = make_positions(args.positions)
+    for workers in args.workers:
+        collected = []
+        for position in positions:
+            minimax.generate_move_minimax(position.to_array(), position.player, None, args.time_limit,
+                                          stats_callback=collected.append, workers=workers)
+        nodes_per_second = sum(stats.nodes for stats in collected) / sum(stats.time for stats in collected)
+        mean_depth = sum(stats.depth for stats in collected) / len(collected)
+        print(f'{workers:2d} workers: {nodes_per_second:10.0f} nodes/s, mean depth {mean_depth:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Write and read throughput of the binary position records: a file of random positions is
+streamed to disk, then read back in batches of boards through the memory map.
+
+    python -m benchmarks.bench_records [--positions 1000000] [--batch 65536] [--path positions.bin]
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from agents.common import BOARD_MASK, BOTTOM_MASK
+from agents.records import PositionReader, PositionWriter, POSITION_DTYPE
+
+
+def random_records(n: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Returns `n` position records of random bitboards. They need not be reachable positions,
+    only the bytes matter for the throughput.
+    """
+    records = np.zeros(n, dtype=POSITION_DTYPE)
+    cells = rng.integers(0, 1 << 62, size=(n, 2), dtype=np.uint64) & np.uint64(BOARD_MASK & ~BOTTOM_MASK)
+    records['masks'][:, 0] = cells[:, 0]
+    records['masks'][:, 1] = cells[:, 1] & ~cells[:, 0]
+    records['to_move'] = rng.integers(1, 3, size=n)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--positions', type=int, default=1000000)
+    parser.add_argument('--batch', type=int, default=1 << 16)
+    parser.add_argument('--path', default=None, help='file to write, a temporary file by default')
+    args = parser.parse_args()
+
+    path = args.path or os.path.join(tempfile.mkdtemp(), 'positions.bin')
+    records = random_records(args.positions, np.random.default_rng(0))
+    t0 = time.perf_counter()
+    with PositionWriter(path) as writer:
+        for first in range(0, len(records), args.batch):
+            writer.write_records(records[first:first + args.batch])
+    write_time = time.perf_counter() - t0
+    size = os.path.getsize(path) / 1e6
+
+    reader = PositionReader(path)
+    t0 = time.perf_counter()
+    for records_batch in reader.record_batches(args.batch):
+        records_batch['to_move'].sum()
+    raw_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    n = 0
+    for boards, _ in reader.batches(args.batch):
+        n += len(boards)
+    board_time = time.perf_counter() - t0
+
+    print(f'{n} positions, {size:.1f} MB, {POSITION_DTYPE.itemsize} bytes per position')
+    print(f'write           {size / write_time:8.0f} MB/s {n / write_time:12.0f} positions/s')
+    print(f'read records    {size / raw_time:8.0f} MB/s {n / raw_time:12.0f} positions/s')
+    print(f'read as boards  {size / board_time:8.0f} MB/s {n / board_time:12.0f} positions/s')
+    if args.path is None:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
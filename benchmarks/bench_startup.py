@@ -0,0 +1,51 @@
+"""
+Cold-start time of a fresh interpreter that loads one agent through the registry, as paid by
+every CLI invocation and every arena or server worker, against the bare interpreter and
+numpy alone. Exits with status 1 if an agent misses COLD_START_TARGET.
+
+    python -m benchmarks.bench_startup [--repeat 10] [--agents random mcts]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from agents.registry import agent_names
+
+COLD_START_TARGET = 0.25  # seconds from interpreter start until an agent is loaded
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cold_start(code: str, repeat: int) -> float:
+    """
+    Returns the median wall time in seconds of running `code` in a new interpreter.
+    """
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--agents', nargs='+', default=agent_names(), choices=agent_names())
+    args = parser.parse_args()
+
+    print(f'{"interpreter":<20} {cold_start("pass", args.repeat) * 1000:8.1f} ms')
+    print(f'{"numpy":<20} {cold_start("import numpy", args.repeat) * 1000:8.1f} ms')
+    missed = []
+    for name in args.agents:
+        seconds = cold_start(f'from agents.registry import get_agent; get_agent({name!r})', args.repeat)
+        if seconds > COLD_START_TARGET:
+            missed.append(name)
+        print(f'{"agent " + name:<20} {seconds * 1000:8.1f} ms')
+    print(f'target {COLD_START_TARGET * 1000:.0f} ms: ' + (f'missed by {", ".join(missed)}' if missed else 'met'))
+    sys.exit(1 if missed else 0)
+
+
+if __name__ == '__main__':
+    main()
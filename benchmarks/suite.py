@@ -0,0 +1,246 @@
+"""
+Reproducible benchmark suite for the game primitives and the search agents. Results are
+written as JSON and compared against a stored baseline; any metric worse than the baseline by
+more than the tolerance is reported and makes the run exit with status 1.
+
+    python -m benchmarks.suite --output bench.json
+    python -m benchmarks.suite --update-baseline --runs 5
+
+The speed of a shared machine drifts by tens of percent between runs, so the tolerance is wide
+and the baseline should be the median of several runs.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from typing import Callable, List
+import numpy as np
+from agents.common import BitBoard, BoardPiece, PlayerAction, apply_player_action, connected_four, \
+    check_end_state, get_valid_columns
+from agents.agent_minimax import minimax
+from agents.new_agent import mcts_agent
+
+SEED = 2021
+N_POSITIONS = 64
+MIN_TIME = 0.5  # seconds every primitive is timed for, per repeat
+REPEAT = 5  # runs per measurement, the median is kept
+TOLERANCE = 0.5
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+MINIMAX_DEPTHS = (4, 6)
+MCTS_SIMULATIONS = (300, 1000)
+AGENT_POSITIONS = 16  # positions every agent budget is timed on
+
+
+def make_positions(n: int = N_POSITIONS, seed: int = SEED) -> List[BitBoard]:
+    """
+    Returns `n` positions reached by random play from the empty board, with 0 to 30 pieces,
+    none of them won or full. The same seed always gives the same positions.
+    """
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < n:
+        position = BitBoard()
+        for _ in range(rng.randrange(31)):
+            position.play(rng.choice(position.valid_columns()))
+            if position.last_move_won():
+                break
+        else:
+            positions.append(position)
+    return positions
+
+
+class CountingBitBoard(BitBoard):
+    """
+    BitBoard counting the moves played on it, i.e. the nodes a search visits.
+    """
+    __slots__ = ('plays',)
+
+    def play(self, col: int):
+        self.plays += 1
+        BitBoard.play(self, col)
+
+
+def counting_copy(position: BitBoard) -> CountingBitBoard:
+    counting = CountingBitBoard.__new__(CountingBitBoard)
+    counting.masks = position.masks[:]
+    counting.heights = position.heights[:]
+    counting.moves = []
+    counting.turn = position.turn
+    counting.hashes = position.hashes[:]
+    counting.plays = 0
+    return counting
+
+
+def ops_per_second(func: Callable, calls: list) -> float:
+    """
+    Calls func(*args) for every args in `calls`, over and over for MIN_TIME seconds, and
+    returns the median of REPEAT runs in calls per second.
+    """
+    rates = []
+    for _ in range(REPEAT):
+        n = 0
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < MIN_TIME:
+            for args in calls:
+                func(*args)
+            n += len(calls)
+        rates.append(n / (time.perf_counter() - t0))
+    return float(np.median(rates))
+
+
+def latency_percentiles(latencies: list) -> dict:
+    latencies_ms = np.array(latencies) * 1000
+    return {f'p{q}': float(np.percentile(latencies_ms, q)) for q in (50, 90, 99)}
+
+
+def bench_primitives(positions: List[BitBoard]) -> dict:
+    boards = [position.to_array() for position in positions]
+    players = [position.player for position in positions]
+    last_movers = [BoardPiece(3 - player) for player in players]
+    actions = [PlayerAction(position.valid_columns()[0]) for position in positions]
+    return {
+        'apply_player_action': ops_per_second(
+            apply_player_action, [(board, action, player, True) for board, action, player in zip(boards, actions, players)]),
+        'connected_four': ops_per_second(connected_four, list(zip(boards, last_movers))),
+        'check_end_state': ops_per_second(check_end_state, list(zip(boards, last_movers))),
+        'get_valid_columns': ops_per_second(get_valid_columns, [(board,) for board in boards]),
+        'board_heuristic': ops_per_second(minimax.board_heuristic, list(zip(boards, players))),
+    }
+
+
+def bench_minimax(positions: List[BitBoard], depth: int) -> dict:
+    """
+    Searches every position to `depth` REPEAT times, with the move ordering of the agent, and
+    keeps the median run per position.
+    """
+    nodes, latencies = 0, []
+    for position in positions:
+        runs = []
+        for _ in range(REPEAT):
+            counting = counting_copy(position)
+            tt, ordering = minimax.TranspositionTable(), minimax.MoveOrdering()
+            t0 = time.perf_counter()
+            minimax.iterative_deepening(counting, counting.player, tt, None, depth, ordering=ordering)
+            runs.append(time.perf_counter() - t0)
+        latencies.append(float(np.median(runs)))
+        nodes += counting.plays
+    return {'nodes_per_second': nodes / sum(latencies), 'latency_ms': latency_percentiles(latencies)}
+
+
+def bench_mcts(positions: List[BitBoard], simulations: int) -> dict:
+    """
+    Runs `simulations` iterations from every position REPEAT times and keeps the median run
+    per position. Nodes per second counts iterations.
+    """
+    latencies = []
+    for position in positions:
+        runs = []
+        for _ in range(REPEAT):
+            t0 = time.perf_counter()
+            mcts_agent.MCTSTree(position).best_simulated_action(simulation_no=simulations)
+            runs.append(time.perf_counter() - t0)
+        latencies.append(float(np.median(runs)))
+    return {'nodes_per_second': simulations * len(positions) / sum(latencies),
+            'latency_ms': latency_percentiles(latencies)}
+
+
+def run_suite() -> dict:
+    random.seed(SEED)
+    np.random.seed(SEED)
+    mcts_agent._rng = np.random.default_rng(SEED)
+    positions = make_positions()
+    agent_positions = positions[:AGENT_POSITIONS]
+    agents = {}
+    for depth in MINIMAX_DEPTHS:
+        agents[f'minimax_depth_{depth}'] = bench_minimax(agent_positions, depth)
+    for simulations in MCTS_SIMULATIONS:
+        agents[f'mcts_{simulations}'] = bench_mcts(agent_positions, simulations)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'seed': SEED,
+        },
+        'primitives': bench_primitives(positions),
+        'agents': agents,
+    }
+
+
+def median_results(runs: List[dict]) -> dict:
+    """
+    Returns the results of the first of `runs` with every metric replaced by its median over
+    all of them.
+    """
+    def merge(values):
+        if isinstance(values[0], dict):
+            return {key: merge([value[key] for value in values]) for key in values[0]}
+        return float(np.median(values))
+
+    return {'meta': {**runs[0]['meta'], 'runs': len(runs)},
+            'primitives': merge([run['primitives'] for run in runs]),
+            'agents': merge([run['agents'] for run in runs])}
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> List[str]:
+    """
+    Returns a message for every metric of `results` that is worse than in `baseline` by more
+    than `tolerance`: throughput lower than (1 - tolerance) times the baseline or latency
+    higher than (1 + tolerance) times the baseline.
+    """
+    regressions = []
+    for name, value in baseline.get('primitives', {}).items():
+        current = results['primitives'].get(name)
+        if current is not None and current < value * (1 - tolerance):
+            regressions.append(f'{name}: {current:.0f} ops/s, baseline {value:.0f} ops/s')
+    for name, metrics in baseline.get('agents', {}).items():
+        current = results['agents'].get(name)
+        if current is None:
+            continue
+        if current['nodes_per_second'] < metrics['nodes_per_second'] * (1 - tolerance):
+            regressions.append(f"{name}: {current['nodes_per_second']:.0f} nodes/s, "
+                               f"baseline {metrics['nodes_per_second']:.0f} nodes/s")
+        for q, value in metrics['latency_ms'].items():
+            if current['latency_ms'][q] > value * (1 + tolerance):
+                regressions.append(f"{name}: {q} latency {current['latency_ms'][q]:.1f} ms, baseline {value:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', default=None, help='file to write the results to as JSON')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--runs', type=int, default=1, help='runs of the suite to take the median of')
+    parser.add_argument('--update-baseline', action='store_true', help='store the results as the new baseline')
+    args = parser.parse_args()
+
+    results = run_suite() if args.runs <= 1 else median_results([run_suite() for _ in range(args.runs)])
+    text = json.dumps(results, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(text + '\n')
+        return
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, nothing to compare against', file=sys.stderr)
+        return
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print(f'PERFORMANCE REGRESSION, {len(regressions)} metrics worse than the baseline '
+              f'by more than {args.tolerance:.0%}:', file=sys.stderr)
+        for regression in regressions:
+            print(f'  {regression}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,7 @@
 import numpy as np
 from typing import Optional, Callable
 from agents.common import PlayerAction, BoardPiece, SavedState, GenMove
-from agents.agent_random import generate_move
-from agents.agent_minimax import gen_move_minimax
-from agents.new_agent import gen_move_mcts
+from agents.registry import get_agent
 
 
 def user_move(board: np.ndarray, _player: BoardPiece, saved_state: Optional[SavedState]):
@@ -20,8 +18,8 @@ def user_move(board: np.ndarray, _player: BoardPiece, saved_state: Optional[Save
 def human_vs_agent(
     generate_move_1: GenMove = user_move,
 # generate_move_2: GenMove = user_move,
-# generate_move_2: GenMove = gen_move_minimax,
-    generate_move_2: GenMove = gen_move_mcts,
+# generate_move_2: GenMove = get_agent('minimax'),
+    generate_move_2: Optional[GenMove] = None,
     player_1: str = "Player 1",
     player_2: str = "Player 2",
     args_1: tuple = (),
@@ -33,6 +31,8 @@ def human_vs_agent(
     from agents.common import PLAYER1, PLAYER2, PLAYER1_PRINT, PLAYER2_PRINT, GameState
     from agents.common import initialize_game_state, pretty_print_board, apply_player_action, check_end_state
 
+    if generate_move_2 is None:
+        generate_move_2 = get_agent('mcts')
     players = (PLAYER1, PLAYER2)
     for play_first in (1, -1):
         for init, player in zip((init_1, init_2)[::play_first], players):
@@ -59,7 +59,7 @@ def human_vs_agent(
                 )
                 print(f"Move time: {time.time() - t0:.3f}s")
                 apply_player_action(board, action, player)
-                end_state = check_end_state(board, player)
+                end_state = check_end_state(board, player, action)
                 if end_state != GameState.STILL_PLAYING:
                     print(pretty_print_board(board))
                     if end_state == GameState.IS_DRAW:
@@ -74,6 +74,6 @@ def human_vs_agent(
 
 if __name__ == "__main__":
     # human_vs_agent(user_move)
-    # human_vs_agent(generate_move)
-    # human_vs_agent(gen_move_minimax)
-    human_vs_agent(user_move,gen_move_mcts)
+    # human_vs_agent(get_agent('random'))
+    # human_vs_agent(get_agent('minimax'))
+    human_vs_agent(user_move, get_agent('mcts'))
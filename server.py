@@ -0,0 +1,293 @@
+"""
+Local game server: hosts many concurrent games between clients and the agents over a line
+delimited JSON protocol on TCP or a Unix socket, with the agents' moves computed in worker
+processes so the event loop never blocks.
+
+    python server.py --port 4000 --workers 4 --deadline 1.0
+    python server.py --unix /tmp/connect4.sock
+
+Every request is one JSON object on a line and is answered by one JSON object on a line,
+carrying the request's "id" if it had one:
+
+    {"op": "new_game", "agent": "mcts", "agent_player": 2, "deadline": 0.5}
+    {"op": "move", "game": "1", "column": 3}
+    {"op": "state", "game": "1"}
+    {"op": "close", "game": "1"}
+
+Answers hold "ok" and either "error" or the game: its id, the board as a list of rows with
+row 0 at the bottom, the player to move, "result" ("playing", "win" or "draw"), the
+"winner" (1, 2 or null) and the "agent_move" if the agent moved in answer to the request.
+The agent moves first if it plays PLAYER1. A game's deadline is clamped to MIN_DEADLINE to
+MAX_DEADLINE seconds. An agent that misses the deadline plays a random column instead
+("timeout": true); one that returns an illegal column loses the game. A client's games are
+closed when it disconnects.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+import numpy as np
+from agents.common import BoardPiece, GameState, PLAYER1, PLAYER2, initialize_game_state, apply_player_action, \
+    check_end_state, get_valid_columns
+from agents.registry import agent_names, get_agent, time_limit_kwargs
+
+MOVE_DEADLINE = 1.0  # seconds per agent move
+MIN_DEADLINE = 0.05  # range the deadline a client asks for is clamped to, in seconds
+MAX_DEADLINE = 60.0
+DEADLINE_GRACE = 1.0  # seconds an agent may overrun its deadline before its move is replaced
+RESULTS = {GameState.STILL_PLAYING: 'playing', GameState.IS_WIN: 'win', GameState.IS_DRAW: 'draw'}
+
+# saved states of the games played in a worker process, by game id
+_sessions = {}
+
+
+def worker_move(agent: str, game: str, board: np.ndarray, player: int,
+                time_limit: Optional[float]) -> Tuple[int, float]:
+    """
+    Runs in a worker process: generates the move of `agent` with the saved state this process
+    keeps for `game`. The agent is imported by the first move that needs it. Returns the column
+    and the seconds the move took, not counting the time the job waited for the worker.
+    """
+    t0 = time.perf_counter()
+    gen_move = get_agent(agent)
+    action, _sessions[game] = gen_move(board, BoardPiece(player), _sessions.get(game),
+                                       **time_limit_kwargs(agent, time_limit))
+    return int(action), time.perf_counter() - t0
+
+
+def worker_close(game: str):
+    _sessions.pop(game, None)
+
+
+class Game:
+    """
+    A game between a client and an agent. All games are played by the same worker process,
+    which keeps the agent's saved state between moves.
+    """
+
+    def __init__(self, game_id: str, agent: str, agent_player: BoardPiece, deadline: float, worker: int):
+        self.id = game_id
+        self.agent = agent
+        self.agent_player = agent_player
+        self.deadline = deadline
+        self.worker = worker
+        self.board = initialize_game_state()
+        self.to_move = PLAYER1
+        self.end_state = GameState.STILL_PLAYING
+        self.winner = None
+        self.lock = asyncio.Lock()
+
+    def play(self, column: int):
+        player = self.to_move
+        apply_player_action(self.board, column, player)
+        self.end_state = check_end_state(self.board, player, column)
+        if self.end_state == GameState.IS_WIN:
+            self.winner = int(player)
+        self.to_move = PLAYER2 if player == PLAYER1 else PLAYER1
+
+    def forfeit(self, player: BoardPiece):
+        self.end_state = GameState.IS_WIN
+        self.winner = 3 - int(player)
+
+    def to_json(self) -> dict:
+        return {
+            'game': self.id,
+            'board': self.board.tolist(),
+            'to_move': int(self.to_move),
+            'result': RESULTS[self.end_state],
+            'winner': self.winner,
+        }
+
+
+class GameServer:
+    """
+    Serves the protocol described in the module docstring. Every worker is a process pool of
+    its own, so the saved states of a game stay in the one process that plays it; games are
+    spread over the workers round robin.
+    """
+
+    def __init__(self, workers: int = 1, deadline: float = MOVE_DEADLINE):
+        self.deadline = deadline
+        self.executors = [ProcessPoolExecutor(max_workers=1) for _ in range(workers)]
+        # seconds the agent moves queued on or running in every worker may take at most
+        self.backlog = [0.] * workers
+        self.games = {}
+        self._ids = itertools.count(1)
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run_in_worker(self, game: Game, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executors[game.worker], func, *args)
+
+    async def agent_move(self, game: Game) -> dict:
+        """
+        Lets the agent of `game` move and returns what the answer reports about the move.
+        """
+        player = game.to_move
+        valid_columns = get_valid_columns(game.board)
+        report = {}
+        allowed = game.deadline + DEADLINE_GRACE
+        # the move waits for the moves queued before it on the worker, only its own run counts
+        # against its deadline
+        timeout = self.backlog[game.worker] + allowed
+        self.backlog[game.worker] += allowed
+        try:
+            column, seconds = await asyncio.wait_for(
+                self.run_in_worker(game, worker_move, game.agent, game.id, game.board.copy(), int(player),
+                                   game.deadline),
+                timeout)
+            timed_out = seconds > allowed
+        except asyncio.TimeoutError:
+            # wait_for cancels the job, so a move still queued is never run
+            timed_out = True
+        finally:
+            self.backlog[game.worker] -= allowed
+        if timed_out:
+            column = random.choice(valid_columns)
+            report['timeout'] = True
+        report['agent_move'] = column
+        if column not in valid_columns:
+            game.forfeit(player)
+        else:
+            game.play(column)
+        return report
+
+    async def new_game(self, request: dict, owned: set) -> dict:
+        agent = request.get('agent', 'mcts')
+        if agent not in agent_names():
+            raise ValueError(f'unknown agent {agent!r}, choose from {agent_names()}')
+        agent_player = request.get('agent_player', int(PLAYER2))
+        # checked before the conversion, BoardPiece would take true for 1 and fail on 300
+        if type(agent_player) is not int or agent_player not in (PLAYER1, PLAYER2):
+            raise ValueError('agent_player must be 1 or 2')
+        agent_player = BoardPiece(agent_player)
+        deadline = request.get('deadline', self.deadline)
+        if type(deadline) not in (int, float) or not math.isfinite(deadline) or deadline <= 0:
+            raise ValueError('deadline must be a positive number of seconds')
+        deadline = min(max(float(deadline), MIN_DEADLINE), MAX_DEADLINE)
+        game_id = str(next(self._ids))
+        game = Game(game_id, agent, agent_player, deadline, (int(game_id) - 1) % len(self.executors))
+        self.games[game_id] = game
+        owned.add(game_id)
+        report = {}
+        if agent_player == PLAYER1:
+            async with game.lock:
+                report = await self.agent_move(game)
+        return {**game.to_json(), **report}
+
+    def get_game(self, request: dict, owned: set) -> Game:
+        game_id = str(request.get('game'))
+        if game_id not in owned:
+            raise ValueError(f'no game {game_id!r}')
+        return self.games[game_id]
+
+    async def move(self, request: dict, owned: set) -> dict:
+        game = self.get_game(request, owned)
+        async with game.lock:
+            if game.end_state != GameState.STILL_PLAYING:
+                raise ValueError('the game is over')
+            if game.to_move == game.agent_player:
+                raise ValueError('it is the agent\'s turn')
+            column = request.get('column')
+            # true and false are ints to isinstance, a column has to be a JSON number
+            if type(column) is not int or column not in get_valid_columns(game.board):
+                raise ValueError(f'illegal column {column!r}')
+            game.play(column)
+            report = {}
+            if game.end_state == GameState.STILL_PLAYING:
+                report = await self.agent_move(game)
+            return {**game.to_json(), **report}
+
+    async def close(self, game_id: str, owned: set):
+        game = self.games.pop(game_id)
+        owned.discard(game_id)
+        await self.run_in_worker(game, worker_close, game_id)
+
+    async def answer(self, request: dict, owned: set) -> dict:
+        op = request.get('op')
+        if op == 'new_game':
+            return await self.new_game(request, owned)
+        if op == 'move':
+            return await self.move(request, owned)
+        if op == 'state':
+            return self.get_game(request, owned).to_json()
+        if op == 'close':
+            game = self.get_game(request, owned)
+            await self.close(game.id, owned)
+            return {'game': game.id}
+        raise ValueError(f'unknown op {op!r}')
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Answers the requests of one connection in order and closes its games when it is gone.
+        """
+        owned = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = {}
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('a request must be a JSON object')
+                    response = {'ok': True, **await self.answer(request, owned)}
+                except (ValueError, TypeError) as error:
+                    response = {'ok': False, 'error': str(error)}
+                if 'id' in request:
+                    response['id'] = request['id']
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            for game_id in list(owned):
+                await self.close(game_id, owned)
+            writer.close()
+
+
+async def start_server(game_server: GameServer, host: str = '127.0.0.1', port: int = 4000,
+                       unix: Optional[str] = None) -> asyncio.AbstractServer:
+    """
+    Starts serving `game_server` on a Unix socket at path `unix` if given, on TCP otherwise.
+    """
+    if unix is not None:
+        return await asyncio.start_unix_server(game_server.handle_client, path=unix)
+    return await asyncio.start_server(game_server.handle_client, host, port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=4000)
+    parser.add_argument('--unix', default=None, help='serve on a Unix socket at this path instead of TCP')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--deadline', type=float, default=MOVE_DEADLINE, help='default seconds per agent move')
+    args = parser.parse_args()
+
+    async def serve():
+        game_server = GameServer(args.workers, args.deadline)
+        server = await start_server(game_server, args.host, args.port, args.unix)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            game_server.shutdown()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()